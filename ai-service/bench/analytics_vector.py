@@ -0,0 +1,213 @@
+# ai_service/bench/analytics_vector.py
+# So sánh tốc độ phần tính toán analytics: vòng lặp Python từng dòng (cách cũ) với bản numpy hiện tại,
+# trên dữ liệu sinh giả (không cần MySQL) và kiểm tra 2 cách cho cùng kết quả.
+#   python bench/analytics_vector.py --products 100000 --interactions 1000000
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVICE_DIR)
+os.environ.setdefault("JOB_SCHEDULER", "0")
+
+import db  # noqa: E402
+import main  # noqa: E402
+import revenue  # noqa: E402
+import cart_counters  # noqa: E402
+from catalog import CatalogSnapshot  # noqa: E402
+
+
+# ---------- cách cũ (giữ lại để so sánh) ----------
+def legacy_cart_insights(snapshot, counts):
+    cart_data = []
+    for pid, (adds, removes, _views) in counts.items():
+        product = snapshot.get(pid)
+        if product is None:
+            continue
+        cart_data.append({"id": product['id'], "name": product['name'], "price": product['price'],
+                          "image": product['image'], "adds_count": adds, "removes_count": removes})
+    trending, flashsale = [], []
+    for item in cart_data:
+        adds, removes = int(item['adds_count']), int(item['removes_count'])
+        if adds + removes == 0:
+            continue
+        abandon_rate = (removes / adds) * 100 if adds > 0 else 100
+        if adds >= 5 and abandon_rate < 30:
+            item['reason'] = f"Được thêm {adds} lần, giữ lại giỏ hàng tốt."
+            trending.append(item)
+        elif removes >= 3 and abandon_rate >= 50:
+            item['abandon_rate'] = round(abandon_rate, 1)
+            item['reason'] = f"Tỷ lệ bỏ giỏ: {round(abandon_rate, 1)}% ({removes} lần xoá). Cần giảm giá!"
+            flashsale.append(item)
+    return {
+        "trending": sorted(trending, key=lambda x: x['adds_count'], reverse=True)[:10],
+        "flashsale_needed": sorted(flashsale, key=lambda x: x['removes_count'], reverse=True)[:10],
+    }
+
+
+def legacy_cart_ingest(counters, rows, now_hour):
+    for _, pid, action, created in rows:
+        idx = cart_counters.ACTIONS.get(action)
+        if idx is None:
+            continue
+        counts = [0, 0, 0]
+        counts[idx] = 1
+        cart_counters._add(counters.totals["all"], pid, counts)
+        hour = cart_counters._hour(created)
+        if hour > now_hour - cart_counters.MAX_WINDOW_HOURS:
+            cart_counters._add(counters.hourly.setdefault(hour, {}), pid, counts)
+            for w, hours in cart_counters.WINDOWS.items():
+                if hour > now_hour - hours:
+                    cart_counters._add(counters.totals[w], pid, counts)
+
+
+def legacy_revenue_fold(rollup, rows):
+    for _, created, amount, status, paid in rows:
+        if status == 'COMPLETED' or paid == 'PAID':
+            key = (created.year, created.month)
+            rollup.monthly[key] = rollup.monthly.get(key, 0.0) + float(amount)
+            rollup.daily[created.date()] = rollup.daily.get(created.date(), 0.0) + float(amount)
+
+
+# ---------- dữ liệu giả ----------
+def make_catalog(n):
+    rows = [{"id": i, "name": f"Sản phẩm {i}", "price": 1000.0 * (i % 500 + 1), "stock": i % 50,
+             "category": f"cat{i % 20}", "image": f"https://img/{i}.jpg", "description": "", "createdAt": None}
+            for i in range(1, n + 1) if i % 11]   # 1 phần sản phẩm đã bị xoá khỏi danh mục
+    return CatalogSnapshot(rows, version=1)
+
+
+def make_interactions(n, products, now):
+    rng = random.Random(1)
+    actions = ("ADD_TO_CART", "ADD_TO_CART", "REMOVE_FROM_CART", "VIEW", "VIEW", "PURCHASE")
+    return [(i, rng.randrange(1, products + 1), rng.choice(actions), now - timedelta(minutes=rng.randrange(60 * 24 * 60)))
+            for i in range(1, n + 1)]
+
+
+def make_orders(n, now):
+    rng = random.Random(2)
+    return [(i, now - timedelta(minutes=rng.randrange(60 * 24 * 730)), rng.uniform(1e5, 5e6),
+             rng.choice(("COMPLETED", "PENDING", "SHIPPING", "CANCELLED")), rng.choice(("PAID", "UNPAID")))
+            for i in range(1, n + 1)]
+
+
+def _chunks(rows, schema, size):
+    return [db._to_columns(rows[i:i + size], schema) for i in range(0, len(rows), size)]
+
+
+def _timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def _fresh_counters(now_hour):
+    counters = cart_counters.CartCounters()
+    counters.bootstrapped = True
+    for w, hours in cart_counters.WINDOWS.items():
+        counters.window_start[w] = now_hour - hours + 1
+    return counters
+
+
+def run(args):
+    now = datetime.now()
+    now_hour = cart_counters._hour(now)
+    snapshot = make_catalog(args.products)
+    interactions = make_interactions(args.interactions, args.products, now)
+    orders = make_orders(args.orders, now)
+    # Phần chuyển dòng -> cột do db.iter_columns làm lúc đọc MySQL, không tính vào đây
+    interaction_chunks = _chunks(interactions, cart_counters.INTERACTION_SCHEMA, args.chunk)
+    order_chunks = _chunks(orders, revenue.ORDER_SCHEMA, args.chunk)
+    results = {}
+
+    def ingest_legacy():
+        counters = _fresh_counters(now_hour)
+        legacy_cart_ingest(counters, interactions, now_hour)
+        return counters
+
+    def ingest_vector():
+        counters = _fresh_counters(now_hour)
+        for chunk in interaction_chunks:
+            counters._ingest(chunk, now_hour, count_all=True)
+        return counters
+
+    old, t_old = _timed(ingest_legacy, args.repeat)
+    new, t_new = _timed(ingest_vector, args.repeat)
+    results["cart_ingest"] = (t_old, t_new, old.totals == new.totals and old.hourly == new.hourly)
+
+    main.cart_counters.counters = new
+    same, t_old, t_new = True, 0.0, 0.0
+    for window in ("all", *cart_counters.WINDOWS):
+        a, ta = _timed(lambda: legacy_cart_insights(snapshot, new.counts(window)), args.repeat)
+        b, tb = _timed(lambda: main._cart_window_insights(snapshot, window), args.repeat)
+        same, t_old, t_new = same and a == b, t_old + ta, t_new + tb
+    results["cart_insights"] = (t_old, t_new, same)
+
+    def fold_legacy():
+        rollup = revenue.RevenueRollup()
+        legacy_revenue_fold(rollup, orders)
+        return rollup
+
+    def fold_vector():
+        rollup = revenue.RevenueRollup()
+        for chunk in order_chunks:
+            rollup._fold_orders(chunk, revenue._is_revenue(chunk))
+        return rollup
+
+    old, t_old = _timed(fold_legacy, args.repeat)
+    new, t_new = _timed(fold_vector, args.repeat)
+    same = (old.daily.keys() == new.daily.keys() and old.monthly.keys() == new.monthly.keys()
+            and all(abs(old.monthly[k] - new.monthly[k]) < 1e-6 * max(1.0, old.monthly[k]) for k in old.monthly))
+    results["revenue_fold"] = (t_old, t_new, same)
+
+    report = {}
+    for name, (t_old, t_new, same) in results.items():
+        report[name] = {"loop_ms": round(t_old * 1000, 1), "vector_ms": round(t_new * 1000, 1),
+                        "speedup": round(t_old / t_new, 1) if t_new else None, "same_result": same}
+        print(f"{name:14s} vòng lặp {t_old * 1000:>9.1f} ms  numpy {t_new * 1000:>8.1f} ms  "
+              f"x{report[name]['speedup']}  {'khớp' if same else 'KHÁC KẾT QUẢ'}")
+    return report
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Vòng lặp Python vs numpy cho cart-insights / revenue")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--interactions", type=int, default=1_000_000)
+    parser.add_argument("--orders", type=int, default=200_000)
+    parser.add_argument("--chunk", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"))
+    args = parser.parse_args()
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _git_commit(), "args": vars(args)},
+        "analytics_vector": run(args),
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"analytics-{report['meta']['timestamp'].replace(':', '')}-{report['meta']['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu kết quả: {path}")
+    if not all(r["same_result"] for r in report["analytics_vector"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,151 @@
+# ai_service/bench/gemini_stub.py
+# Server Gemini giả lập (generateContent + streamGenerateContent?alt=sse) với độ trễ/tỉ lệ lỗi tuỳ chỉnh
+#   python bench/gemini_stub.py --port 8790 --latency-ms 400 --jitter-ms 100
+#   GEMINI_BASE_URL=http://127.0.0.1:8790/v1beta uvicorn main:app
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAT_REPLY = ("Chào bạn! Shop gợi ý mẫu này rất hợp với nhu cầu của bạn, chất vải thoáng mát và dễ phối đồ. "
+              "Bạn có thể xem chi tiết sản phẩm ở đường link bên dưới nhé.")
+
+
+class StubConfig:
+    def __init__(self, latency_ms=300.0, jitter_ms=0.0, error_rate=0.0, stream_chunks=4):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def delay(self):
+        return max(self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0) / 1000
+
+    def count(self, error):
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+
+
+def _prompt_text(body):
+    texts = []
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                texts.append(part["text"])
+    return texts
+
+
+def _has_image(body):
+    return any("inline_data" in part for c in body.get("contents", []) for part in c.get("parts", []))
+
+
+def build_reply(body):
+    """Câu trả lời giả có cùng định dạng mà từng tính năng của ai-service mong đợi"""
+    texts = _prompt_text(body)
+    prompt = texts[-1] if texts else ""
+    if "Sentiment Analysis" in prompt:
+        # Lấy id từ mảng JSON review đầu vào, gán nhãn theo id cho ổn định giữa các lần chạy
+        payload = prompt.split("Dữ liệu đầu vào:", 1)[-1]
+        ids = [int(i) for i in re.findall(r'"id":\s*(\d+)', payload)]
+        labels = ["Tích cực", "Tiêu cực", "Trung lập"]
+        return json.dumps([{"id": i, "sentiment": labels[i % 3]} for i in ids], ensure_ascii=False)
+    if _has_image(body):
+        ids = [int(i) for i in re.findall(r'"id":\s*(\d+)', prompt)]
+        return json.dumps(ids[:4])
+    return CHAT_REPLY
+
+
+def _candidate(text):
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, payload):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.startswith("/stats"):
+                return self._send_json(200, {"requests": config.requests, "errors": config.errors})
+            self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            fail = random.random() < config.error_rate
+            config.count(fail)
+            delay = config.delay()
+
+            if fail:
+                time.sleep(delay)
+                return self._send_json(503, {"error": {"message": "stub overloaded", "status": "UNAVAILABLE"}})
+
+            reply = build_reply(body)
+            if ":streamGenerateContent" not in self.path:
+                time.sleep(delay)
+                return self._send_json(200, _candidate(reply))
+
+            # SSE: đoạn đầu tới sau ~1/2 độ trễ (time-to-first-token), phần còn lại rải đều
+            n = max(config.stream_chunks, 1)
+            size = -(-len(reply) // n)
+            chunks = [reply[i:i + size] for i in range(0, len(reply), size)]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(delay / 2)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    time.sleep(delay / 2 / max(len(chunks) - 1, 1))
+                event = f"data: {json.dumps(_candidate(chunk), ensure_ascii=False)}\r\n\r\n".encode("utf-8")
+                self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8790, config=None):
+    """Chạy server ở thread nền, trả về (server, config); gọi server.shutdown() để dừng"""
+    config = config or StubConfig()
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="gemini-stub", daemon=True).start()
+    return server, config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server Gemini giả lập cho benchmark")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+    server, _ = serve(args.host, args.port, StubConfig(args.latency_ms, args.jitter_ms, args.error_rate))
+    print(f"Gemini stub: http://{args.host}:{args.port}/v1beta")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
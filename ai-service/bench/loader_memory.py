@@ -0,0 +1,146 @@
+# ai_service/bench/loader_memory.py
+# So sánh đỉnh RAM + thời gian khi nạp dữ liệu phân tích: fetch_all (list dict) -> DataFrame
+# với db.fetch_columns (cursor không buffer, đọc theo lô vào mảng numpy) -> DataFrame.
+# Mỗi lần đo chạy trong 1 process riêng để đỉnh RSS (ru_maxrss) không bị lần đo trước ảnh hưởng.
+#   python bench/loader_memory.py --database shop_ai_bench_large        (database đã seed bằng seed.py/run.py)
+#   python bench/loader_memory.py --synthetic 2000000                   (không cần MySQL, dòng sinh giả)
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import subprocess
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVICE_DIR)
+
+MODES = ("dicts", "columns")
+QUERIES = ("orders", "rfm")
+
+
+def _query(name):
+    import revenue
+    import segmentation
+    if name == "orders":
+        return f"SELECT {revenue.ORDER_COLUMNS} FROM `Order` ORDER BY id", (), revenue.ORDER_SCHEMA
+    return segmentation.RFM_SQL.format(where=""), (), segmentation.RFM_SCHEMA
+
+
+def _synthetic_rows(query, n):
+    """Dòng dạng tuple giống cursor MySQL trả về"""
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    for i in range(1, n + 1):
+        created = start + timedelta(seconds=rng.randrange(365 * 86400))
+        if query == "orders":
+            yield (i, created, rng.uniform(1e5, 5e6), rng.choice(("COMPLETED", "PENDING", "CANCELLED")),
+                   rng.choice(("PAID", "UNPAID")))
+        else:
+            yield (i, rng.randrange(1, 50), rng.uniform(1e5, 5e7), created)
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def child(mode, query, synthetic, chunk_size):
+    import pandas as pd
+    import db
+    sql, params, schema = _query(query)
+    baseline = _peak_rss_mb()
+    t0 = time.perf_counter()
+    if synthetic:
+        rows = _synthetic_rows(query, synthetic)
+        if mode == "dicts":
+            names = list(schema)
+            df = pd.DataFrame([dict(zip(names, row)) for row in rows])
+        else:
+            columns = db.concat_columns((db._to_columns(chunk, schema) for chunk in _chunks(rows, chunk_size)),
+                                        schema, chunk_size)
+            df = pd.DataFrame(columns)
+    elif mode == "dicts":
+        df = pd.DataFrame(db.fetch_all(sql, params))
+    else:
+        df = pd.DataFrame(db.fetch_columns(sql, params, schema, chunk_size))
+    seconds = time.perf_counter() - t0
+    return {
+        "rows": len(df),
+        "seconds": round(seconds, 3),
+        "baseline_rss_mb": round(baseline, 1),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "peak_delta_mb": round(_peak_rss_mb() - baseline, 1),
+        "frame_mb": round(df.memory_usage(deep=True).sum() / 1024 / 1024, 1),
+    }
+
+
+def run_child(mode, query, args):
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", mode, query,
+           "--synthetic", str(args.synthetic), "--chunk", str(args.chunk)]
+    env = dict(os.environ, MYSQL_DATABASE=args.database) if args.database else None
+    out = subprocess.check_output(cmd, cwd=SERVICE_DIR, env=env, text=True)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đỉnh RAM khi nạp dữ liệu phân tích: list dict vs mảng cột")
+    parser.add_argument("--queries", default=",".join(QUERIES), type=lambda s: [x for x in s.split(",") if x])
+    parser.add_argument("--database", help="MYSQL_DATABASE cho process đo (vd. shop_ai_bench_large)")
+    parser.add_argument("--synthetic", type=int, default=0, help="số dòng sinh giả thay cho MySQL (0 = dùng MySQL)")
+    parser.add_argument("--chunk", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "QUERY"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(*args.child, args.synthetic, args.chunk)))
+        return
+
+    results = {}
+    for query in args.queries:
+        for mode in MODES:
+            runs = [run_child(mode, query, args) for _ in range(args.repeat)]
+            best = min(runs, key=lambda r: r["peak_delta_mb"])
+            results[f"{query}:{mode}"] = best
+            print(f"{query:8s} {mode:8s} {best['rows']:>9d} dòng  {best['seconds']:>7.2f}s  "
+                  f"RSS đỉnh +{best['peak_delta_mb']:>7.1f} MB  (DataFrame {best['frame_mb']} MB)")
+        old, new = results[f"{query}:dicts"], results[f"{query}:columns"]
+        if new["peak_delta_mb"]:
+            print(f"{query:8s} RAM đỉnh giảm {old['peak_delta_mb'] / new['peak_delta_mb']:.1f}x, "
+                  f"thời gian {old['seconds']:.2f}s -> {new['seconds']:.2f}s")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _git_commit(), "args": vars(args)},
+        "loader_memory": results,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"loader-{report['meta']['timestamp'].replace(':', '')}-{report['meta']['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu kết quả: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+# ai_service/bench/run.py
+# Benchmark các endpoint ai-service trên dữ liệu giả lập: seed MySQL -> chạy Gemini giả -> bật uvicorn -> đo
+#   python bench/run.py --scales small,medium --requests 200 --concurrency 8
+#   python bench/run.py --scales small --compare bench/results/<file trước>.json
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import seed as seeder  # noqa: E402
+import gemini_stub  # noqa: E402
+
+SCALES = {
+    "small": {"products": 500, "users": 300, "orders": 3000, "reviews": 1000, "interactions": 10000},
+    "medium": {"products": 5000, "users": 2000, "orders": 20000, "reviews": 10000, "interactions": 100000},
+    "large": {"products": 50000, "users": 20000, "orders": 200000, "reviews": 50000, "interactions": 1000000},
+}
+
+QUESTIONS = [
+    "áo thun nam màu đen", "váy đi biển mùa hè dưới 500k", "quần jeans nữ", "áo khoác mùa đông",
+    "đồ công sở thanh lịch", "áo sơ mi trắng đi làm", "chân váy ngắn", "hoodie oversize",
+    "quần short đi chơi", "đầm dự tiệc sang trọng", "shop có túi tote không", "mũ lưỡi trai màu be",
+]
+
+
+def _question(i):
+    # Thêm số thứ tự để phần lớn câu hỏi không trúng cache câu trả lời -> đo trọn đường đi RAG + Gemini
+    return f"{random.choice(QUESTIONS)} {i}"
+
+
+def _image():
+    return seeder._image_data_url(random.Random(7), size=224)
+
+
+# name -> (method, path, body(i), tỉ lệ số request so với --requests)
+SCENARIOS = {
+    "chatbot": ("POST", "/chatbot", lambda i: {"question": _question(i), "history": []}, 1.0),
+    "predict-revenue": ("GET", "/predict-revenue", None, 1.0),
+    "predict-revenue:refresh": ("GET", "/predict-revenue?refresh=true", None, 0.1),
+    "customer-segments": ("GET", "/customer-segments", None, 1.0),
+    "customer-segments:refresh": ("GET", "/customer-segments?refresh=true", None, 0.1),
+    "analyze-reviews": ("GET", "/analyze-reviews", None, 1.0),
+    "analyze-reviews:refresh": ("GET", "/analyze-reviews?refresh=true", None, 0.1),
+    "visual-search": ("POST", "/visual-search", lambda i: {"image_base64": _image()}, 0.5),
+    "cart-insights": ("GET", "/cart-insights", None, 1.0),
+    "cart-insights:refresh": ("GET", "/cart-insights?refresh=true", None, 0.1),
+    "sync-rag": ("GET", "/api/ai/sync-rag", None, 0.1),
+}
+
+
+# ---------- đo RAM process server (+ các process con: job pool) ----------
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def tree_rss(pid):
+    return _rss_bytes(pid) + sum(tree_rss(child) for child in _children(pid))
+
+
+class RssSampler:
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, tree_rss(self.pid))
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = tree_rss(self.pid)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+# ---------- chạy tải ----------
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(len(sorted_values) * p), len(sorted_values) - 1)]
+
+
+def _is_error(response):
+    if response.status_code != 200:
+        return True
+    if "text/event-stream" in response.headers.get("content-type", ""):
+        return False
+    try:
+        payload = response.json()
+    except ValueError:
+        return True
+    return isinstance(payload, dict) and (payload.get("status") == "error" or "error" in payload)
+
+
+async def run_scenario(client, pid, name, n, concurrency):
+    method, path, body, _ = SCENARIOS[name]
+    latencies, errors = [], 0
+    counter = iter(range(n))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            t = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body(i) if body else None)
+                failed = _is_error(response)
+            except httpx.HTTPError:
+                failed = True
+            latencies.append((time.perf_counter() - t) * 1000)
+            errors += int(failed)
+
+    with RssSampler(pid) as sampler:
+        t0 = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(max(1, min(concurrency, n)))])
+        wall = time.perf_counter() - t0
+
+    latencies.sort()
+    return {
+        "requests": n,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(n / wall, 2) if wall else None,
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+        "max_ms": round(latencies[-1], 2),
+        "peak_rss_mb": round(sampler.peak / 1024 / 1024, 1),
+    }
+
+
+# ---------- vòng đời server ----------
+
+def start_server(port, env):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_ready(client, process, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn thoát với mã {process.returncode}")
+        try:
+            response = await client.get("/api/ai/ready")
+            if response.status_code == 200 and response.json().get("ready"):
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("ai-service không sẵn sàng")
+
+
+async def timed_get(client, path):
+    t = time.perf_counter()
+    response = await client.get(path)
+    return {"ms": round((time.perf_counter() - t) * 1000, 1), "status": response.status_code,
+            "body": response.json() if response.status_code == 200 else response.text[:300]}
+
+
+async def bench_scale(scale, args, stub_url):
+    sizes = SCALES[scale]
+    database = f"{args.database}_{scale}"
+    result = {"sizes": sizes}
+    if not args.skip_seed:
+        print(f"[{scale}] seed {sizes} -> {database}")
+        result["seed"] = seeder.seed(database=database, **sizes)
+
+    data_dir = os.path.join(BENCH_DIR, ".data", scale)
+    env = dict(os.environ,
+               MYSQL_DATABASE=database,
+               GEMINI_BASE_URL=stub_url,
+               GOOGLE_API_KEY="bench",
+               # Stub không có quota -> mặc định bỏ rate limit phía client để đo chính service
+               GEMINI_RPM=os.environ.get("GEMINI_RPM", "0"),
+               CHROMA_PATH=os.path.join(data_dir, "chroma"),
+               AI_MODEL_DIR=os.path.join(data_dir, "model_store"),
+               AI_WARMUP=args.warmup,
+               JOB_SCHEDULER="0")  # không để job định kỳ chen vào kết quả đo
+    t0 = time.perf_counter()
+    process = start_server(args.port, env)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout) as client:
+            await wait_ready(client, process)
+            result["startup"] = {"ready_ms": round((time.perf_counter() - t0) * 1000, 1),
+                                 "rss_mb": round(tree_rss(process.pid) / 1024 / 1024, 1)}
+            # Lần đồng bộ đầu tiên (encode toàn bộ danh mục) + chỉ mục ảnh cho visual search
+            print(f"[{scale}] sync-rag full + image index")
+            result["initial_sync_rag"] = await timed_get(client, "/api/ai/sync-rag?mode=full")
+            result["initial_image_index"] = await timed_get(client, "/api/ai/sync-image-index")
+
+            result["endpoints"] = {}
+            for name in args.endpoints:
+                n = max(1, int(args.requests * SCENARIOS[name][3]))
+                print(f"[{scale}] {name}: {n} request, concurrency {args.concurrency}")
+                result["endpoints"][name] = await run_scenario(client, process.pid, name, n, args.concurrency)
+            result["service"] = {
+                "ready": (await client.get("/api/ai/ready")).json(),
+                "compute": (await client.get("/api/ai/compute-stats")).json(),
+                "jobs": (await client.get("/api/ai/jobs")).json(),
+            }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """In chênh lệch p95/throughput so với lần chạy trước; trả về số endpoint bị chậm đi quá ngưỡng"""
+    regressions = 0
+    for scale, result in current["scales"].items():
+        base_scale = baseline.get("scales", {}).get(scale)
+        if not base_scale:
+            continue
+        print(f"\n== {scale}: so với {baseline['meta'].get('commit')} ({baseline['meta'].get('timestamp')})")
+        for name, stats in result.get("endpoints", {}).items():
+            base = base_scale.get("endpoints", {}).get(name)
+            if not base or not base.get("p95_ms"):
+                continue
+            delta = (stats["p95_ms"] - base["p95_ms"]) / base["p95_ms"]
+            flag = "CHẬM HƠN" if delta > threshold else ""
+            regressions += int(delta > threshold)
+            print(f"{name:28s} p95 {base['p95_ms']:>9.1f} -> {stats['p95_ms']:>9.1f} ms ({delta:+.0%})  "
+                  f"rps {base['throughput_rps']} -> {stats['throughput_rps']} {flag}")
+    return regressions
+
+
+async def main_async(args):
+    server, stub = gemini_stub.serve(port=args.stub_port, config=gemini_stub.StubConfig(
+        args.gemini_latency_ms, args.gemini_jitter_ms, args.gemini_error_rate))
+    stub_url = f"http://127.0.0.1:{args.stub_port}/v1beta"
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "scales": {},
+    }
+    try:
+        for scale in args.scales:
+            report["scales"][scale] = await bench_scale(scale, args, stub_url)
+    finally:
+        server.shutdown()
+    report["meta"]["gemini_stub"] = {"requests": stub.requests, "errors": stub.errors}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ai-service với MySQL giả lập + Gemini giả")
+    parser.add_argument("--scales", default="small", type=lambda s: [x for x in s.split(",") if x])
+    parser.add_argument("--endpoints", default=",".join(SCENARIOS), type=lambda s: [x for x in s.split(",") if x])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--stub-port", type=int, default=8790)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=50)
+    parser.add_argument("--gemini-error-rate", type=float, default=0)
+    parser.add_argument("--warmup", default="all", help="AI_WARMUP cho server ('' = nạp lười khi có request)")
+    parser.add_argument("--database", default=seeder.BENCH_DATABASE)
+    parser.add_argument("--skip-seed", action="store_true", help="dùng lại database đã seed của lần trước")
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--compare", help="file kết quả cũ để so sánh")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p95 tăng quá tỉ lệ này = chậm hơn")
+    args = parser.parse_args()
+
+    unknown = [s for s in args.scales if s not in SCALES] + [e for e in args.endpoints if e not in SCENARIOS]
+    if unknown:
+        parser.error(f"không có scale/endpoint: {unknown}")
+
+    report = asyncio.run(main_async(args))
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{report['meta']['timestamp'].replace(':', '')}-{report['meta']['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+    print(f"\nĐã lưu kết quả: {path}")
+
+    for scale, result in report["scales"].items():
+        print(f"\n== {scale}")
+        for name, s in result["endpoints"].items():
+            print(f"{name:28s} p50 {s['p50_ms']:>9.1f}  p95 {s['p95_ms']:>9.1f}  p99 {s['p99_ms']:>9.1f} ms  "
+                  f"{s['throughput_rps']:>8} rps  lỗi {s['errors']}  RSS {s['peak_rss_mb']} MB")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# ai_service/bench/seed.py
+# Tạo database MySQL giả lập (cùng schema Prisma) với số lượng sản phẩm/đơn/review/tương tác tuỳ chọn
+#   python bench/seed.py --products 5000 --users 2000 --orders 20000 --reviews 10000 --interactions 100000
+import os
+import sys
+import time
+import base64
+import random
+import argparse
+from io import BytesIO
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mysql.connector  # noqa: E402
+
+import db  # noqa: E402
+
+BENCH_DATABASE = os.getenv("BENCH_MYSQL_DATABASE", "shop_ai_bench")
+INSERT_CHUNK = 5000
+
+SCHEMA = [
+    """CREATE TABLE User (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        email VARCHAR(191) NOT NULL UNIQUE,
+        password VARCHAR(191) NOT NULL DEFAULT '123456',
+        fullName VARCHAR(191) NULL,
+        role VARCHAR(191) NOT NULL DEFAULT 'USER'
+    )""",
+    """CREATE TABLE Product (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(191) NOT NULL,
+        description TEXT NULL,
+        price DOUBLE NOT NULL,
+        costPrice DOUBLE NOT NULL,
+        stock INT NOT NULL DEFAULT 100,
+        image TEXT NULL,
+        category VARCHAR(191) NOT NULL,
+        createdAt DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        updatedAt DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3) ON UPDATE CURRENT_TIMESTAMP(3),
+        INDEX (updatedAt)
+    )""",
+    """CREATE TABLE `Order` (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        userId INT NOT NULL,
+        totalAmount DOUBLE NOT NULL,
+        status VARCHAR(191) NOT NULL DEFAULT 'PENDING',
+        paymentMethod VARCHAR(191) NOT NULL DEFAULT 'COD',
+        paymentStatus VARCHAR(191) NOT NULL DEFAULT 'UNPAID',
+        createdAt DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        INDEX (userId)
+    )""",
+    """CREATE TABLE OrderItem (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        orderId INT NOT NULL,
+        productId INT NOT NULL,
+        quantity INT NOT NULL,
+        price DOUBLE NOT NULL,
+        INDEX (orderId), INDEX (productId)
+    )""",
+    """CREATE TABLE Review (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        content TEXT NOT NULL,
+        rating INT NOT NULL DEFAULT 5,
+        userId INT NOT NULL,
+        productId INT NOT NULL,
+        createdAt DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        INDEX (productId)
+    )""",
+    """CREATE TABLE UserInteraction (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        userId INT NOT NULL,
+        productId INT NOT NULL,
+        action VARCHAR(191) NOT NULL,
+        createdAt DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3),
+        INDEX (productId)
+    )""",
+]
+
+CATEGORIES = {
+    "Áo": ["Áo thun", "Áo sơ mi", "Áo khoác", "Áo hoodie", "Áo polo", "Áo len"],
+    "Quần": ["Quần jeans", "Quần short", "Quần tây", "Quần jogger", "Quần kaki"],
+    "Váy": ["Váy hoa", "Đầm dự tiệc", "Chân váy", "Váy maxi", "Đầm công sở"],
+    "Phụ kiện": ["Mũ lưỡi trai", "Túi tote", "Thắt lưng", "Khăn choàng"],
+}
+COLORS = ["đen", "trắng", "xanh navy", "be", "đỏ đô", "xám", "hồng pastel", "xanh rêu"]
+MATERIALS = ["cotton", "linen", "kaki", "len", "jean", "lụa", "nỉ"]
+STYLES = ["basic", "oversize", "slim fit", "vintage", "Hàn Quốc", "công sở", "đi biển"]
+REVIEWS = {
+    5: ["Hàng đẹp, vải mát, sẽ ủng hộ tiếp", "Rất ưng, đúng như mô tả", "Giao nhanh, đóng gói cẩn thận"],
+    4: ["Chất lượng ổn so với giá", "Đẹp nhưng hơi rộng một chút"],
+    3: ["Bình thường, tạm được", "Màu hơi khác ảnh"],
+    2: ["Vải mỏng, không như mong đợi", "Đường may lỗi vài chỗ"],
+    1: ["Quá tệ, giao sai size", "Hàng kém chất lượng, thất vọng"],
+}
+ACTIONS = ["VIEW"] * 6 + ["ADD_TO_CART"] * 3 + ["REMOVE_FROM_CART"]
+ORDER_STATUSES = ["COMPLETED"] * 6 + ["PENDING", "SHIPPING", "CANCELLED"]
+
+
+def _image_data_url(rng, size=32):
+    """Ảnh PNG nhỏ 1 màu (data URL) để chỉ mục ảnh không phải tải từ mạng"""
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3))).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def _random_time(rng, days):
+    # Prisma ghi DateTime theo UTC
+    return db.utc_now() - timedelta(seconds=rng.randrange(days * 86400))
+
+
+def _insert(cursor, sql, rows):
+    for i in range(0, len(rows), INSERT_CHUNK):
+        cursor.executemany(sql, rows[i:i + INSERT_CHUNK])
+
+
+def seed(products, users, orders, reviews, interactions, days=365, seed_value=42, database=BENCH_DATABASE):
+    rng = random.Random(seed_value)
+    config = db.get_db_config()
+    config.pop("database")
+    conn = mysql.connector.connect(**config)
+    cursor = conn.cursor()
+    t0 = time.perf_counter()
+
+    cursor.execute(f"DROP DATABASE IF EXISTS `{database}`")
+    cursor.execute(f"CREATE DATABASE `{database}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+    cursor.execute(f"USE `{database}`")
+    for ddl in SCHEMA:
+        cursor.execute(ddl)
+
+    _insert(cursor, "INSERT INTO User (email, fullName) VALUES (%s, %s)",
+            [(f"user{i}@bench.local", f"Khách {i}") for i in range(1, users + 1)])
+
+    palette = [_image_data_url(rng) for _ in range(64)]
+    product_rows, prices = [], []
+    for _ in range(products):
+        category = rng.choice(list(CATEGORIES))
+        kind = rng.choice(CATEGORIES[category])
+        color, material, style = rng.choice(COLORS), rng.choice(MATERIALS), rng.choice(STYLES)
+        price = rng.randrange(99, 1500) * 1000
+        prices.append(price)
+        product_rows.append((
+            f"{kind} {style} màu {color}",
+            f"{kind} chất liệu {material}, phong cách {style}, màu {color}. Phù hợp đi làm, đi chơi.",
+            price, price * 0.6, rng.randrange(0, 200), rng.choice(palette), category,
+            _random_time(rng, days),
+        ))
+    _insert(cursor, "INSERT INTO Product (name, description, price, costPrice, stock, image, category, createdAt) "
+                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", product_rows)
+
+    order_rows, item_rows = [], []
+    for order_id in range(1, orders + 1):
+        status = rng.choice(ORDER_STATUSES)
+        lines = [(rng.randrange(1, products + 1), rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+        total = sum(prices[pid - 1] * qty for pid, qty in lines)
+        order_rows.append((rng.randrange(1, users + 1), total, status,
+                           "PAID" if status == "COMPLETED" else "UNPAID", _random_time(rng, days)))
+        item_rows.extend((order_id, pid, qty, prices[pid - 1]) for pid, qty in lines)
+    _insert(cursor, "INSERT INTO `Order` (userId, totalAmount, status, paymentStatus, createdAt) "
+                    "VALUES (%s, %s, %s, %s, %s)", order_rows)
+    _insert(cursor, "INSERT INTO OrderItem (orderId, productId, quantity, price) VALUES (%s, %s, %s, %s)", item_rows)
+
+    review_rows = []
+    for _ in range(reviews):
+        rating = rng.choices([5, 4, 3, 2, 1], weights=[5, 3, 1, 1, 1])[0]
+        review_rows.append((rng.choice(REVIEWS[rating]), rating, rng.randrange(1, users + 1),
+                            rng.randrange(1, products + 1), _random_time(rng, days)))
+    _insert(cursor, "INSERT INTO Review (content, rating, userId, productId, createdAt) VALUES (%s, %s, %s, %s, %s)",
+            review_rows)
+
+    # Tương tác sắp theo thời gian để id tăng cùng createdAt như dữ liệu thật
+    times = sorted(_random_time(rng, min(days, 60)) for _ in range(interactions))
+    _insert(cursor, "INSERT INTO UserInteraction (userId, productId, action, createdAt) VALUES (%s, %s, %s, %s)",
+            [(rng.randrange(1, users + 1), rng.randrange(1, products + 1), rng.choice(ACTIONS), t) for t in times])
+
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return {
+        "database": database,
+        "products": products, "users": users, "orders": orders, "order_items": len(item_rows),
+        "reviews": reviews, "interactions": interactions,
+        "seed_s": round(time.perf_counter() - t0, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tạo dữ liệu giả lập cho benchmark ai-service")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--reviews", type=int, default=2000)
+    parser.add_argument("--interactions", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database", default=BENCH_DATABASE)
+    parser.add_argument("--force", action="store_true", help="cho phép ghi đè database đang cấu hình trong .env")
+    args = parser.parse_args()
+    if args.database == db.get_db_config()["database"] and not args.force:
+        parser.error(f"'{args.database}' là database đang dùng (MYSQL_DATABASE), seed sẽ XOÁ nó. Thêm --force nếu chắc chắn.")
+    print(seed(args.products, args.users, args.orders, args.reviews, args.interactions,
+               args.days, args.seed, args.database))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# ai_service/bench/workers_memory.py
+# So sánh RAM khi chạy nhiều worker: `uvicorn main:app --workers N` (mỗi worker nạp model riêng)
+# với `serve.py --workers N` (nạp model 1 lần rồi fork + vector sản phẩm mmap dùng chung).
+# Dùng dữ liệu đã seed/đồng bộ bởi run.py (bench/.data/<scale>, database <database>_<scale>).
+#   python bench/run.py --scales small --endpoints chatbot --requests 10      (lần đầu, để có dữ liệu)
+#   python bench/workers_memory.py --scale small --workers 4
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import components  # noqa: E402
+import seed as seeder  # noqa: E402
+from run import QUESTIONS, wait_ready, _git_commit  # noqa: E402
+
+MODES = ("uvicorn", "shared")
+
+
+def _command(mode, args):
+    if mode == "shared":
+        return [sys.executable, "serve.py", "--workers", str(args.workers), "--port", str(args.port),
+                "--host", "127.0.0.1", "--log-level", "warning"]
+    return [sys.executable, "-m", "uvicorn", "main:app", "--workers", str(args.workers), "--port", str(args.port),
+            "--host", "127.0.0.1", "--log-level", "warning"]
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def _cmdline(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+    except OSError:
+        return ""
+
+
+def tree_memory(pid):
+    """RSS/PSS (MB) của process cha + từng process con trực tiếp (worker)"""
+    processes = []
+    for role, p in [("master", pid)] + [("worker", c) for c in _children(pid)]:
+        try:
+            memory = components.process_memory(p)
+        except OSError:
+            continue
+        if role == "worker" and "resource_tracker" in _cmdline(p):
+            role = "helper"
+        processes.append({"pid": p, "role": role, **{f"{k}_mb": round(v / 1024 / 1024, 1) for k, v in memory.items()}})
+    workers = [p for p in processes if p["role"] == "worker"]
+    return {
+        "processes": processes,
+        "workers": len(workers),
+        "total_rss_mb": round(sum(p["rss_mb"] for p in processes), 1),
+        "total_pss_mb": round(sum(p["pss_mb"] for p in processes), 1),
+        "worker_rss_mb": [p["rss_mb"] for p in workers],
+        "worker_private_mb": [p["private_mb"] for p in workers],
+    }
+
+
+async def _exercise(client, n, concurrency):
+    """Gửi câu hỏi truy xuất RAG song song để mọi worker đều nạp đủ thành phần + chạm vào vector"""
+    queue = asyncio.Queue()
+    for i in range(n):
+        queue.put_nowait(f"{QUESTIONS[i % len(QUESTIONS)]} {i}")
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            q = queue.get_nowait()
+            r = await client.get("/api/ai/retrieve", params={"q": q})
+            errors += r.status_code != 200
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return errors
+
+
+async def measure(mode, args):
+    data_dir = os.path.join(BENCH_DIR, ".data", args.scale)
+    env = dict(os.environ,
+               MYSQL_DATABASE=f"{args.database}_{args.scale}",
+               GOOGLE_API_KEY=os.environ.get("GOOGLE_API_KEY", "bench"),
+               CHROMA_PATH=os.path.join(data_dir, "chroma"),
+               AI_MODEL_DIR=os.path.join(data_dir, "model_store"),
+               AI_WARMUP="embedding_model,retriever",
+               AI_SHARED_VECTORS="1" if mode == "shared" else "0",
+               JOB_SCHEDULER="0")
+    t0 = time.perf_counter()
+    process = subprocess.Popen(_command(mode, args), cwd=SERVICE_DIR, env=env)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout) as client:
+            await wait_ready(client, process)
+            # Mỗi worker tự warm-up; gửi thêm request để chắc mọi worker đã sẵn sàng
+            errors = await _exercise(client, args.queries, args.workers * 2)
+            ready_s = round(time.perf_counter() - t0, 1)
+            await asyncio.sleep(args.settle)
+            result = tree_memory(process.pid)
+            result.update(mode=mode, ready_s=ready_s, errors=errors)
+            return result
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=20)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAM nhiều worker: uvicorn --workers vs serve.py (preload + mmap)")
+    parser.add_argument("--scale", default="small")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", default=",".join(MODES), type=lambda s: [x for x in s.split(",") if x])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--settle", type=float, default=2.0, help="giây chờ trước khi đọc RSS")
+    parser.add_argument("--port", type=int, default=8810)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--database", default=seeder.BENCH_DATABASE)
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results"))
+    args = parser.parse_args()
+
+    results = {mode: asyncio.run(measure(mode, args)) for mode in args.modes}
+    for mode, r in results.items():
+        print(f"{mode:8s} {r['workers']} worker  tổng RSS {r['total_rss_mb']:>8.1f} MB  tổng PSS {r['total_pss_mb']:>8.1f} MB  "
+              f"RSS/worker {r['worker_rss_mb']}  riêng/worker {r['worker_private_mb']}")
+    if {"uvicorn", "shared"} <= set(results):
+        saved = results["uvicorn"]["total_pss_mb"] - results["shared"]["total_pss_mb"]
+        print(f"Tiết kiệm {saved:.1f} MB RAM thực (PSS) với {args.workers} worker")
+
+    report = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": _git_commit(), "args": vars(args)},
+        "workers_memory": results,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"workers-{report['meta']['timestamp'].replace(':', '')}-{report['meta']['commit']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu kết quả: {path}")
+
+
+if __name__ == "__main__":
+    main()
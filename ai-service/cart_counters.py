@@ -0,0 +1,178 @@
+# ai_service/cart_counters.py
+# Bộ đếm thêm/xoá giỏ hàng và lượt xem theo sản phẩm, cập nhật tăng dần từ UserInteraction
+import os
+import time
+import threading
+from datetime import datetime
+
+import numpy as np
+
+import db
+
+REFRESH_INTERVAL = float(os.getenv("CART_REFRESH_INTERVAL", "5"))
+FETCH_CHUNK = int(os.getenv("CART_FETCH_CHUNK", "10000"))
+
+# Cửa sổ thời gian -> số giờ; bộ đếm theo giờ được giữ tối đa bằng cửa sổ dài nhất
+WINDOWS = {"24h": 24, "7d": 24 * 7, "30d": 24 * 30}
+MAX_WINDOW_HOURS = max(WINDOWS.values())
+
+ACTIONS = {"ADD_TO_CART": 0, "REMOVE_FROM_CART": 1, "VIEW": 2}
+INTERACTION_SCHEMA = {'id': 'int64', 'productId': 'int64', 'action': 'object', 'createdAt': 'datetime64[us]'}
+
+
+def _hour(dt):
+    """Số giờ kể từ epoch; datetime naive của DB được tính như datetime64 của numpy (không đổi múi giờ)"""
+    return int(np.datetime64(dt, 'h').astype(np.int64))
+
+
+def _hour_start(hour):
+    return np.datetime64(hour, 'h').astype(datetime)
+
+
+# (giờ, productId) được ghép thành 1 số nguyên để gom nhóm bằng 1 lần np.unique
+PID_SPAN = 1 << 32
+
+
+def _count_by(codes, keys):
+    """Đếm số dòng theo khoá (mảng int) và loại hành động -> (khoá duy nhất, mảng (n, 3) adds/removes/views)"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    counts = np.zeros((len(unique), len(ACTIONS)), dtype=np.int64)
+    np.add.at(counts, (inverse, codes), 1)
+    return unique, counts
+
+
+def _add(table, pid, counts, sign=1):
+    row = table.get(pid)
+    if row is None:
+        row = table[pid] = [0, 0, 0]
+    for i in range(3):
+        row[i] += sign * counts[i]
+
+
+class CartCounters:
+    """
+    totals['all'][productId] = [adds, removes, views] cho toàn bộ lịch sử.
+    Với mỗi cửa sổ (24h/7d/30d) giữ tổng chạy; khi thời gian trôi qua,
+    các bucket giờ rơi khỏi cửa sổ được trừ ra thay vì tính lại từ đầu.
+    """
+
+    def __init__(self):
+        self.hourly = {}                                    # giờ -> {productId: [a, r, v]}
+        self.totals = {"all": {}, **{w: {} for w in WINDOWS}}
+        self.window_start = {w: None for w in WINDOWS}      # giờ sớm nhất đang nằm trong cửa sổ
+        self.watermark = 0
+        self.bootstrapped = False
+        self.last_refresh = 0.0
+        self.rows_ingested = 0
+        self._lock = threading.Lock()
+
+    def _ingest(self, rows, now_hour, count_all):
+        """
+        Cộng 1 lô UserInteraction (dạng cột) vào bộ đếm: gom theo (giờ, sản phẩm) bằng numpy
+        rồi mới cập nhật dict -> số lần lặp Python = số cặp khác nhau thay vì số dòng.
+        """
+        codes = np.full(len(rows['action']), -1, dtype=np.int64)
+        for action, idx in ACTIONS.items():
+            codes[rows['action'] == action] = idx
+        valid = codes >= 0
+        codes, pids = codes[valid], rows['productId'][valid]
+        hours = rows['createdAt'][valid].astype('datetime64[h]').astype(np.int64)
+        windows = [("all", None)] if count_all else []
+        for w, window_hours in [*windows, *WINDOWS.items()]:
+            inside = slice(None) if window_hours is None else hours > now_hour - window_hours
+            table = self.totals[w]
+            for pid, counts in zip(*(a.tolist() for a in _count_by(codes[inside], pids[inside]))):
+                _add(table, pid, counts)
+        recent = hours > now_hour - MAX_WINDOW_HOURS
+        keys, counts = _count_by(codes[recent], hours[recent] * PID_SPAN + pids[recent])
+        for key, c in zip(keys.tolist(), counts.tolist()):
+            hour, pid = divmod(key, PID_SPAN)
+            _add(self.hourly.setdefault(hour, {}), pid, c)
+        self.rows_ingested += int(valid.sum())
+
+    def _expire(self, now_hour):
+        """Trừ các bucket giờ vừa rơi ra khỏi từng cửa sổ"""
+        for w, hours in WINDOWS.items():
+            new_start = now_hour - hours + 1
+            old_start = self.window_start[w]
+            if old_start is not None:
+                for h in range(old_start, min(new_start, old_start + MAX_WINDOW_HOURS + 1)):
+                    for pid, counts in self.hourly.get(h, {}).items():
+                        _add(self.totals[w], pid, counts, sign=-1)
+            self.window_start[w] = new_start
+        for h in [h for h in self.hourly if h <= now_hour - MAX_WINDOW_HOURS]:
+            del self.hourly[h]
+
+    def _bootstrap(self, now_hour):
+        # Tổng toàn thời gian: 1 câu GROUP BY; chi tiết theo giờ chỉ cần cho 30 ngày gần nhất
+        max_row = db.fetch_all("SELECT COALESCE(MAX(id), 0) AS max_id FROM UserInteraction")
+        self.watermark = int(max_row[0]['max_id'])
+        rows = db.fetch_all("""
+            SELECT productId,
+                   SUM(CASE WHEN action = 'ADD_TO_CART' THEN 1 ELSE 0 END) AS adds,
+                   SUM(CASE WHEN action = 'REMOVE_FROM_CART' THEN 1 ELSE 0 END) AS removes,
+                   SUM(CASE WHEN action = 'VIEW' THEN 1 ELSE 0 END) AS views
+            FROM UserInteraction
+            WHERE id <= %s
+            GROUP BY productId
+        """, (self.watermark,))
+        for r in rows:
+            self.totals["all"][r['productId']] = [int(r['adds']), int(r['removes']), int(r['views'])]
+
+        since = _hour_start(now_hour - MAX_WINDOW_HOURS + 1)
+        for rows in db.iter_columns(
+            "SELECT id, productId, action, createdAt FROM UserInteraction "
+            "WHERE id <= %s AND createdAt >= %s ORDER BY id",
+            (self.watermark, since), INTERACTION_SCHEMA, FETCH_CHUNK
+        ):
+            self._ingest(rows, now_hour, count_all=False)
+        for w, hours in WINDOWS.items():
+            self.window_start[w] = now_hour - hours + 1
+        self.bootstrapped = True
+
+    def _load_new(self, now_hour):
+        for rows in db.iter_columns(
+            "SELECT id, productId, action, createdAt FROM UserInteraction WHERE id > %s ORDER BY id",
+            (self.watermark,), INTERACTION_SCHEMA, FETCH_CHUNK
+        ):
+            self._ingest(rows, now_hour, count_all=True)
+            self.watermark = int(rows['id'][-1])
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self.last_refresh < REFRESH_INTERVAL:
+                return
+            # createdAt do Prisma ghi theo UTC -> mốc giờ hiện tại cũng phải là UTC
+            now_hour = _hour(db.utc_now())
+            if not self.bootstrapped:
+                self._bootstrap(now_hour)
+            else:
+                self._expire(now_hour)
+                self._load_new(now_hour)
+            self.last_refresh = time.monotonic()
+
+    def counts(self, window="all"):
+        """{productId: (adds, removes, views)} của cửa sổ thời gian yêu cầu"""
+        with self._lock:
+            return {pid: tuple(c) for pid, c in self.totals[window].items() if any(c)}
+
+    def count_arrays(self, window="all"):
+        """(productIds, mảng (n, 3) adds/removes/views) của cửa sổ, bỏ sản phẩm toàn 0"""
+        with self._lock:
+            table = self.totals[window]
+            pids = np.fromiter(table.keys(), dtype=np.int64, count=len(table))
+            counts = np.array(list(table.values()), dtype=np.int64).reshape(-1, len(ACTIONS))
+        active = counts.any(axis=1)
+        return pids[active], counts[active]
+
+    def stats(self):
+        return {
+            "watermark": self.watermark,
+            "products": len(self.totals["all"]),
+            "hour_buckets": len(self.hourly),
+            "rows_ingested": self.rows_ingested,
+        }
+
+
+counters = CartCounters()
+
@@ -0,0 +1,227 @@
+# ai_service/catalog.py
+# Ảnh chụp (snapshot) bảng Product trong RAM, dạng cột, dùng chung cho mọi endpoint
+import os
+import sys
+import time
+import asyncio
+import threading
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+import db
+
+# Cứ mỗi VERSION_CHECK_INTERVAL giây kiểm tra version bảng Product 1 lần,
+# quá CATALOG_TTL giây thì nạp lại bất kể version
+VERSION_CHECK_INTERVAL = float(os.getenv("CATALOG_VERSION_CHECK_INTERVAL", "5"))
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "600"))
+
+PRODUCT_SQL = "SELECT id, name, price, stock, category, image, description, createdAt FROM Product ORDER BY id"
+# Product.updatedAt (@updatedAt, có index) do Prisma cập nhật mỗi lần sửa: MAX() đọc 1 đầu index,
+# COUNT(*) + MAX(id) bắt được sản phẩm bị xoá/thêm
+VERSION_SQL = "SELECT COUNT(*) AS n, COALESCE(MAX(id), 0) AS max_id, MAX(updatedAt) AS updated FROM Product"
+# DB chưa chạy migration thêm updatedAt: checksum mọi dòng (quét cả bảng, chỉ để tương thích)
+LEGACY_VERSION_SQL = """
+    SELECT COUNT(*) AS n, COALESCE(MAX(id), 0) AS max_id,
+           COALESCE(SUM(CRC32(CONCAT_WS('|', name, price, stock, category,
+                                        COALESCE(image, ''), COALESCE(description, '')))), 0) AS updated
+    FROM Product
+"""
+ER_BAD_FIELD_ERROR = 1054
+
+
+def _version_of(row):
+    return (int(row['n']), int(row['max_id']), str(row['updated']))
+
+
+def _missing_column(error):
+    # mysql-connector: .errno; aiomysql/pymysql: args[0]
+    code = getattr(error, "errno", None) or (error.args[0] if error.args else None)
+    return code == ER_BAD_FIELD_ERROR
+
+
+class CatalogSnapshot:
+    """Các cột id/name/price/stock/category/image/description lưu thành mảng song song"""
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.ids = np.fromiter((r['id'] for r in rows), dtype=np.int64, count=len(rows))
+        self.prices = np.fromiter((r['price'] for r in rows), dtype=np.float64, count=len(rows))
+        self.stocks = np.fromiter((r['stock'] or 0 for r in rows), dtype=np.int32, count=len(rows))
+        self.names = [r['name'] for r in rows]
+        self.images = [r['image'] or "" for r in rows]
+        self.descriptions = [r['description'] for r in rows]
+        self.created_at = [r['createdAt'] for r in rows]
+        # category lặp lại nhiều -> lưu mã số + bảng tra
+        categories, codes = np.unique(np.array([r['category'] or "" for r in rows], dtype=object), return_inverse=True)
+        self.category_names = list(categories)
+        self.category_codes = codes.astype(np.int16)
+        self._pos = {int(pid): i for i, pid in enumerate(self.ids)}
+        self._context_text = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def category(self, i):
+        return self.category_names[self.category_codes[i]]
+
+    def row(self, i):
+        return {
+            "id": int(self.ids[i]),
+            "name": self.names[i],
+            "price": float(self.prices[i]),
+            "stock": int(self.stocks[i]),
+            "category": self.category(i),
+            "image": self.images[i],
+            "description": self.descriptions[i],
+            "createdAt": self.created_at[i],
+        }
+
+    def rows(self, columns=None):
+        """list dict giống kết quả cursor(dictionary=True) cho code cũ"""
+        out = [self.row(i) for i in range(len(self))]
+        if columns:
+            out = [{c: r[c] for c in columns} for r in out]
+        return out
+
+    def get(self, product_id):
+        i = self._pos.get(int(product_id))
+        return None if i is None else self.row(i)
+
+    def positions(self, product_ids):
+        """Vị trí trong snapshot của từng id (mảng), -1 nếu sản phẩm không còn; ids đã sắp xếp -> searchsorted"""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        pos = np.searchsorted(self.ids, product_ids)
+        found = pos < len(self.ids)
+        found[found] = self.ids[pos[found]] == product_ids[found]
+        return np.where(found, pos, -1)
+
+    def price_stock(self, product_id):
+        """(giá, tồn kho) hiện tại, dùng để phát hiện câu trả lời đã cache bị lỗi thời"""
+        i = self._pos.get(int(product_id))
+        return None if i is None else (float(self.prices[i]), int(self.stocks[i]))
+
+    def render_context(self):
+        """Chuỗi danh sách sản phẩm cho prompt, ghép 1 lần bằng join và cache theo version"""
+        if self._context_text is None:
+            lines = [
+                f"- ID: {pid} | Tên: {name} | Giá: {price} VND | Kho: {stock} | Ảnh: {img} | Chi tiết: {desc}"
+                for pid, name, price, stock, img, desc in zip(
+                    self.ids.tolist(), self.names, self.prices.tolist(), self.stocks.tolist(),
+                    self.images, self.descriptions
+                )
+            ]
+            self._context_text = "DANH SÁCH SẢN PHẨM TRONG KHO:\n" + "\n".join(lines) + ("\n" if lines else "")
+        return self._context_text
+
+    def memory_usage(self):
+        arrays = self.ids.nbytes + self.prices.nbytes + self.stocks.nbytes + self.category_codes.nbytes
+        strings = sum(
+            sum(sys.getsizeof(s) for s in column if s is not None)
+            for column in (self.names, self.images, self.descriptions, self.category_names)
+        )
+        context = sys.getsizeof(self._context_text) if self._context_text else 0
+        return {"arrays_bytes": arrays, "strings_bytes": strings, "context_bytes": context,
+                "total_bytes": arrays + strings + context}
+
+
+class Catalog:
+    def __init__(self):
+        self._snapshot = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        # get_async: các request async cùng lúc thấy version cũ chỉ 1 cái đọc version + nạp lại
+        self._async_lock = asyncio.Lock()
+        self.loads = 0
+        self.checks = 0
+        self.version_sql = VERSION_SQL
+
+    def _fall_back(self, error):
+        if self.version_sql is LEGACY_VERSION_SQL or not _missing_column(error):
+            return False
+        print(">>> [PYTHON] Bảng Product chưa có cột updatedAt (chưa chạy prisma migrate), "
+              "kiểm tra version bằng checksum cả bảng")
+        self.version_sql = LEGACY_VERSION_SQL
+        return True
+
+    def _read_version(self):
+        try:
+            return _version_of(db.fetch_all(self.version_sql)[0])
+        except Exception as e:
+            if not self._fall_back(e):
+                raise
+            return _version_of(db.fetch_all(self.version_sql)[0])
+
+    async def _read_version_async(self):
+        try:
+            return _version_of((await db.fetch_all_async(self.version_sql))[0])
+        except Exception as e:
+            if not self._fall_back(e):
+                raise
+            return _version_of((await db.fetch_all_async(self.version_sql))[0])
+
+    def _needs_check(self, force_check):
+        return (
+            self._snapshot is None
+            or force_check
+            or self._expired()
+            or time.monotonic() - self._last_check > VERSION_CHECK_INTERVAL
+        )
+
+    def _expired(self):
+        return time.monotonic() - self._snapshot.loaded_at > CATALOG_TTL
+
+    def get(self, force_check=False):
+        """Trả snapshot hiện tại, nạp lại nếu version bảng Product đã đổi hoặc hết TTL"""
+        if not self._needs_check(force_check):
+            return self._snapshot
+        with self._lock:
+            if not self._needs_check(force_check):
+                return self._snapshot
+            version = self._read_version()
+            self.checks += 1
+            self._last_check = time.monotonic()
+            if self._snapshot is None or self._snapshot.version != version or self._expired():
+                self._snapshot = CatalogSnapshot(db.fetch_all(PRODUCT_SQL), version)
+                self.loads += 1
+            return self._snapshot
+
+    async def get_async(self, force_check=False):
+        """Như get() nhưng dùng pool async (cho endpoint async def)"""
+        if not self._needs_check(force_check):
+            return self._snapshot
+        checked = self._last_check
+        async with self._async_lock:
+            # Request khác vừa kiểm tra xong trong lúc chờ lock -> dùng luôn kết quả đó
+            if self._last_check != checked and self._snapshot is not None:
+                return self._snapshot
+            version = await self._read_version_async()
+            self.checks += 1
+            self._last_check = time.monotonic()
+            if self._snapshot is None or self._snapshot.version != version or self._expired():
+                rows = await db.fetch_all_async(PRODUCT_SQL)
+                # Dựng mảng/np.unique trên cả danh mục tốn CPU -> không chạy trên event loop
+                snapshot = await run_in_threadpool(CatalogSnapshot, rows, version)
+                with self._lock:
+                    self._snapshot = snapshot
+                self.loads += 1
+            return self._snapshot
+
+    def invalidate(self):
+        self._last_check = 0.0
+
+    def stats(self):
+        snap = self._snapshot
+        return {
+            "products": 0 if snap is None else len(snap),
+            "version": None if snap is None else list(snap.version),
+            "version_source": "checksum" if self.version_sql is LEGACY_VERSION_SQL else "updatedAt",
+            "loads": self.loads,
+            "version_checks": self.checks,
+            "age_s": None if snap is None else round(time.monotonic() - snap.loaded_at, 1),
+            "memory": None if snap is None else snap.memory_usage(),
+        }
+
+
+catalog = Catalog()
@@ -0,0 +1,184 @@
+# ai_service/components.py
+# Khởi tạo lười (lazy) các thành phần nặng: chỉ nạp khi dùng lần đầu, ghi lại thời gian nạp + RAM tăng thêm
+import os
+import time
+import resource
+import threading
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# main.py import module này đầu tiên -> mốc tính thời gian khởi động và RAM nền
+_started_at = time.perf_counter()
+_startup_ms = None
+_rss_at_startup = None
+
+WARMUP = [c.strip() for c in os.getenv("AI_WARMUP", "").split(",") if c.strip()]
+
+
+def rss_bytes():
+    """RSS hiện tại của process (Linux: /proc/self/statm; nơi khác: RSS đỉnh từ getrusage)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _mb(n):
+    return round(n / (1024 * 1024), 1)
+
+
+def process_memory(pid="self"):
+    """
+    RSS / PSS / phần dùng chung / phần riêng (byte) của 1 process, đọc /proc/<pid>/smaps_rollup (Linux).
+    PSS chia đều trang nhớ dùng chung cho các process cùng map -> tổng PSS các worker = RAM thật sự dùng.
+    """
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def worker_pids():
+    """(pid process cha, [pid các worker]) khi chạy bằng serve.py; chạy 1 process thì chỉ có chính nó"""
+    master = os.getenv("AI_SERVE_MASTER_PID")
+    if master:
+        try:
+            with open(f"/proc/{master}/task/{master}/children") as f:
+                return int(master), sorted(int(pid) for pid in f.read().split())
+        except OSError:
+            pass
+    return None, [os.getpid()]
+
+
+def workers_memory():
+    """Bộ nhớ từng worker (+ process cha đang giữ model đã nạp trước khi fork)"""
+    master, pids = worker_pids()
+    processes = []
+    for role, pid in [("master", master)] * (master is not None) + [("worker", pid) for pid in pids]:
+        try:
+            memory = process_memory(pid)
+        except OSError:
+            continue
+        processes.append({"pid": pid, "role": role, "current": pid == os.getpid(),
+                          **{f"{key}_mb": _mb(value) for key, value in memory.items()}})
+    total_rss = sum(p["rss_mb"] for p in processes)
+    total_pss = sum(p["pss_mb"] for p in processes)
+    return {
+        "workers": len(pids),
+        "processes": processes,
+        "total_rss_mb": round(total_rss, 1),
+        # RAM thực dùng; chênh lệch với tổng RSS = phần được dùng chung giữa các process
+        "total_pss_mb": round(total_pss, 1),
+        "shared_saving_mb": round(total_rss - total_pss, 1),
+    }
+
+
+_rss_at_import = rss_bytes()
+
+
+class Lazy:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.loaded = False
+        self.load_ms = None
+        self.rss_delta = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.loaded:
+            return self.value
+        with self._lock:
+            if not self.loaded:
+                t0, rss0 = time.perf_counter(), rss_bytes()
+                try:
+                    self.value = self.factory()
+                except Exception as e:
+                    self.error = f"{type(e).__name__}: {e}"
+                    raise
+                self.load_ms = round((time.perf_counter() - t0) * 1000, 1)
+                self.rss_delta = rss_bytes() - rss0
+                self.error = None
+                self.loaded = True
+                print(f">>> [PYTHON] Đã nạp {self.name} trong {self.load_ms} ms (+{_mb(self.rss_delta)} MB)")
+        return self.value
+
+    def status(self):
+        return {
+            "warm": self.loaded,
+            "load_ms": self.load_ms,
+            "rss_delta_mb": None if self.rss_delta is None else _mb(self.rss_delta),
+            "error": self.error,
+        }
+
+
+_registry = {}
+_warmup = {"started": False, "done": False, "ms": None}
+
+
+def register(name, factory):
+    """Đăng ký thành phần; trả về đối tượng Lazy, gọi .get() để lấy (nạp ở lần gọi đầu)"""
+    _registry[name] = Lazy(name, factory)
+    return _registry[name]
+
+
+def get(name):
+    return _registry[name].get()
+
+
+def mark_started():
+    """Gọi khi app đã sẵn sàng nhận request (sự kiện startup)"""
+    global _startup_ms, _rss_at_startup
+    _startup_ms = round((time.perf_counter() - _started_at) * 1000, 1)
+    _rss_at_startup = rss_bytes()
+
+
+def warm_up(names=None):
+    """Nạp trước các thành phần (AI_WARMUP=embedding_model,chroma hoặc AI_WARMUP=all)"""
+    names = names if names is not None else WARMUP
+    if "all" in names:
+        names = list(_registry)
+    _warmup["started"] = True
+    t0 = time.perf_counter()
+    for name in names:
+        try:
+            get(name)
+        except Exception as e:
+            print(f">>> [PYTHON] Warm-up {name} lỗi: {e}")
+    _warmup["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    _warmup["done"] = True
+
+
+def start_warm_up():
+    if WARMUP:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def readiness():
+    required = list(_registry) if "all" in WARMUP else [n for n in WARMUP if n in _registry]
+    return {
+        # Không cấu hình warm-up thì luôn sẵn sàng (thành phần nạp khi dùng lần đầu)
+        "ready": all(_registry[n].loaded for n in required),
+        "warmup": {"components": WARMUP, **_warmup},
+        "startup_ms": _startup_ms,
+        "rss_mb": {
+            "at_import": _mb(_rss_at_import),
+            "at_startup": None if _rss_at_startup is None else _mb(_rss_at_startup),
+            "components": _mb(sum(c.rss_delta or 0 for c in _registry.values())),
+            "current": _mb(rss_bytes()),
+        },
+        "components": {name: c.status() for name, c in _registry.items()},
+    }
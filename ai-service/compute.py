@@ -0,0 +1,233 @@
+# ai_service/compute.py
+# Executor riêng cho việc nặng CPU (encode, KMeans, hồi quy) + cấu hình số thread + đo thời gian event loop bị chặn
+import os
+import sys
+import time
+import asyncio
+import threading
+import contextvars
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+import tracing
+
+load_dotenv()
+
+CPU_COUNT = os.cpu_count() or 1
+# Request tương tác (encode câu hỏi, predict) dùng ít thread để không tranh CPU với nhau,
+# job hàng loạt (sync RAG, fit KMeans) được dùng tới BATCH_THREADS
+INTERACTIVE_THREADS = int(os.getenv("AI_INTERACTIVE_THREADS", "1"))
+BATCH_THREADS = int(os.getenv("AI_BATCH_THREADS", str(CPU_COUNT)))
+COMPUTE_WORKERS = int(os.getenv("AI_COMPUTE_WORKERS", "1"))
+
+LOOP_CHECK_INTERVAL = float(os.getenv("LOOP_CHECK_INTERVAL_MS", "50")) / 1000
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100")) / 1000
+
+_THREAD_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+               "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def configure_threads():
+    """
+    Gọi trước khi import numpy/torch: pool thread của BLAS/OpenMP được tạo đủ lớn cho job
+    hàng loạt (giá trị đặt sẵn trong môi trường vẫn được giữ nguyên); sau khi import xong
+    apply_interactive_limits() hạ xuống mức dùng cho request thường.
+    """
+    for name in _THREAD_ENV:
+        os.environ.setdefault(name, str(max(BATCH_THREADS, INTERACTIVE_THREADS)))
+
+
+def _set_torch_threads(n):
+    # Chỉ chỉnh khi torch đã được nạp (model embedding nạp lười), không tự import torch
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return None
+    previous = torch.get_num_threads()
+    torch.set_num_threads(n)
+    return previous
+
+
+def apply_interactive_limits():
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(limits=INTERACTIVE_THREADS)
+    _set_torch_threads(INTERACTIVE_THREADS)
+
+
+class _BatchThreads:
+    """
+    Số thread BLAS/OpenMP/torch là cấu hình chung của cả process: các tác vụ hàng loạt chạy chồng
+    nhau dùng chung 1 lần nâng (đếm số người đang dùng), chỉ người ra cuối cùng trả lại giá trị gốc.
+    Nếu mỗi lần tự lưu/khôi phục riêng thì lần ra sau có thể ghi đè giá trị cũ lên lần đang chạy.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.threads = 0
+        self._original = None       # threadpool_limits của lần nâng đầu (giữ giá trị gốc)
+        self._torch_previous = None
+        self._lock = threading.Lock()
+
+    def enter(self, n):
+        from threadpoolctl import threadpool_limits
+        with self._lock:
+            self.depth += 1
+            if n <= self.threads:
+                return
+            limiter = threadpool_limits(limits=n)
+            previous = _set_torch_threads(n)
+            if self._original is None:
+                self._original = limiter
+            if self._torch_previous is None:
+                self._torch_previous = previous
+            self.threads = n
+
+    def exit(self):
+        with self._lock:
+            self.depth -= 1
+            if self.depth:
+                return
+            if self._original is not None:
+                self._original.restore_original_limits()
+            if self._torch_previous is not None:
+                _set_torch_threads(self._torch_previous)
+            self.threads, self._original, self._torch_previous = 0, None, None
+
+
+_batch = _BatchThreads()
+
+
+@contextmanager
+def batch_threads(n=None):
+    """Tạm nâng số thread BLAS/OpenMP/torch cho 1 tác vụ hàng loạt; trả lại khi tác vụ cuối cùng xong"""
+    _batch.enter(n or BATCH_THREADS)
+    try:
+        yield
+    finally:
+        _batch.exit()
+
+
+class _ComputeMetrics:
+    def __init__(self):
+        self.tasks = 0
+        self.running = 0
+        self.busy_total = 0.0
+        self.queue_wait_total = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, fn, submitted_at, args, kwargs):
+        started = time.perf_counter()
+        with self._lock:
+            self.running += 1
+            self.queue_wait_total += started - submitted_at
+        tracing.record("compute.queue", started - submitted_at)
+        try:
+            with batch_threads():
+                return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.tasks += 1
+                self.busy_total += time.perf_counter() - started
+
+
+_executor = ThreadPoolExecutor(max_workers=COMPUTE_WORKERS, thread_name_prefix="compute")
+_metrics = _ComputeMetrics()
+
+
+def submit(fn, *args, **kwargs):
+    """Đưa việc nặng CPU vào executor compute (chạy với BATCH_THREADS), trả về Future"""
+    # Mang theo context của request (trace) sang thread compute
+    return _executor.submit(contextvars.copy_context().run, _metrics.run, fn, time.perf_counter(), args, kwargs)
+
+
+def call(fn, *args, **kwargs):
+    """Bản đồng bộ cho endpoint def: chạy trong executor compute và chờ kết quả"""
+    return submit(fn, *args, **kwargs).result()
+
+
+async def run(fn, *args, **kwargs):
+    """Bản async: event loop không bị chặn trong lúc encode/fit"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor, partial(contextvars.copy_context().run, _metrics.run, fn, time.perf_counter(), args, kwargs)
+    )
+
+
+class LoopMonitor:
+    """
+    Đo độ trễ event loop: cứ LOOP_CHECK_INTERVAL giây ngủ 1 lần, thời gian thức dậy trễ
+    hơn dự kiến chính là khoảng loop bị code đồng bộ chặn.
+    """
+
+    def __init__(self, interval=LOOP_CHECK_INTERVAL, threshold=LOOP_BLOCK_THRESHOLD, window=2000):
+        self.interval = interval
+        self.threshold = threshold
+        self.window = window
+        self.lags = []
+        self.max_lag = 0.0
+        self.blocked_total = 0.0
+        self.stalls = 0
+        self.last_stall = None
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            t = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - t - self.interval, 0.0)
+            self.lags.append(lag)
+            if len(self.lags) > self.window:
+                del self.lags[:len(self.lags) - self.window]
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.threshold:
+                self.stalls += 1
+                self.blocked_total += lag
+                self.last_stall = {"at": time.strftime("%Y-%m-%d %H:%M:%S"), "ms": round(lag * 1000, 1)}
+                print(f">>> [PYTHON] Event loop bị chặn {lag * 1000:.0f} ms")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        lags = sorted(self.lags)
+
+        def pct(p):
+            return round(lags[min(int(len(lags) * p), len(lags) - 1)] * 1000, 2) if lags else 0.0
+
+        return {
+            "samples": len(lags),
+            "lag_p50_ms": pct(0.50),
+            "lag_p99_ms": pct(0.99),
+            "lag_max_ms": round(self.max_lag * 1000, 2),
+            "stalls": self.stalls,
+            "stall_threshold_ms": round(self.threshold * 1000),
+            "blocked_total_ms": round(self.blocked_total * 1000, 1),
+            "last_stall": self.last_stall,
+        }
+
+
+loop_monitor = LoopMonitor()
+
+
+def stats():
+    return {
+        "cpu_count": CPU_COUNT,
+        "interactive_threads": INTERACTIVE_THREADS,
+        "batch_threads": BATCH_THREADS,
+        "compute_workers": COMPUTE_WORKERS,
+        "compute_tasks": _metrics.tasks,
+        "compute_running": _metrics.running,
+        "compute_busy_ms": round(_metrics.busy_total * 1000, 1),
+        "compute_queue_wait_ms": round(_metrics.queue_wait_total * 1000, 1),
+        "event_loop": loop_monitor.stats(),
+    }
@@ -0,0 +1,311 @@
+# ai_service/db.py
+# Pool kết nối MySQL dùng chung cho toàn bộ ai-service (sync + async)
+import os
+import time
+import asyncio
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager, asynccontextmanager
+
+import aiomysql
+import numpy as np
+from mysql.connector import pooling
+from dotenv import load_dotenv
+
+import tracing
+
+load_dotenv()
+
+
+def get_db_config():
+    """Đọc cấu hình kết nối từ biến môi trường (.env)"""
+    return {
+        "host": os.getenv("MYSQL_HOST", "localhost"),
+        "port": int(os.getenv("MYSQL_PORT", "3306")),
+        "user": os.getenv("MYSQL_USER", "root"),
+        "password": os.getenv("MYSQL_PASSWORD", ""),
+        "database": os.getenv("MYSQL_DATABASE", "shop_ai_db"),
+    }
+
+
+# mysql-connector giới hạn tối đa 32 connection / pool
+POOL_SIZE = min(int(os.getenv("MYSQL_POOL_SIZE", "8")), 32)
+ASYNC_POOL_SIZE = int(os.getenv("MYSQL_ASYNC_POOL_SIZE", "8"))
+CHECKOUT_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", "5"))
+# Connection rảnh lâu hơn ngưỡng này sẽ được ping lại trước khi dùng
+PING_INTERVAL = float(os.getenv("MYSQL_POOL_PING_INTERVAL", "30"))
+POOL_RECYCLE = int(os.getenv("MYSQL_POOL_RECYCLE", "3600"))
+# Số dòng mỗi lần đọc của loader dạng cột (cursor không buffer)
+STREAM_CHUNK = int(os.getenv("MYSQL_STREAM_CHUNK", "5000"))
+
+
+def utc_now():
+    """Giờ UTC hiện tại (naive), cùng múi giờ với các cột DateTime Prisma ghi vào MySQL"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class PoolTimeoutError(Exception):
+    """Hết thời gian chờ lấy connection từ pool"""
+
+
+class _PoolMetrics:
+    def __init__(self, size):
+        self.size = size
+        self.in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def record_checkout(self, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def record_release(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def record(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "pool_size": self.size,
+                "in_use": self.in_use,
+                "available": self.size - self.in_use,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "reconnects": self.reconnects,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 2) if self.checkouts else 0,
+                "wait_max_ms": round(self.wait_max * 1000, 2),
+            }
+
+
+# ---------------- SYNC POOL (cho các handler def) ----------------
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_SIZE)
+_last_used = {}          # connection_id -> time.monotonic() lần trả về pool gần nhất
+_last_used_lock = threading.Lock()
+sync_metrics = _PoolMetrics(POOL_SIZE)
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="ai_service_pool",
+                    pool_size=POOL_SIZE,
+                    pool_reset_session=True,
+                    **get_db_config()
+                )
+    return _pool
+
+
+@contextmanager
+def get_connection():
+    """Mượn 1 connection từ pool, tự trả lại khi ra khỏi khối with"""
+    start = time.perf_counter()
+    # MySQLConnectionPool báo lỗi ngay khi hết connection -> dùng semaphore để chờ có timeout
+    if not _pool_slots.acquire(timeout=CHECKOUT_TIMEOUT):
+        sync_metrics.record("timeouts")
+        raise PoolTimeoutError(f"Không lấy được kết nối MySQL sau {CHECKOUT_TIMEOUT}s")
+    conn = None
+    try:
+        conn = _get_pool().get_connection()
+        key = conn.connection_id
+        with _last_used_lock:
+            idle = time.monotonic() - _last_used.get(key, 0)
+        if idle > PING_INTERVAL:
+            conn.ping(reconnect=True, attempts=2, delay=0)
+            if conn.connection_id != key:
+                with _last_used_lock:
+                    _last_used.pop(key, None)
+                sync_metrics.record("reconnects")
+        sync_metrics.record_checkout(time.perf_counter() - start)
+    except Exception:
+        sync_metrics.record("errors")
+        if conn is not None:
+            conn.close()
+        _pool_slots.release()
+        raise
+
+    try:
+        yield conn
+    finally:
+        with _last_used_lock:
+            _last_used[conn.connection_id] = time.monotonic()
+        try:
+            conn.close()  # với PooledMySQLConnection, close() = trả về pool
+        finally:
+            sync_metrics.record_release()
+            _pool_slots.release()
+
+
+def fetch_all(sql, params=None):
+    """Chạy 1 câu SELECT và trả về list dict"""
+    with tracing.stage("db"), get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(sql, params or ())
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    tracing.size("db", "rows", len(rows))
+    return rows
+
+
+# ---------------- LOADER DẠNG CỘT (cho các phân tích đọc nhiều dòng) ----------------
+def _to_columns(rows, schema):
+    """list tuple -> {cột: np.ndarray}; schema = {tên cột: dtype numpy} theo đúng thứ tự SELECT"""
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    return {name: np.array(values, dtype=dtype) for (name, dtype), values in zip(schema.items(), columns)}
+
+
+class _ColumnBuffer:
+    """Mảng numpy tăng dung lượng gấp đôi khi đầy, tránh giữ list Python của cả kết quả"""
+
+    def __init__(self, dtype, capacity):
+        self.data = np.empty(capacity, dtype=dtype)
+        self.size = 0
+
+    def extend(self, values):
+        end = self.size + len(values)
+        if end > len(self.data):
+            grown = np.empty(max(end, 2 * len(self.data)), dtype=self.data.dtype)
+            grown[:self.size] = self.data[:self.size]
+            self.data = grown
+        self.data[self.size:end] = values
+        self.size = end
+
+    def array(self):
+        return self.data[:self.size].copy() if self.size < len(self.data) else self.data
+
+
+def concat_columns(chunks, schema, chunk_size=STREAM_CHUNK):
+    """Ghép các lô {cột: mảng} thành 1 bộ cột duy nhất"""
+    buffers = {name: _ColumnBuffer(dtype, chunk_size) for name, dtype in schema.items()}
+    for chunk in chunks:
+        for name, buffer in buffers.items():
+            buffer.extend(chunk[name])
+    return {name: buffer.array() for name, buffer in buffers.items()}
+
+
+def iter_columns(sql, params=None, schema=None, chunk_size=STREAM_CHUNK):
+    """
+    Chạy SELECT với cursor không buffer (dòng được đọc dần từ server) và trả về từng lô tối đa
+    chunk_size dòng dưới dạng {cột: np.ndarray} -> RAM chỉ giữ 1 lô tuple Python tại một thời điểm,
+    không tạo dict cho từng dòng. Cột số nguyên phải NOT NULL (float/datetime: NULL -> nan/NaT).
+    """
+    with get_connection() as conn:
+        cursor = conn.cursor(buffered=False)
+        exhausted = False
+        try:
+            t = time.perf_counter()
+            cursor.execute(sql, params or ())
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    exhausted = True
+                    break
+                chunk = _to_columns(rows, schema)
+                tracing.record("db", time.perf_counter() - t)
+                tracing.size("db", "rows", len(rows))
+                yield chunk
+                t = time.perf_counter()
+        finally:
+            if not exhausted:
+                # Người gọi dừng giữa chừng: đọc bỏ phần còn lại trước khi trả connection về pool
+                conn.consume_results()
+            cursor.close()
+
+
+def fetch_columns(sql, params=None, schema=None, chunk_size=STREAM_CHUNK):
+    """Toàn bộ kết quả dạng {cột: np.ndarray}, đọc theo lô (đỉnh RAM ~ kích thước mảng + 1 lô)"""
+    return concat_columns(iter_columns(sql, params, schema, chunk_size), schema, chunk_size)
+
+
+# ---------------- ASYNC POOL (cho các endpoint async def) ----------------
+_async_pool = None
+_async_pool_lock = None
+async_metrics = _PoolMetrics(ASYNC_POOL_SIZE)
+
+
+async def _get_async_pool():
+    global _async_pool, _async_pool_lock
+    if _async_pool is None:
+        if _async_pool_lock is None:
+            _async_pool_lock = asyncio.Lock()
+        async with _async_pool_lock:
+            if _async_pool is None:
+                cfg = get_db_config()
+                _async_pool = await aiomysql.create_pool(
+                    host=cfg["host"],
+                    port=cfg["port"],
+                    user=cfg["user"],
+                    password=cfg["password"],
+                    db=cfg["database"],
+                    minsize=1,
+                    maxsize=ASYNC_POOL_SIZE,
+                    pool_recycle=POOL_RECYCLE,
+                    autocommit=True,
+                    charset="utf8mb4",
+                )
+    return _async_pool
+
+
+@asynccontextmanager
+async def get_async_connection():
+    """Phiên bản async của get_connection()"""
+    start = time.perf_counter()
+    pool = await _get_async_pool()
+    try:
+        conn = await asyncio.wait_for(pool.acquire(), timeout=CHECKOUT_TIMEOUT)
+    except asyncio.TimeoutError:
+        async_metrics.record("timeouts")
+        raise PoolTimeoutError(f"Không lấy được kết nối MySQL sau {CHECKOUT_TIMEOUT}s")
+    try:
+        await conn.ping(reconnect=True)
+    except Exception:
+        async_metrics.record("errors")
+        pool.release(conn)
+        raise
+    async_metrics.record_checkout(time.perf_counter() - start)
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+        async_metrics.record_release()
+
+
+async def fetch_all_async(sql, params=None):
+    with tracing.stage("db"):
+        async with get_async_connection() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(sql, params or ())
+                rows = list(await cursor.fetchall())
+    tracing.size("db", "rows", len(rows))
+    return rows
+
+
+async def close_pools():
+    global _async_pool
+    if _async_pool is not None:
+        _async_pool.close()
+        await _async_pool.wait_closed()
+        _async_pool = None
+
+
+def pool_stats():
+    return {"sync": sync_metrics.snapshot(), "async": async_metrics.snapshot()}
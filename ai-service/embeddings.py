@@ -0,0 +1,219 @@
+# ai_service/embeddings.py
+# Nạp model embedding (PyTorch / ONNX / ONNX int8) + cache vector câu hỏi + gom câu hỏi đồng thời thành 1 lần encode
+import os
+import re
+import time
+import queue
+import threading
+import unicodedata
+from concurrent.futures import Future
+
+import numpy as np
+
+import tracing
+from cache import TTLCache
+
+CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "2048"))
+CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", "3600"))
+BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+
+MODEL_NAME = os.getenv("EMBED_MODEL", "keepitreal/vietnamese-sbert")
+# torch: SentenceTransformer gốc; onnx: ONNX Runtime (fp32); onnx-int8: ONNX lượng tử hoá động int8
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+BACKENDS = ("torch", "onnx", "onnx-int8")
+# Bộ lệnh CPU dùng khi lượng tử hoá: arm64 | avx2 | avx512 | avx512_vnni
+QUANT_CONFIG = os.getenv("EMBED_QUANT_CONFIG", "avx2")
+MODEL_DIR = os.getenv("AI_MODEL_DIR", "./model_store")
+
+
+def load_model(backend=EMBED_BACKEND):
+    """
+    Trả về model có cùng giao diện .encode(texts) cho mọi backend.
+    Bản int8 được xuất 1 lần vào AI_MODEL_DIR rồi dùng lại ở các lần khởi động sau.
+    Đổi backend khi Chroma đã có vector của backend khác: xem /api/ai/embedding-benchmark,
+    độ khớp thấp thì chạy /api/ai/sync-rag?mode=full.
+    """
+    from sentence_transformers import SentenceTransformer
+    if backend not in BACKENDS:
+        raise ValueError(f"EMBED_BACKEND phải là một trong {BACKENDS}")
+    if backend == "torch":
+        return SentenceTransformer(MODEL_NAME)
+    if backend == "onnx":
+        return SentenceTransformer(MODEL_NAME, backend="onnx")
+
+    file_name = f"model_qint8_{QUANT_CONFIG}.onnx"
+    path = os.path.join(MODEL_DIR, "embed-" + MODEL_NAME.replace("/", "--"))
+    if not os.path.exists(os.path.join(path, "onnx", file_name)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        model = SentenceTransformer(MODEL_NAME, backend="onnx")
+        model.save(path)
+        export_dynamic_quantized_onnx_model(model, QUANT_CONFIG, path)
+    return SentenceTransformer(path, backend="onnx", model_kwargs={"file_name": os.path.join("onnx", file_name)})
+
+
+def normalize_query(text):
+    """'  Áo thun   NAM?? ' -> 'áo thun nam'"""
+    text = unicodedata.normalize("NFC", text or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class MicroBatchEncoder:
+    """
+    Các request chatbot chạy song song trong threadpool của FastAPI.
+    Thay vì mỗi request gọi encode() riêng, các câu hỏi đến trong vòng vài ms
+    được gom lại và encode một lần.
+    """
+
+    def __init__(self, encode_fn, max_wait_ms=BATCH_WAIT_MS, max_batch=BATCH_MAX_SIZE):
+        self.encode_fn = encode_fn
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_batch_seen = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            with self._start_lock:
+                if self._worker is None or not self._worker.is_alive():
+                    self._worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                    self._worker.start()
+
+    def submit(self, text):
+        self._ensure_worker()
+        fut = Future()
+        self._queue.put((text, fut))
+        return fut
+
+    def encode(self, text, timeout=None):
+        return self.submit(text).result(timeout=timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch):
+        # Câu hỏi trùng nhau trong cùng 1 lô chỉ encode 1 lần
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            vectors = np.asarray(self.encode_fn(unique_texts))
+        except Exception as e:
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+        index = {text: i for i, text in enumerate(unique_texts)}
+        for text, fut in batch:
+            fut.set_result(vectors[index[text]])
+        with self._stats_lock:
+            self.batches += 1
+            self.items += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "queries": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0,
+                "max_batch_size": self.max_batch_seen,
+            }
+
+
+class QueryEncoder:
+    """Encode câu hỏi của khách: tra cache trước, nếu miss thì đưa vào micro-batch"""
+
+    def __init__(self, model, backend=EMBED_BACKEND):
+        self.backend = backend
+        self.cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+        self.batcher = MicroBatchEncoder(model.encode)
+
+    def encode(self, text):
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            with tracing.stage("embed"):
+                vector = self.batcher.encode(key)
+            self.cache.put(key, vector)
+        return vector
+
+    def stats(self):
+        return {"backend": self.backend, "cache": self.cache.stats(), "batcher": self.batcher.stats()}
+
+
+DEFAULT_BENCH_QUERIES = [
+    "áo thun nam màu đen", "váy đi biển mùa hè", "quần jeans nữ dưới 300k", "áo khoác mùa đông",
+    "đồ công sở thanh lịch", "áo sơ mi trắng", "chân váy ngắn", "hoodie unisex", "quần short thể thao",
+    "đầm dự tiệc sang trọng",
+]
+
+
+def _normalized(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def compare_backends(documents, queries=None, backends=BACKENDS, k=5, baseline="torch", models=None):
+    """
+    So sánh các backend trên cùng danh mục: thời gian encode cả danh mục (docs/s), độ trễ
+    encode 1 câu hỏi (p50/p95), độ giống vector so với baseline và tỉ lệ trùng top-k truy xuất.
+    models: {backend: model} đã nạp sẵn (vd. model đang phục vụ) để khỏi nạp lại.
+    """
+    queries = queries or DEFAULT_BENCH_QUERIES
+    models = dict(models or {})
+    k = min(k, len(documents))
+    results, doc_vectors, top_k = {}, {}, {}
+    for backend in dict.fromkeys([baseline, *backends]):
+        t = time.perf_counter()
+        model = models.get(backend) or load_model(backend)
+        load_ms = (time.perf_counter() - t) * 1000
+
+        t = time.perf_counter()
+        docs = _normalized(model.encode(documents, batch_size=32))
+        encode_s = time.perf_counter() - t
+
+        latencies = []
+        query_vectors = []
+        for q in queries:
+            t = time.perf_counter()
+            query_vectors.append(model.encode([q])[0])
+            latencies.append((time.perf_counter() - t) * 1000)
+        query_vectors = _normalized(query_vectors)
+        latencies.sort()
+
+        doc_vectors[backend] = docs
+        top_k[backend] = np.argsort(-(query_vectors @ docs.T), axis=1)[:, :k]
+        results[backend] = {
+            "load_ms": round(load_ms, 1),
+            "docs_per_s": round(len(documents) / encode_s, 1) if encode_s else None,
+            "query_p50_ms": round(latencies[len(latencies) // 2], 2),
+            "query_p95_ms": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 2),
+        }
+
+    base_docs, base_top = doc_vectors[baseline], top_k[baseline]
+    for backend, report in results.items():
+        docs = doc_vectors[backend]
+        if docs.shape == base_docs.shape:
+            report["vector_cosine_vs_baseline"] = round(float(np.mean(np.sum(docs * base_docs, axis=1))), 4)
+        overlap = [len(set(a) & set(b)) / k for a, b in zip(top_k[backend], base_top)] if k else []
+        report[f"top{k}_agreement"] = round(float(np.mean(overlap)), 4) if overlap else None
+        report["speedup_vs_baseline"] = round(report["docs_per_s"] / results[baseline]["docs_per_s"], 2) \
+            if report["docs_per_s"] and results[baseline]["docs_per_s"] else None
+    return {"documents": len(documents), "queries": len(queries), "k": k, "baseline": baseline, "backends": results}
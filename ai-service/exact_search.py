@@ -0,0 +1,178 @@
+# ai_service/exact_search.py
+# Tìm vector chính xác (brute-force) bằng numpy cho danh mục nhỏ: 1 phép nhân ma trận thay cho
+# HNSW + SQLite của Chroma, và báo cáo recall@k của Chroma so với kết quả chính xác
+import os
+import time
+
+import numpy as np
+
+import tracing
+
+# Danh mục tối đa bao nhiêu sản phẩm thì retriever tự dùng tìm chính xác trong RAM thay cho Chroma.
+# Mỗi worker giữ 1 bản: 10k x 768 chiều float32 ~ 30 MB/worker; danh mục lớn hơn với nhiều worker
+# thì dùng ma trận mmap dùng chung (serve.py, AI_SHARED_VECTORS)
+EXACT_SEARCH_MAX = int(os.getenv("RAG_EXACT_SEARCH_MAX", "10000"))
+
+
+class VectorArrays:
+    """
+    Vector sản phẩm + các cột dùng để lọc, lưu thành mảng song song.
+    Khoảng cách giống Chroma (L2): |q - x|^2 = |q|^2 - 2 q.x + |x|^2 -> xếp theo |x|^2 - 2 q.x.
+    """
+
+    def __init__(self, version, vectors, ids, sq_norms, prices, stocks, category_codes, categories):
+        self.version = version
+        self.vectors = vectors
+        self.ids = ids
+        self.sq_norms = sq_norms
+        self.prices = prices
+        self.stocks = stocks
+        self.category_codes = category_codes
+        self.categories = list(categories)
+
+    @classmethod
+    def from_collection(cls, data, version=None):
+        """data: kết quả collection.get(include=["embeddings", "metadatas"])"""
+        metas = [m or {} for m in data["metadatas"]]
+        vectors = np.ascontiguousarray(np.asarray(data["embeddings"], dtype=np.float32).reshape(len(metas), -1)) \
+            if metas else np.empty((0, 0), dtype=np.float32)
+        categories, codes = np.unique(np.array([m.get("category", "") for m in metas], dtype=object),
+                                      return_inverse=True)
+        return cls(
+            version=version,
+            vectors=vectors,
+            ids=np.array([int(pid) for pid in data["ids"]], dtype=np.int64),
+            sq_norms=np.einsum("ij,ij->i", vectors, vectors),
+            prices=np.array([float(m.get("price_value", 0.0)) for m in metas], dtype=np.float64),
+            stocks=np.array([int(m.get("stock", 0)) for m in metas], dtype=np.int64),
+            category_codes=codes.astype(np.int32),
+            categories=categories.tolist(),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def mask(self, constraints, in_stock=True):
+        """Cùng điều kiện với retrieval.build_where, tính trên mảng"""
+        mask = np.ones(len(self.ids), dtype=bool)
+        if in_stock:
+            mask &= self.stocks > 0
+        if "max_price" in constraints:
+            mask &= self.prices <= float(constraints["max_price"])
+        if "min_price" in constraints:
+            mask &= self.prices >= float(constraints["min_price"])
+        if "category" in constraints:
+            category = constraints["category"]
+            mask &= self.category_codes == (self.categories.index(category) if category in self.categories else -1)
+        return mask
+
+    def top_k(self, queries, n, constraints=None, in_stock=True):
+        """
+        queries: 1 vector hoặc ma trận (m x dim) -> m danh sách id (chuỗi, như Chroma) của n sản phẩm
+        gần nhất thoả điều kiện; cả lô câu hỏi tính bằng 1 phép nhân ma trận.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        mask = self.mask(constraints or {}, in_stock)
+        n = min(n, int(mask.sum()))
+        if n <= 0:
+            return [[] for _ in range(len(queries))]
+        # Nhân với toàn bộ ma trận (không sao chép các dòng thoả điều kiện), dòng bị lọc = +inf
+        distances = self.sq_norms - 2.0 * (queries @ self.vectors.T)
+        distances[:, ~mask] = np.inf
+        part = np.argpartition(distances, n - 1, axis=1)[:, :n]
+        order = np.take_along_axis(
+            part, np.argsort(np.take_along_axis(distances, part, axis=1), axis=1, kind="stable"), axis=1)
+        return [[str(pid) for pid in self.ids[o].tolist()] for o in order]
+
+
+class ExactVectorIndex:
+    """Bản sao vector của collection trong RAM (float32 liên tục), dựng lại khi retriever dựng lại chỉ mục"""
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.queries = 0
+
+    @classmethod
+    def from_collection(cls, data):
+        return cls(VectorArrays.from_collection(data))
+
+    @property
+    def ready(self):
+        return True
+
+    def __len__(self):
+        return len(self.arrays)
+
+    def query(self, vector, n, constraints=None, in_stock=True):
+        with tracing.stage("vectors.query"):
+            ids = self.arrays.top_k(vector, n, constraints, in_stock)[0]
+        self.queries += 1
+        return ids
+
+    def query_batch(self, vectors, n, constraints=None, in_stock=True):
+        with tracing.stage("vectors.query"):
+            results = self.arrays.top_k(vectors, n, constraints, in_stock)
+        self.queries += len(results)
+        return results
+
+    def stats(self):
+        vectors = self.arrays.vectors
+        return {"count": len(self), "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+                "bytes": int(vectors.nbytes), "queries": self.queries}
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return round(values[min(int(len(values) * p), len(values) - 1)], 3) if values else None
+
+
+def recall_report(collection, query_vectors, k=5, in_stock=True, exact=None):
+    """
+    recall@k của Chroma (HNSW) so với tìm chính xác trên cùng collection: với mỗi câu hỏi,
+    tỉ lệ id trong top-k chính xác mà Chroma cũng trả về. Kèm độ trễ p50/p95 (ms) của từng cách.
+    """
+    if k < 1:
+        raise ValueError("k phải >= 1")
+    t = time.perf_counter()
+    if exact is None:
+        exact = ExactVectorIndex.from_collection(collection.get(include=["embeddings", "metadatas"]))
+    build_ms = (time.perf_counter() - t) * 1000
+    count = len(exact)
+    k = min(k, count)
+    if not count or not len(query_vectors):
+        return {"count": count, "k": k, "queries": 0, "recall": None}
+
+    where = {"stock": {"$gt": 0}} if in_stock else None
+    recalls, chroma_ms, exact_ms, misses = [], [], [], []
+    for i, vector in enumerate(query_vectors):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        t = time.perf_counter()
+        truth = exact.query(vector, k, in_stock=in_stock)
+        exact_ms.append((time.perf_counter() - t) * 1000)
+        t = time.perf_counter()
+        found = collection.query(query_embeddings=[vector.tolist()], n_results=k, where=where, include=[])["ids"][0]
+        chroma_ms.append((time.perf_counter() - t) * 1000)
+        if truth:
+            recall = len(set(found) & set(truth)) / len(truth)
+            recalls.append(recall)
+            if recall < 1:
+                misses.append({"query": i, "recall": round(recall, 3), "missing": [p for p in truth if p not in found]})
+
+    t = time.perf_counter()
+    exact.query_batch(np.asarray(query_vectors, dtype=np.float32), k, in_stock=in_stock)
+    batch_ms = (time.perf_counter() - t) * 1000
+    return {
+        "count": count,
+        "k": k,
+        "in_stock_filter": in_stock,
+        "queries": len(recalls),
+        "recall": round(float(np.mean(recalls)), 4) if recalls else None,
+        "recall_min": round(float(np.min(recalls)), 4) if recalls else None,
+        "perfect_ratio": round(sum(r == 1 for r in recalls) / len(recalls), 4) if recalls else None,
+        "latency_ms": {
+            "chroma_p50": _percentile(chroma_ms, 0.5), "chroma_p95": _percentile(chroma_ms, 0.95),
+            "exact_p50": _percentile(exact_ms, 0.5), "exact_p95": _percentile(exact_ms, 0.95),
+            "exact_batch_total": round(batch_ms, 3), "exact_build": round(build_ms, 1),
+        },
+        "misses": misses[:20],
+    }
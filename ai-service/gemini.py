@@ -0,0 +1,505 @@
+# ai_service/gemini.py
+# Client async dùng chung để gọi Gemini: keep-alive, giới hạn đồng thời + rate limit,
+# thử lại có jitter, circuit breaker và bộ đếm độ trễ/lỗi phía Gemini
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+
+import httpx
+
+import tracing
+from cache import TTLCache
+from embeddings import normalize_query
+
+# Đổi GEMINI_BASE_URL để chạy với server Gemini giả lập khi test/benchmark
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "18"))
+MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "20"))
+# Số lần gọi Gemini cùng lúc trên toàn service; chờ slot/token quá QUEUE_TIMEOUT giây thì báo bận
+MAX_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "8"))
+QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", "10"))
+RATE_PER_MINUTE = float(os.getenv("GEMINI_RPM", "60"))   # 0 = không giới hạn
+RATE_BURST = int(os.getenv("GEMINI_BURST", "10"))
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "2"))
+BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "8"))
+BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+# Tổng thời gian 1 câu hỏi chatbot (chờ slot + mọi lần thử + backoff): backend bỏ cuộc sau 20s
+# (CHATBOT_TIMEOUT_MS) nên không thử lại nếu không còn kịp trả lời trong hạn này
+CHAT_DEADLINE = float(os.getenv("GEMINI_CHAT_DEADLINE", "18"))
+
+# Ảnh gửi kèm được Gemini tính cố định ~258 token
+IMAGE_TOKENS = 258
+
+RESPONSE_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "1800"))
+
+
+class GeminiError(Exception):
+    """Gemini trả về lỗi hoặc không có candidates"""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        # 429 (hết quota tạm thời) và lỗi 5xx có thể thử lại
+        return self.status == 429 or (self.status is not None and self.status >= 500)
+
+
+class GeminiBadResponse(GeminiError):
+    """Gemini trả về JSON/SSE hỏng hoặc sai cấu trúc (thường do kết nối bị cắt giữa chừng) -> thử lại được"""
+
+    @property
+    def retryable(self):
+        return True
+
+
+class GeminiUnavailable(GeminiError):
+    """Không gọi Gemini: circuit breaker đang mở hoặc chờ slot/rate limit quá lâu (trả lời dự phòng ngay)"""
+
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(GEMINI_TIMEOUT, connect=5.0),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+            headers={"Content-Type": "application/json"},
+        )
+    return _client
+
+
+async def close_client():
+    global _client, _semaphore
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _semaphore = None
+
+
+def _url(method, api_key):
+    return f"{GEMINI_BASE_URL}/models/{GEMINI_MODEL}:{method}?key={api_key}"
+
+
+def estimate_tokens(text):
+    """Ước lượng số token (~4 byte UTF-8 / token) khi không muốn tốn 1 lần gọi countTokens"""
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def _record_prompt(payload, contents):
+    tokens = 0
+    for content in contents:
+        for part in content.get("parts", []):
+            if "text" in part:
+                tokens += estimate_tokens(part["text"])
+            elif "inline_data" in part:
+                tokens += IMAGE_TOKENS
+    tracing.size("gemini.prompt", "bytes", len(payload))
+    tracing.size("gemini.prompt", "tokens", tokens)
+
+
+def _encode_request(contents):
+    with tracing.stage("gemini.encode"):
+        payload = json.dumps({"contents": contents}, ensure_ascii=False).encode("utf-8")
+    _record_prompt(payload, contents)
+    return payload
+
+
+def _extract_text(result):
+    try:
+        if "candidates" not in result:
+            error_msg = result.get("error", {}).get("message", "Lỗi không xác định từ Gemini")
+            raise GeminiError(error_msg)
+        parts = result["candidates"][0].get("content", {}).get("parts", [])
+        return "".join(part.get("text", "") for part in parts)
+    except (AttributeError, KeyError, IndexError, TypeError) as e:
+        raise GeminiBadResponse(f"Phản hồi Gemini sai cấu trúc: {e!r}") from e
+
+
+def _parse_chunk(data):
+    """1 dòng 'data:' của SSE -> text; JSON hỏng thành GeminiBadResponse để vẫn qua _settle/breaker"""
+    try:
+        result = json.loads(data)
+    except ValueError as e:
+        raise GeminiBadResponse(f"Đoạn SSE không phải JSON hợp lệ: {e}") from e
+    return _extract_text(result)
+
+
+# ---------------- GIỚI HẠN / THỬ LẠI / CIRCUIT BREAKER ----------------
+
+class TokenBucket:
+    """Giới hạn số lần gọi/phút trên toàn service, cho phép dồn tối đa `burst` lần gọi liền nhau"""
+
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, deadline):
+        """Lấy 1 token, chờ tới khi có; quá `deadline` (monotonic) thì báo bận"""
+        if self.rate <= 0:
+            return
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            wait = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                raise GeminiUnavailable("Vượt giới hạn số lần gọi Gemini/phút")
+            await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Gemini lỗi (429/5xx/timeout) liên tiếp BREAKER_THRESHOLD lần -> mở mạch, mọi lần gọi trong
+    BREAKER_COOLDOWN giây bị từ chối ngay để endpoint trả câu dự phòng thay vì chờ timeout.
+    Hết thời gian chờ thì cho 1 lần gọi thử (half-open): thành công -> đóng mạch, lỗi -> mở lại.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        self.opened = 0
+
+    def allow(self):
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.cooldown:
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_started = None
+        if self.state == self.HALF_OPEN:
+            # Chỉ 1 lần gọi thử tại 1 thời điểm (lần thử bị huỷ giữa chừng thì sau GEMINI_TIMEOUT cho thử lại)
+            if self.probe_started is not None and now - self.probe_started < GEMINI_TIMEOUT:
+                return False
+            self.probe_started = now
+        return True
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_started = None
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                self.opened += 1
+                print(f">>> [PYTHON] Gemini lỗi {self.failures} lần liên tiếp, tạm ngưng gọi {self.cooldown:.0f}s")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.probe_started = None
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "retry_in_s": round(max(self.cooldown - (time.monotonic() - self.opened_at), 0), 1)
+            if self.state == self.OPEN else 0,
+        }
+
+
+class _UpstreamMetrics:
+    def __init__(self):
+        self.calls = 0
+        self.ok = 0
+        self.errors = {}          # loại lỗi -> số lần (http_429, http_503, timeout, network, ...)
+        self.retries = 0
+        self.rejected = 0         # bị từ chối ngay (circuit mở / chờ quá lâu)
+        self.in_flight = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.queue_wait_total = 0.0
+
+    def attempt(self, seconds, error_kind=None):
+        self.calls += 1
+        self.latency_total += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        if error_kind is None:
+            self.ok += 1
+        else:
+            self.errors[error_kind] = self.errors.get(error_kind, 0) + 1
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "ok": self.ok,
+            "errors": dict(self.errors),
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+            "latency_avg_ms": round(self.latency_total / self.calls * 1000, 1) if self.calls else 0,
+            "latency_max_ms": round(self.latency_max * 1000, 1),
+            "queue_wait_avg_ms": round(self.queue_wait_total / self.calls * 1000, 1) if self.calls else 0,
+        }
+
+
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+bucket = TokenBucket(RATE_PER_MINUTE, RATE_BURST)
+metrics = _UpstreamMetrics()
+_semaphore = None
+
+
+def _error_kind(error):
+    if isinstance(error, GeminiError):
+        return f"http_{error.status}" if error.status else "bad_response"
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    return "network"
+
+
+def _is_retryable(error):
+    if isinstance(error, GeminiError):
+        return error.retryable
+    return isinstance(error, httpx.TransportError)
+
+
+def _backoff(attempt, error):
+    """Chờ theo lũy thừa 2 có jitter ngẫu nhiên; 429 có Retry-After thì theo Gemini"""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after:
+        return min(retry_after, BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX))
+
+
+def _check_circuit():
+    if not breaker.allow():
+        metrics.rejected += 1
+        raise GeminiUnavailable("Gemini đang tạm ngưng do lỗi liên tiếp")
+
+
+def _remaining(deadline):
+    """Số giây còn lại tới deadline (time.monotonic()); None = không giới hạn tổng"""
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def _attempt_timeout(timeout, deadline):
+    timeout = timeout or GEMINI_TIMEOUT
+    remaining = _remaining(deadline)
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise GeminiUnavailable("Hết thời gian chờ Gemini cho yêu cầu này")
+    return min(timeout, remaining)
+
+
+def _can_retry(delay, deadline):
+    remaining = _remaining(deadline)
+    return remaining is None or delay < remaining
+
+
+@asynccontextmanager
+async def _slot(request_deadline=None):
+    """
+    Giữ 1 chỗ trong giới hạn số lần gọi đồng thời + 1 token rate limit; chờ quá QUEUE_TIMEOUT
+    (hoặc quá deadline của cả yêu cầu) thì báo bận
+    """
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    t0 = time.monotonic()
+    deadline = t0 + QUEUE_TIMEOUT
+    if request_deadline is not None:
+        deadline = min(deadline, request_deadline)
+    try:
+        await asyncio.wait_for(_semaphore.acquire(), max(deadline - t0, 0))
+    except asyncio.TimeoutError:
+        metrics.rejected += 1
+        raise GeminiUnavailable("Quá nhiều yêu cầu đang chờ Gemini")
+    try:
+        try:
+            await bucket.acquire(deadline)
+        except GeminiUnavailable:
+            metrics.rejected += 1
+            raise
+        waited = time.monotonic() - t0
+        metrics.queue_wait_total += waited
+        tracing.record("gemini.queue", waited)
+        metrics.in_flight += 1
+        try:
+            yield
+        finally:
+            metrics.in_flight -= 1
+    finally:
+        _semaphore.release()
+
+
+def _settle(t0, error=None):
+    """Ghi nhận kết quả 1 lần gọi; trả về True nếu nên thử lại"""
+    metrics.attempt(time.monotonic() - t0, None if error is None else _error_kind(error))
+    if error is None:
+        breaker.success()
+        return False
+    if _is_retryable(error):
+        breaker.failure()
+        return True
+    # Lỗi do request (400, 403...) không có nghĩa Gemini đang sập
+    breaker.success()
+    return False
+
+
+def _raise_for_status(response, result):
+    if response.status_code != 200:
+        error_msg = result.get("error", {}).get("message", "") if isinstance(result, dict) else ""
+        retry_after = response.headers.get("Retry-After")
+        raise GeminiError(f"HTTP {response.status_code} {error_msg}".strip(), status=response.status_code,
+                          retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+
+
+async def _generate_once(payload, api_key, timeout):
+    with tracing.stage("gemini"):
+        response = await get_client().post(
+            _url("generateContent", api_key),
+            content=payload,
+            timeout=timeout or GEMINI_TIMEOUT,
+        )
+    try:
+        with tracing.stage("gemini.decode"):
+            result = response.json()
+    except ValueError:
+        if response.status_code == 200:
+            raise GeminiBadResponse("HTTP 200 nhưng body không phải JSON hợp lệ")
+        raise GeminiError(f"HTTP {response.status_code}", status=response.status_code)
+    _raise_for_status(response, result)
+    return _extract_text(result)
+
+
+async def generate(contents, api_key, timeout=None, deadline=None):
+    """
+    Gọi generateContent, trả về toàn bộ câu trả lời (tự thử lại khi 429/5xx/mất kết nối).
+    timeout: giới hạn mỗi lần gọi; deadline (time.monotonic()): hạn chót của cả yêu cầu, mỗi lần gọi
+    chỉ được dùng phần thời gian còn lại và không thử lại khi backoff vượt quá hạn.
+    """
+    payload = _encode_request(contents)
+    for attempt in range(MAX_RETRIES + 1):
+        _check_circuit()
+        async with _slot(deadline):
+            attempt_timeout = _attempt_timeout(timeout, deadline)
+            t0 = time.monotonic()
+            try:
+                text = await _generate_once(payload, api_key, attempt_timeout)
+            except (GeminiError, httpx.HTTPError) as e:
+                if not _settle(t0, e) or attempt == MAX_RETRIES:
+                    raise
+                delay = _backoff(attempt, e)
+                if not _can_retry(delay, deadline):
+                    raise
+            else:
+                _settle(t0)
+                return text
+        metrics.retries += 1
+        await asyncio.sleep(delay)
+
+
+async def _stream_once(payload, api_key, timeout):
+    t0 = time.perf_counter()
+    first_chunk = True
+    async with get_client().stream(
+        "POST",
+        _url("streamGenerateContent", api_key) + "&alt=sse",
+        content=payload,
+        timeout=timeout or GEMINI_TIMEOUT,
+    ) as response:
+        if response.status_code != 200:
+            body = await response.aread()
+            try:
+                result = json.loads(body)
+            except ValueError:
+                result = {}
+            _raise_for_status(response, result)
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = _parse_chunk(line[5:].strip())
+            if chunk:
+                if first_chunk:
+                    # Thời gian tới đoạn đầu tiên (time-to-first-token)
+                    tracing.record("gemini.first_chunk", time.perf_counter() - t0)
+                    first_chunk = False
+                yield chunk
+    tracing.record("gemini", time.perf_counter() - t0)
+
+
+async def stream_generate(contents, api_key, timeout=None, deadline=None):
+    """
+    Gọi streamGenerateContent (SSE), trả về từng đoạn text ngay khi Gemini sinh ra.
+    Chỉ thử lại khi chưa có đoạn nào được trả về (không lặp nội dung phía client) và còn kịp deadline.
+    """
+    payload = _encode_request(contents)
+    for attempt in range(MAX_RETRIES + 1):
+        _check_circuit()
+        delay = None
+        async with _slot(deadline):
+            attempt_timeout = _attempt_timeout(timeout, deadline)
+            t0 = time.monotonic()
+            started = False
+            try:
+                async for chunk in _stream_once(payload, api_key, attempt_timeout):
+                    started = True
+                    yield chunk
+            except (GeminiError, httpx.HTTPError) as e:
+                if not _settle(t0, e) or started or attempt == MAX_RETRIES:
+                    raise
+                delay = _backoff(attempt, e)
+                if not _can_retry(delay, deadline):
+                    raise
+            else:
+                _settle(t0)
+                return
+        metrics.retries += 1
+        await asyncio.sleep(delay)
+
+
+def stats():
+    return {
+        "limits": {
+            "concurrency": MAX_CONCURRENCY,
+            "rpm": RATE_PER_MINUTE,
+            "burst": RATE_BURST,
+            "max_retries": MAX_RETRIES,
+            "queue_timeout_s": QUEUE_TIMEOUT,
+            "chat_deadline_s": CHAT_DEADLINE,
+        },
+        "upstream": metrics.stats(),
+        "circuit": breaker.stats(),
+    }
+
+
+# ---------------- CACHE CÂU TRẢ LỜI CHATBOT ----------------
+response_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+
+def chat_cache_key(product_ids, question, history):
+    """Khoá cache = (tập sản phẩm RAG tìm được, câu hỏi đã chuẩn hoá, lịch sử đã cắt)"""
+    raw = json.dumps({
+        "products": sorted(str(pid) for pid in product_ids),
+        "question": normalize_query(question),
+        "history": [[role, normalize_query(text)] for role, text in history],
+    }, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
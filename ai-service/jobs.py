@@ -0,0 +1,468 @@
+# ai_service/jobs.py
+# Bộ lập lịch job nền: chạy các phân tích nặng định kỳ/theo yêu cầu, lưu kết quả mới nhất để API trả ngay
+import os
+import time
+import pickle
+import asyncio
+import inspect
+import threading
+import functools
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+
+import tracing
+
+JOB_THREADS = int(os.getenv("JOB_THREADS", "4"))
+# Worker process được giữ sống giữa các lần chạy nên state tăng dần (model, watermark) vẫn còn
+JOB_PROCESSES = int(os.getenv("JOB_PROCESSES", "1"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "300"))
+SCHEDULER_ENABLED = os.getenv("JOB_SCHEDULER", "1") == "1"
+TICK_SECONDS = 1.0
+# serve.py nhiều worker: thư mục worker chủ công bố kết quả job ghi dữ liệu + nhận yêu cầu từ worker khác
+JOB_SHARED_DIR = os.getenv("JOB_SHARED_DIR", os.path.join(os.getenv("AI_MODEL_DIR", "./model_store"), "jobs"))
+SHARED_POLL_SECONDS = float(os.getenv("JOB_SHARED_POLL", "0.5"))
+REQUEST_MARK = ".request."
+
+THREAD, PROCESS, ASYNC = "thread", "process", "async"
+
+
+def call_path(path, **kwargs):
+    """
+    Chạy hàm theo đường dẫn 'module.hàm' bên trong worker process: process chính không cần
+    import module đó (vd. segmentation kéo theo pandas/sklearn) chỉ để đăng ký job.
+    """
+    import importlib
+    module_name, fn_name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), fn_name)(**kwargs)
+
+
+def _call_args(fn, kwargs):
+    """Tham số thực tế của 1 lần chạy (gồm cả giá trị mặc định) để so 2 lần gọi cùng job"""
+    args = {}
+    try:
+        for name, param in inspect.signature(fn).parameters.items():
+            if param.default is not param.empty:
+                args[name] = param.default
+    except (TypeError, ValueError):
+        pass
+    if isinstance(fn, functools.partial):
+        args.update(fn.keywords)
+    args.update(kwargs)
+    return args
+
+
+class JobFailed(Exception):
+    """Job chạy lỗi và chưa có kết quả cũ nào để trả về"""
+
+
+class JobUnavailable(JobFailed):
+    """Job ghi dữ liệu chỉ chạy ở worker chủ và worker chủ chưa công bố kết quả nào"""
+
+
+class _Queued(Future):
+    """Lần chạy được xếp hàng sau lần đang chạy (khác tham số); nhận kết quả của lần chạy đó khi xong"""
+
+
+class Job:
+    def __init__(self, name, fn, kind=THREAD, interval=0, writer=False):
+        self.name = name
+        self.fn = fn
+        self.kind = kind
+        self.interval = interval      # giây; 0 = chỉ chạy khi được gọi
+        self.writer = writer          # ghi Chroma/SQLite/file model -> chỉ 1 worker được chạy
+        self.result = None
+        self.computed_at = None
+        self.duration_ms = None
+        self.error = None
+        self.runs = 0
+        self.failures = 0
+        self.deduplicated = 0
+        self.started_at = None        # time.monotonic() của lần chạy gần nhất
+        self.args = None              # tham số của lần chạy gần nhất
+        self.future = None            # lần chạy đang diễn ra (nếu có)
+        self.queued = []              # [(tham số, kwargs, _Queued)] chờ lần đang chạy xong
+        self.settled = None           # future đã được ghi nhận kết quả
+        self.shared_key = None        # (inode, mtime) file kết quả chung đã nạp (worker không phải chủ)
+
+    @property
+    def running(self):
+        return self.future is not None and not self.future.done()
+
+    def status(self):
+        return {
+            "kind": self.kind,
+            "interval_s": self.interval,
+            "writer": self.writer,
+            "running": self.running,
+            "has_result": self.computed_at is not None,
+            "computed_at": self.computed_at.isoformat() if self.computed_at else None,
+            "duration_ms": self.duration_ms,
+            "runs": self.runs,
+            "failures": self.failures,
+            "deduplicated": self.deduplicated,
+            "queued": len(self.queued),
+            "last_args": self.args,
+            "last_error": self.error,
+        }
+
+
+class JobScheduler:
+    def __init__(self):
+        self.jobs = {}
+        self.loop = None
+        self._threads = None
+        self._processes = None
+        self._ticker = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.shared_dir = None        # None = 1 process, mọi job chạy tại chỗ
+        self.owner = True
+
+    def register(self, name, fn, kind=THREAD, interval=0, writer=False):
+        """
+        fn: hàm trả về kết quả (thread/process) hoặc coroutine function (async)
+        writer=True: job ghi dữ liệu dùng chung, khi share() chỉ worker chủ chạy
+        """
+        self.jobs[name] = Job(name, fn, kind, interval, writer)
+
+    def share(self, directory, owner):
+        """
+        Nhiều worker (serve.py): job writer chỉ chạy ở worker chủ, kết quả được công bố vào
+        `directory`; worker khác đọc kết quả đó, cần tính lại thì ghi file yêu cầu cho worker chủ.
+        Phải gọi trước start().
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.shared_dir = directory
+        self.owner = owner
+
+    def _remote(self, job):
+        return job.writer and self.shared_dir is not None and not self.owner
+
+    # ---------- vòng đời ----------
+
+    def start(self, loop=None):
+        self.loop = loop
+        self._threads = ThreadPoolExecutor(max_workers=JOB_THREADS, thread_name_prefix="job")
+        # spawn thay vì fork: không kế thừa socket MySQL / thread của process chính
+        self._processes = ProcessPoolExecutor(
+            max_workers=JOB_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+        )
+        if SCHEDULER_ENABLED or (self.shared_dir is not None and self.owner):
+            self._stop.clear()
+            self._ticker = threading.Thread(target=self._run_ticker, name="job-ticker", daemon=True)
+            self._ticker.start()
+
+    def stop(self):
+        self._stop.set()
+        for executor in (self._threads, self._processes):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run_ticker(self):
+        while not self._stop.wait(TICK_SECONDS):
+            if self.shared_dir is not None and self.owner:
+                self._take_requests()
+            if not SCHEDULER_ENABLED:
+                continue
+            now = time.monotonic()
+            for job in list(self.jobs.values()):
+                if self._remote(job):
+                    continue
+                if job.interval > 0 and not job.running and (
+                        job.started_at is None or now - job.started_at >= job.interval):
+                    try:
+                        self.kick(job.name)
+                    except Exception as e:
+                        print(f">>> [PYTHON] Không chạy được job {job.name}: {e}")
+
+    # ---------- chạy job ----------
+
+    def _submit(self, job, kwargs):
+        if job.kind == PROCESS:
+            return self._processes.submit(job.fn, **kwargs)
+        if job.kind == ASYNC:
+            if self.loop is None:
+                raise RuntimeError(f"Job {job.name} cần event loop, gọi start(loop) trước")
+            return asyncio.run_coroutine_threadsafe(
+                tracing.bind_async(f"job:{job.name}", job.fn(**kwargs)), self.loop)
+        return self._threads.submit(tracing.bind(f"job:{job.name}", job.fn), **kwargs)
+
+    def _start(self, job, kwargs, args):
+        """Gọi khi đang giữ self._lock; done-callback phải gắn sau khi nhả lock (xem _watch)"""
+        job.started_at = time.monotonic()
+        job.runs += 1
+        job.args = args
+        job.future = self._submit(job, kwargs)
+        return job.future, job.started_at
+
+    def _watch(self, job, future, t0):
+        # Future đã xong thì add_done_callback gọi _finish ngay trong thread này -> không được giữ
+        # self._lock ở đây (Lock không re-entrant, _finish cũng lấy lock)
+        future.add_done_callback(lambda f: self._finish(job, f, t0))
+
+    def trigger(self, name, **kwargs):
+        """
+        Chạy job nếu nó chưa chạy. Đang chạy với cùng tham số (tính cả giá trị mặc định) thì trả về
+        future của lần chạy đó (không chạy trùng); khác tham số (vd. force=True khi lần định kỳ đang
+        chạy) thì xếp hàng chạy lại ngay sau lần đó, người gọi nhận kết quả của lần chạy của mình.
+        """
+        job = self.jobs[name]
+        if self._remote(job):
+            raise JobUnavailable(f"Job {name} chỉ chạy ở worker chủ")
+        args = _call_args(job.fn, kwargs)
+        with self._lock:
+            if job.running:
+                job.deduplicated += 1
+                if args == job.args:
+                    return job.future
+                for queued_args, _, waiter in job.queued:
+                    if queued_args == args:
+                        return waiter
+                waiter = _Queued()
+                job.queued.append((args, kwargs, waiter))
+                return waiter
+            future, t0 = self._start(job, kwargs, args)
+        self._watch(job, future, t0)
+        return future
+
+    def kick(self, name):
+        """Chạy job ở nền với tham số mặc định; đang chạy (bất kể tham số) thì thôi"""
+        job = self.jobs[name]
+        if self._remote(job):
+            self._request(job, {})
+            return None
+        with self._lock:
+            if job.running:
+                job.deduplicated += 1
+                return job.future
+            future, t0 = self._start(job, {}, _call_args(job.fn, {}))
+        self._watch(job, future, t0)
+        return future
+
+    def _run_queued(self, job):
+        """Lần chạy vừa xong -> chạy lần đầu tiên đang xếp hàng, chuyển kết quả sang future của người chờ"""
+        with self._lock:
+            if job.running or not job.queued:
+                return
+            args, kwargs, waiter = job.queued.pop(0)
+            try:
+                future, t0 = self._start(job, kwargs, args)
+            except Exception as e:
+                waiter.set_exception(e)
+                return
+        self._watch(job, future, t0)
+
+        def relay(f):
+            if f.cancelled():
+                waiter.set_exception(JobFailed(f"Job {job.name} bị huỷ"))
+            elif f.exception() is not None:
+                waiter.set_exception(f.exception())
+            else:
+                waiter.set_result(f.result())
+
+        # Gắn sau _watch -> kết quả đã được ghi vào job trước khi người chờ thức dậy
+        future.add_done_callback(relay)
+
+    def _finish(self, job, future, t0):
+        # Gọi từ done-callback và từ nơi đang chờ kết quả (callback có thể chạy sau khi waiter đã thức)
+        if isinstance(future, _Queued):
+            return  # kết quả đã được ghi từ future của lần chạy thật
+        with self._lock:
+            if job.settled is future:
+                return
+            job.settled = future
+        try:
+            if not future.cancelled():
+                self._record(job, future, t0)
+                if job.writer and self.shared_dir is not None:
+                    self._publish(job)
+        finally:
+            self._run_queued(job)
+
+    def _record(self, job, future, t0):
+        error = future.exception()
+        job.duration_ms = round((time.monotonic() - t0) * 1000, 1)
+        tracing.JOB_SECONDS.observe(job.duration_ms / 1000, job=job.name, outcome="error" if error else "ok")
+        if error is not None:
+            job.failures += 1
+            job.error = f"{type(error).__name__}: {error}"
+            print(f">>> [PYTHON] Job {job.name} lỗi: {job.error}")
+            return
+        job.result = future.result()
+        job.computed_at = datetime.now()
+        job.error = None
+
+    # ---------- job writer dùng chung giữa các worker (share) ----------
+
+    def _shared_path(self, job):
+        return os.path.join(self.shared_dir, f"{job.name}.pkl")
+
+    def _publish(self, job):
+        """Worker chủ: ghi kết quả + lỗi gần nhất ra file (os.replace -> worker khác không đọc bản dở dang)"""
+        state = {"result": job.result, "computed_at": job.computed_at, "duration_ms": job.duration_ms,
+                 "error": job.error}
+        path = self._shared_path(job)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f">>> [PYTHON] Không công bố được kết quả job {job.name}: {e}")
+
+    def _load_shared(self, job):
+        """Worker khác: nạp kết quả worker chủ đã công bố; chỉ đọc lại khi file được thay"""
+        try:
+            st = os.stat(self._shared_path(job))
+        except FileNotFoundError:
+            return False
+        key = (st.st_ino, st.st_mtime_ns)
+        if key == job.shared_key:
+            return True
+        with open(self._shared_path(job), "rb") as f:
+            state = pickle.load(f)
+        with self._lock:
+            job.result, job.computed_at = state["result"], state["computed_at"]
+            job.duration_ms, job.error = state["duration_ms"], state["error"]
+            job.shared_key = key
+        return True
+
+    def _request(self, job, kwargs):
+        """Worker khác: ghi file yêu cầu chạy job; worker chủ tạo file <yêu cầu>.done khi lần chạy đó xong"""
+        path = os.path.join(self.shared_dir, f"{job.name}{REQUEST_MARK}{os.getpid()}.{time.time_ns()}")
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(kwargs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def _take_requests(self):
+        """Worker chủ (ticker): chạy các yêu cầu từ worker khác, lần chạy xong thì đánh dấu .done"""
+        try:
+            names = os.listdir(self.shared_dir)
+        except FileNotFoundError:
+            return
+        for file_name in names:
+            name, mark, _ = file_name.partition(REQUEST_MARK)
+            if not mark or file_name.endswith((".tmp", ".done")):
+                continue
+            path = os.path.join(self.shared_dir, file_name)
+            try:
+                with open(path, "rb") as f:
+                    kwargs = pickle.load(f)
+                os.remove(path)
+                future = self.trigger(name, **kwargs)
+            except Exception as e:
+                print(f">>> [PYTHON] Bỏ qua yêu cầu job {file_name}: {e}")
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            # Gắn sau _watch -> file kết quả đã được công bố trước khi tạo .done
+            future.add_done_callback(lambda f, done=path + ".done": open(done, "w").close())
+
+    def _take_done(self, request):
+        try:
+            os.remove(request + ".done")
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _give_up(self, request):
+        # Hết JOB_TIMEOUT: worker chủ chưa nhận yêu cầu thì rút lại, đã nhận thì bỏ file .done về sau
+        for path in (request, request + ".done"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _remote_payload(self, job):
+        if not self._load_shared(job):
+            raise JobUnavailable(f"Job {job.name} chạy ở worker chủ và chưa có kết quả, thử lại sau")
+        return self._payload(job)
+
+    def _remote_result(self, job, refresh, kwargs):
+        if refresh or not self._load_shared(job):
+            request = self._request(job, kwargs)
+            deadline = time.monotonic() + JOB_TIMEOUT
+            while not self._take_done(request):
+                if time.monotonic() >= deadline:
+                    self._give_up(request)
+                    break
+                time.sleep(SHARED_POLL_SECONDS)
+        return self._remote_payload(job)
+
+    async def _remote_result_async(self, job, refresh, kwargs):
+        if refresh or not self._load_shared(job):
+            request = self._request(job, kwargs)
+            deadline = time.monotonic() + JOB_TIMEOUT
+            while not self._take_done(request):
+                if time.monotonic() >= deadline:
+                    self._give_up(request)
+                    break
+                await asyncio.sleep(SHARED_POLL_SECONDS)
+        return self._remote_payload(job)
+
+    def _stale(self, job):
+        return job.interval > 0 and (job.started_at is None or time.monotonic() - job.started_at >= job.interval)
+
+    def _payload(self, job):
+        if job.computed_at is None:
+            raise JobFailed(job.error or f"Job {job.name} chưa có kết quả")
+        return job.result, {
+            "computed_at": job.computed_at.isoformat(),
+            "duration_ms": job.duration_ms,
+            "refreshing": job.running,
+        }
+
+    def result(self, name, refresh=False, **kwargs):
+        """
+        Kết quả mới nhất của job + metadata (computed_at...). Chưa có kết quả hoặc refresh=True
+        thì chờ lần chạy kế tiếp; còn lại trả ngay kết quả cũ (hết hạn thì chạy lại ở nền).
+        Job writer ở worker không phải chủ: chờ worker chủ chạy, chưa có kết quả nào thì JobUnavailable.
+        """
+        job = self.jobs[name]
+        if self._remote(job):
+            return self._remote_result(job, refresh, kwargs)
+        if refresh or job.computed_at is None:
+            future = self.trigger(name, **kwargs)
+            try:
+                future.result(timeout=JOB_TIMEOUT)
+            except Exception:
+                pass  # lỗi được ghi ở _finish, trả kết quả cũ nếu có
+            if future.done():
+                self._finish(job, future, job.started_at)
+        elif self._stale(job):
+            self.kick(name)
+        return self._payload(job)
+
+    async def result_async(self, name, refresh=False, **kwargs):
+        """Như result() nhưng dùng được trong endpoint async def"""
+        job = self.jobs[name]
+        if self._remote(job):
+            return await self._remote_result_async(job, refresh, kwargs)
+        if refresh or job.computed_at is None:
+            future = self.trigger(name, **kwargs)
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), JOB_TIMEOUT)
+            except Exception:
+                pass
+            if future.done():
+                self._finish(job, future, job.started_at)
+        elif self._stale(job):
+            self.kick(name)
+        return self._payload(job)
+
+    def status(self):
+        return {
+            "scheduler_enabled": SCHEDULER_ENABLED,
+            "shared_dir": self.shared_dir,
+            "owner": self.owner,
+            "threads": JOB_THREADS,
+            "processes": JOB_PROCESSES,
+            "jobs": {name: job.status() for name, job in self.jobs.items()},
+        }
+
+
+scheduler = JobScheduler()
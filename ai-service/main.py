@@ -1,44 +1,90 @@
 # ai_service/main.py
 import os
-os.environ["OMP_NUM_THREADS"] = "1"
-os.environ["OPENBLAS_NUM_THREADS"] = "1"
-os.environ["MKL_NUM_THREADS"] = "1"
-os.environ["VECLIB_MAXIMUM_THREADS"] = "1"
-os.environ["NUMEXPR_NUM_THREADS"] = "1"
-import mysql.connector
+import components
+import compute
+# Phải chạy trước khi import numpy/torch (số thread tối đa của BLAS/OpenMP được chốt lúc nạp thư viện)
+compute.configure_threads()
 from typing import List, Optional
-import chromadb
-from sentence_transformers import SentenceTransformer
-import requests
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+import httpx
 from pydantic import BaseModel
-import pandas as pd
-import numpy as np
-from sklearn.linear_model import LinearRegression
 from datetime import datetime
+from functools import partial
 import json
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+import time
+import asyncio
+import numpy as np
 
 import os
 from dotenv import load_dotenv
 load_dotenv() 
+import db
+import rag_sync
+import embeddings
+import retrieval
+import gemini
+import revenue
+import sentiment
+import visual_index
+import cart_counters
+from recommend import recommender
+import jobs
+import tracing
+import prompt_budget
+import shared_vectors
+import exact_search
+from semantic_cache import SemanticCache
+from catalog import catalog
+from segment_table import SegmentTable
+compute.apply_interactive_limits()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="shop_ai_db" 
-        )
-embedding_model = SentenceTransformer('keepitreal/vietnamese-sbert')
-chroma_client = chromadb.PersistentClient(path="./chroma_data")
-product_collection = chroma_client.get_or_create_collection(name="fashion_products")
+
+# Các thành phần nặng chỉ được nạp ở lần dùng đầu tiên (hoặc lúc warm-up, xem AI_WARMUP)
+def _load_embedding_model():
+    # EMBED_BACKEND=torch|onnx|onnx-int8, cùng giao diện .encode() cho RAG và sync
+    model = embeddings.load_model()
+    compute.apply_interactive_limits()  # torch vừa được nạp -> áp giới hạn thread
+    return model
+
+def _open_chroma():
+    import chromadb
+    return chromadb.PersistentClient(path=os.getenv("CHROMA_PATH", "./chroma_data"))
+
+embedding_model = components.register("embedding_model", _load_embedding_model)
+chroma_client = components.register("chroma", _open_chroma)
+product_collection = components.register(
+    "product_collection", lambda: chroma_client.get().get_or_create_collection(name="fashion_products"))
+query_encoder = components.register("query_encoder", lambda: embeddings.QueryEncoder(embedding_model.get()))
+
+def _open_shared_vectors():
+    # AI_SHARED_VECTORS=1 (serve.py nhiều worker): vector sản phẩm đọc từ file mmap dùng chung
+    index = shared_vectors.SharedVectorIndex()
+    if shared_vectors.SHARED_VECTORS and not index.refresh(force=True) and jobs.scheduler.owner:
+        # lần chạy đầu, chưa có bản export nào; worker khác nhận bản này qua refresh()
+        index.export(product_collection.get())
+    return index
+
+shared_index = components.register("shared_vectors", _open_shared_vectors)
+retriever = components.register(
+    "retriever", lambda: retrieval.HybridRetriever(
+        product_collection.get(), query_encoder.get(),
+        shared_index.get() if shared_vectors.SHARED_VECTORS else None))
 
 if not GOOGLE_API_KEY:
     raise ValueError("LỖI: Chưa tìm thấy GOOGLE_API_KEY trong file .env")
 
-app = FastAPI()
+class TracedJSONResponse(JSONResponse):
+    """JSONResponse có đo thời gian serialize + kích thước body (bước 'serialize' trong trace)"""
+    def render(self, content):
+        with tracing.stage("serialize"):
+            body = super().render(content)
+        tracing.size("serialize", "bytes", len(body))
+        return body
+
+app = FastAPI(default_response_class=TracedJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  
@@ -46,31 +92,138 @@ app.add_middleware(
     allow_methods=["*"],  
     allow_headers=["*"],
 )
+# Đo thời gian từng bước của mỗi request -> /metrics + log request chậm (TRACE_SLOW_MS)
+app.add_middleware(tracing.TraceMiddleware)
+
+tracing.register_gauge("ai_process_rss_bytes", "RSS của process ai-service", components.rss_bytes)
+tracing.register_gauge("ai_process_pss_bytes", "PSS của process (trang nhớ dùng chung chia đều cho các worker)",
+                       lambda: components.process_memory()["pss"])
+tracing.register_gauge("ai_db_pool_in_use", "Số connection MySQL đang được mượn",
+                       lambda: {name: s["in_use"] for name, s in db.pool_stats().items()})
+tracing.register_gauge("ai_compute_running", "Số tác vụ đang chạy trong executor compute",
+                       lambda: compute.stats()["compute_running"])
+tracing.register_gauge("ai_gemini_in_flight", "Số lần gọi Gemini đang chạy", lambda: gemini.metrics.in_flight)
+tracing.register_gauge("ai_gemini_circuit_open", "1 nếu circuit breaker Gemini đang mở",
+                       lambda: int(gemini.breaker.state == gemini.CircuitBreaker.OPEN))
+tracing.register_gauge("ai_gemini_calls", "Số lần gọi Gemini theo kết quả (tích luỹ)",
+                       lambda: {"ok": gemini.metrics.ok, "retries": gemini.metrics.retries,
+                                "rejected": gemini.metrics.rejected, **gemini.metrics.errors})
+tracing.register_gauge("ai_chat_cache_hits", "Số câu trả lời chatbot lấy từ cache (không gọi Gemini)",
+                       lambda: {"exact": gemini.response_cache.hits, "semantic": semantic_cache.hits})
+tracing.register_gauge("ai_event_loop_stalls", "Số lần event loop bị chặn quá LOOP_BLOCK_THRESHOLD_MS",
+                       lambda: compute.loop_monitor.stalls)
+
+JOB_INTERVALS = {
+    "predict-revenue": float(os.getenv("JOB_REVENUE_INTERVAL", "300")),
+    "customer-segments": float(os.getenv("JOB_SEGMENTS_INTERVAL", "900")),
+    "analyze-reviews": float(os.getenv("JOB_REVIEWS_INTERVAL", "1800")),
+    "cart-insights": float(os.getenv("JOB_CART_INTERVAL", "60")),
+    "sync-rag": float(os.getenv("JOB_SYNC_RAG_INTERVAL", "600")),
+    "recommender": float(os.getenv("RECO_REFRESH_INTERVAL", "60")),
+}
+
+@app.on_event("startup")
+async def start_jobs():
+    """Đăng ký các job phân tích nặng; API chỉ đọc kết quả mới nhất thay vì tính trong request"""
+    jobs.scheduler.register("predict-revenue", _revenue_report, jobs.THREAD, JOB_INTERVALS["predict-revenue"])
+    # fit KMeans tốn CPU -> chạy ở process riêng, không tranh GIL với event loop
+    # writer=True: ghi file model / SQLite nhãn / Chroma -> với serve.py chỉ worker 0 chạy
+    jobs.scheduler.register("customer-segments", partial(jobs.call_path, "segmentation.build_report", refit=False),
+                            jobs.PROCESS, JOB_INTERVALS["customer-segments"], writer=True)
+    jobs.scheduler.register("analyze-reviews", _review_report, jobs.ASYNC, JOB_INTERVALS["analyze-reviews"],
+                            writer=True)
+    jobs.scheduler.register("cart-insights", _cart_report, jobs.THREAD, JOB_INTERVALS["cart-insights"])
+    jobs.scheduler.register("sync-rag", _sync_rag, jobs.ASYNC, JOB_INTERVALS["sync-rag"], writer=True)
+    # Dựng ma trận gợi ý lần đầu ngay khi khởi động (ticker chạy job chưa từng chạy ở tick đầu tiên)
+    jobs.scheduler.register("recommender", _recommender_report, jobs.THREAD, JOB_INTERVALS["recommender"])
+    jobs.scheduler.start(asyncio.get_running_loop())
+    compute.loop_monitor.start()
+    components.mark_started()
+    components.start_warm_up()
+
+@app.get("/api/ai/ready")
+def readiness():
+    """Thành phần nào đã nạp (warm), thời gian khởi động và RSS theo từng thành phần"""
+    return components.readiness()
+
+@app.get("/api/ai/workers")
+def workers():
+    """RSS/PSS từng worker (serve.py) và phần bộ nhớ dùng chung nhờ nạp model trước khi fork + vector mmap"""
+    return {**components.workers_memory(),
+            "shared_vectors": shared_index.value.stats() if shared_index.loaded else {"enabled": shared_vectors.SHARED_VECTORS}}
+
+@app.get("/metrics")
+def metrics():
+    """Histogram thời gian request/từng bước theo định dạng Prometheus"""
+    return PlainTextResponse(tracing.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/ai/slow-requests")
+def slow_requests():
+    """Các request chậm gần nhất (vượt TRACE_SLOW_MS) kèm thời gian từng bước"""
+    return tracing.slow_requests()
+
+@app.get("/api/ai/compute-stats")
+def compute_stats():
+    """Cấu hình thread, tải của executor compute và thời gian event loop bị chặn"""
+    return compute.stats()
+
+@app.get("/api/ai/jobs")
+def job_status():
+    """Trạng thái các job nền: đang chạy, lần tính gần nhất, thời gian chạy, lỗi gần nhất"""
+    return jobs.scheduler.status()
+
+@app.get("/api/ai/jobs/{name}/run")
+def run_job(name: str):
+    """Kích hoạt 1 job ngay (không chờ kết quả); job đang chạy thì không chạy trùng"""
+    if name not in jobs.scheduler.jobs:
+        return {"status": "error", "message": f"Không có job {name}"}
+    jobs.scheduler.kick(name)
+    return {"status": "success", "job": jobs.scheduler.jobs[name].status()}
+
+def _job_unavailable(e):
+    """Worker không sở hữu job ghi dữ liệu, worker chủ chưa có kết quả -> 503 để client thử lại"""
+    return JSONResponse(status_code=503, content={"status": "error", "message": str(e)})
+
+@app.on_event("shutdown")
+async def close_shared_clients():
+    jobs.scheduler.stop()
+    compute.loop_monitor.stop()
+    await db.close_pools()
+    await gemini.close_client()
+
+@app.get("/api/ai/gemini-stats")
+def gemini_stats():
+    """Giới hạn, số lần gọi/thử lại/lỗi theo loại, độ trễ và trạng thái circuit breaker của Gemini"""
+    return gemini.stats()
+
+@app.get("/api/ai/prompt-stats")
+def prompt_stats():
+    """Ngân sách token của prompt chatbot và tổng số token tiết kiệm được nhờ cắt gọn lịch sử/context"""
+    return prompt_budget.stats()
+
+@app.get("/api/ai/chat-cache-stats")
+def chat_cache_stats():
+    """Tỉ lệ trúng cache câu trả lời chatbot (khớp chính xác + theo ngữ nghĩa) và số lần gọi Gemini tránh được"""
+    exact, semantic = gemini.response_cache.stats(), semantic_cache.stats()
+    return {"exact": exact, "semantic": semantic, "upstream_calls_avoided": exact["hits"] + semantic["hits"]}
+
+@app.get("/api/ai/db-pool")
+def db_pool_stats():
+    """Thống kê pool kết nối MySQL (đang dùng, thời gian chờ, timeout...)"""
+    return db.pool_stats()
 
 def get_products_context():
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="", # Điền mật khẩu MySQL của bạn nếu có (thường XAMPP là rỗng)
-            database="shop_ai_db" # Đảm bảo đúng tên Database của bạn
-        )
-        cursor = conn.cursor(dictionary=True)
-        
-        # Bổ sung lấy id và image từ Database
-        cursor.execute("SELECT id, name, price, description, stock, image FROM Product")
-        products = cursor.fetchall()
-        conn.close()
-        
-        text = "DANH SÁCH SẢN PHẨM TRONG KHO:\n"
-        for p in products:
-            img_url = p['image'] if p['image'] else ''
-            # Cung cấp cho AI biết ID và Đường dẫn ảnh
-            text += f"- ID: {p['id']} | Tên: {p['name']} | Giá: {p['price']} VND | Kho: {p['stock']} | Ảnh: {img_url} | Chi tiết: {p['description']}\n"
-        return text
+        # Dùng snapshot danh mục dùng chung, chuỗi context được dựng 1 lần cho mỗi phiên bản dữ liệu
+        return catalog.get().render_context()
     except Exception:
         return ""
 
+@app.get("/api/ai/catalog-stats")
+def catalog_stats():
+    """Số sản phẩm, phiên bản, số lần nạp lại và bộ nhớ của snapshot danh mục"""
+    return catalog.stats()
+
 class ChatRequest(BaseModel):
     question: str
 class HistoryItem(BaseModel):
@@ -79,97 +232,162 @@ class HistoryItem(BaseModel):
 class ChatRequest(BaseModel):
     question: str
     history: Optional[List[HistoryItem]] = []
+    userId: Optional[int] = None
 
 #test rag 
+async def _sync_rag(mode="incremental"):
+    """Đồng bộ Product (MySQL) -> ChromaDB; chạy như job nền 'sync-rag'"""
+    t0 = time.perf_counter()
+    existing_metas = await run_in_threadpool(rag_sync.load_existing, product_collection.get())
+    snapshot = await catalog.get_async(force_check=True)
+    products = snapshot.rows()
+    all_ids = None
+    if mode == "new":
+        watermark = datetime.fromtimestamp(rag_sync.get_watermark(existing_metas))
+        all_ids = [str(p['id']) for p in products]
+        products = [p for p in products if p['createdAt'] and p['createdAt'] > watermark]
+    load_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+    if not products and not all_ids and not existing_metas:
+        return {"message": "Không có sản phẩm nào để đồng bộ."}
+
+    print(f"Đang đồng bộ Vector cho sản phẩm (mode={mode})...")
+    # Encode hàng loạt chạy trong executor compute (dùng nhiều thread) -> event loop vẫn phục vụ request khác
+    report = await compute.run(
+        rag_sync.sync_products, products, product_collection.get(), embedding_model.get().encode,
+        mode=mode, all_ids=all_ids, existing_metas=existing_metas
+    )
+    report["timings_ms"]["load_mysql"] = load_ms
+    if shared_vectors.SHARED_VECTORS:
+        # Worker khác nhận bản mới qua mtime của file meta (AI_SHARED_VECTORS_CHECK_INTERVAL)
+        t0 = time.perf_counter()
+        await run_in_threadpool(shared_index.get().export, product_collection.get())
+        report["timings_ms"]["export_shared_vectors"] = round((time.perf_counter() - t0) * 1000, 1)
+    if retriever.loaded:
+        retriever.value.invalidate()
+
+    return {
+        "status": "success",
+        "message": f"Đã đồng bộ: {report['embedded']} cập nhật, {report['skipped']} bỏ qua, {report['deleted']} xoá.",
+        "report": report
+    }
+
 @app.get("/api/ai/sync-rag")
-async def sync_mysql_to_chroma():
-    """API này dùng để đồng bộ dữ liệu từ bảng Product trong MySQL sang ChromaDB"""
+async def sync_mysql_to_chroma(mode: str = "incremental"):
+    """API này dùng để đồng bộ dữ liệu từ bảng Product trong MySQL sang ChromaDB
+    mode=incremental (mặc định): chỉ encode lại sản phẩm mới/thay đổi nội dung
+    mode=new: chỉ lấy sản phẩm có createdAt mới hơn lần đồng bộ trước
+    mode=full: encode lại toàn bộ
+    Nếu đang có 1 lần đồng bộ chạy (định kỳ hoặc do request khác) thì chờ và dùng chung kết quả đó.
+    """
+    if mode not in rag_sync.SYNC_MODES:
+        return {"status": "error", "message": f"mode phải là một trong {rag_sync.SYNC_MODES}"}
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="", # Điền pass nếu có
-            database="shop_ai_db"
-        )
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, name, price, description, image FROM Product")
-        products = cursor.fetchall()
-        
+        result, meta = await jobs.scheduler.result_async("sync-rag", refresh=True, mode=mode)
+        return {**result, "job": meta}
+    except jobs.JobUnavailable as e:
+        return _job_unavailable(e)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+    
+@app.get("/api/ai/embedding-stats")
+def embedding_stats():
+    """Tỉ lệ trúng cache và kích thước lô encode câu hỏi chatbot"""
+    if not query_encoder.loaded:
+        return {"warm": False}
+    return query_encoder.get().stats()
+
+@app.get("/api/ai/embedding-benchmark")
+def embedding_benchmark(backends: str = "torch,onnx,onnx-int8", limit: int = 500, k: int = 5):
+    """
+    So sánh các backend embedding trên `limit` sản phẩm đầu của danh mục: docs/s, độ trễ encode
+    câu hỏi, độ giống vector và tỉ lệ trùng top-k truy xuất so với model PyTorch gốc
+    """
+    try:
+        selected = [b.strip() for b in backends.split(",") if b.strip()]
+        unknown = [b for b in selected if b not in embeddings.BACKENDS]
+        if unknown:
+            return {"status": "error", "message": f"backend không hợp lệ: {unknown}, chọn trong {embeddings.BACKENDS}"}
+        products = catalog.get().rows()[:limit]
         if not products:
-            return {"message": "Không có sản phẩm nào để đồng bộ."}
-
-        ids = []
-        documents = []
-        metadatas = []
-
-        # 2. Chuẩn bị dữ liệu để Vector hóa
-        for p in products:
-            doc_text = f"Tên sản phẩm: {p['name']}. Mô tả: {p['description']}"
-            
-            ids.append(str(p['id']))
-            documents.append(doc_text)
-            metadatas.append({
-                "name": p['name'],
-                "price": str(p['price']),
-                "image": p['image'] if p['image'] else "" 
-            })
-            
-        # 3. Biến văn bản thành Vector và lưu vào DB
-        print("Đang tạo Vector cho sản phẩm...")
-        embeddings = embedding_model.encode(documents).tolist()
-        
-        # Xóa dữ liệu cũ (nếu có) để cập nhật mới
-        if product_collection.count() > 0:
-            existing_ids = product_collection.get()['ids']
-            product_collection.delete(ids=existing_ids)
-            
-        # Nạp dữ liệu mới vào ChromaDB
-        product_collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas
+            return {"status": "error", "message": "Không có sản phẩm để đo"}
+        documents = [rag_sync.build_document(p) for p in products]
+        report = compute.call(
+            embeddings.compare_backends, documents, backends=selected, k=k,
+            models={embeddings.EMBED_BACKEND: embedding_model.get()}
         )
-        
-        cursor.close()
-        conn.close()
-        return {"status": "success", "message": f"Đã đồng bộ thành công {len(products)} sản phẩm vào Vector DB!"}
-        
+        return {"status": "success", "active_backend": embeddings.EMBED_BACKEND, "report": report}
     except Exception as e:
+        print(f"LỖI EMBEDDING BENCHMARK: {e}")
         return {"status": "error", "message": str(e)}
-    
+
 def get_top_5_products_from_rag(user_query: str):
-    """Tìm 5 sản phẩm giống với ý định câu hỏi của user nhất"""
-    # Nếu ChromaDB trống, không cần tìm
-    if product_collection.count() == 0:
-        return "Hiện chưa có dữ liệu sản phẩm trong Vector DB."
-    # 1. Biến câu hỏi của user thành Vector
-    query_vector = embedding_model.encode([user_query]).tolist()
-    # 2. Dò tìm trong ChromaDB
-    results = product_collection.query(
-        query_embeddings=query_vector,
-        n_results=5 # Bắt ChromaDB trả về đúng 5 kết quả gần nhất
-    )
-    # 3. Ghép kết quả thành một đoạn văn bản (Context) để mớm cho Gemini
-    context_text = "DANH SÁCH SẢN PHẨM PHÙ HỢP TRONG KHO (Chỉ tư vấn dựa trên danh sách này):\n\n"
-    # ChromaDB trả về list of lists, ta duyệt qua list đầu tiên
-    for i in range(len(results['ids'][0])):
-        p_id = results['ids'][0][i]
-        meta = results['metadatas'][0][i]
-        
-        context_text += f"- Tên sản phẩm: {meta['name']} (ID: {p_id})\n"
-        context_text += f"  Giá: {meta['price']} VNĐ\n"
-        context_text += f"  Link ảnh: {meta['image']}\n"
-        context_text += "----------\n"
-        
-    return context_text
+    """
+    Tìm 5 sản phẩm phù hợp nhất với câu hỏi (lọc còn hàng/giá/loại + vector + từ khoá), theo thứ tự liên quan.
+    Trả về (sản phẩm, vector câu hỏi); ChromaDB trống thì (None, None)
+    """
+    if product_collection.get().count() == 0:
+        return None, None
+    products, _, _, vector = retriever.get().retrieve(user_query, k=5)
+    return products, vector
+
+@app.get("/api/ai/retrieve")
+def debug_retrieve(q: str, k: int = 5):
+    """Xem kết quả truy xuất RAG + điều kiện đã hiểu + thời gian từng bước"""
+    products, constraints, timings, _ = retriever.get().retrieve(q, k=k)
+    return {"constraints": constraints, "products": products, "timings_ms": timings}
+
+@app.get("/api/ai/vector-recall")
+def vector_recall(k: int = 5, in_stock: bool = True, limit: int = 200):
+    """
+    recall@k của Chroma (HNSW) so với tìm chính xác bằng numpy trên cùng collection, câu hỏi gồm
+    bộ câu mẫu + tên `limit` sản phẩm đầu danh mục; kèm nhánh vector retriever đang dùng
+    """
+    if k < 1:
+        return {"status": "error", "message": "k phải >= 1"}
+    try:
+        queries = embeddings.DEFAULT_BENCH_QUERIES + [p['name'] for p in catalog.get().rows()[:limit]]
+        # Encode thẳng bằng model thành 1 lô trong executor compute: không đi qua QueryEncoder để khỏi
+        # chen vào hàng đợi micro-batch của chatbot và đẩy câu hỏi thật ra khỏi cache TTL
+        texts = [embeddings.normalize_query(q) for q in queries]
+        vectors = np.asarray(compute.call(embedding_model.get().encode, texts, batch_size=32), dtype=np.float32)
+        r = retriever.get()
+        # Dùng lại ma trận retriever đã dựng (danh mục nhỏ), nếu chưa có thì recall_report tự dựng
+        report = compute.call(exact_search.recall_report, product_collection.get(), vectors,
+                              k=k, in_stock=in_stock, exact=r.exact)
+        return {"status": "success", "retriever": r.stats(), "report": report}
+    except Exception as e:
+        print(f"LỖI VECTOR RECALL: {e}")
+        return {"status": "error", "message": str(e)}
 
-# --- API 1: CHATBOT ---
-@app.post("/chatbot")
-def chat_endpoint(req: ChatRequest):
-    context = get_top_5_products_from_rag(req.question)
-    
-    system_prompt = f"""Bạn là chuyên gia tư vấn thời trang (Stylist) của Fashion AI Shop.
+PERSONAL_PICKS = int(os.getenv("RAG_PERSONAL_PICKS", "3"))
+
+def _recommended_products(product_ids, k, exclude=()):
+    """Ghép (id, điểm) từ recommender với thông tin sản phẩm trong snapshot, bỏ sản phẩm hết hàng"""
+    snapshot = catalog.get()
+    out = []
+    for pid, score in product_ids:
+        product = snapshot.get(pid)
+        if product is None or product['stock'] <= 0 or pid in exclude:
+            continue
+        out.append({"id": pid, "name": product['name'], "price": product['price'],
+                    "image": product['image'], "category": product['category'], "score": score})
+        if len(out) >= k:
+            break
+    return out
+
+def get_personal_picks(user_id, exclude_ids):
+    """Vài sản phẩm gợi ý theo lịch sử xem/mua của khách đã đăng nhập để bổ sung vào context RAG"""
+    if not user_id or PERSONAL_PICKS <= 0:
+        return []
+    recommender.ensure_fresh()
+    exclude = {int(pid) for pid in exclude_ids}
+    return _recommended_products(recommender.recommend(user_id, k=PERSONAL_PICKS * 3), PERSONAL_PICKS, exclude)
+
+RAG_HEADER = "DANH SÁCH SẢN PHẨM PHÙ HỢP TRONG KHO (Chỉ tư vấn dựa trên danh sách này):\n\n"
+PICKS_HEADER = "\nSẢN PHẨM KHÁCH CÓ THỂ THÍCH (dựa trên lịch sử xem/mua, chỉ gợi ý thêm khi phù hợp câu hỏi):\n"
+
+STYLIST_PROMPT = """Bạn là chuyên gia tư vấn thời trang (Stylist) của Fashion AI Shop.
 Dưới đây là danh sách các sản phẩm hệ thống tìm được dựa trên câu hỏi của khách:
 
 {context}
@@ -192,360 +410,353 @@ HƯỚNG DẪN TƯ DUY VÀ TRẢ LỜI (BẮT BUỘC TUÂN THỦ):
    -> CHỈ xin lỗi và nói "shop chưa có dữ liệu/sản phẩm" KHI VÀ CHỈ KHI danh sách trên hoàn toàn trống, HOẶC cả 5 sản phẩm trên không có bất kỳ cách nào liên hệ được với nhu cầu của khách (ví dụ: khách đòi mua váy mà danh sách toàn quần nam).
 """
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GOOGLE_API_KEY}"
-
-    try:
-        contents = []
-        contents.append({
-            "role": "user",
-            "parts": [{"text": system_prompt}]
-        })
+def _render_context(products, picks, shown=(), budget=None):
+    """Context sản phẩm cho prompt; budget=None: đầy đủ như khi chưa cắt gọn (dùng để đếm token tiết kiệm)"""
+    if products is None:
+        text, dropped = "Hiện chưa có dữ liệu sản phẩm trong Vector DB.", 0
+    else:
+        listing, _, dropped = prompt_budget.render_products(products, shown, budget)
+        text = RAG_HEADER + listing
+    if picks:
+        remaining = None if budget is None else budget - gemini.estimate_tokens(text)
+        lines, _ = prompt_budget.render_picks(picks, shown, remaining)
+        if lines:
+            text += PICKS_HEADER + lines
+    return text, dropped
+
+def _chat_contents(context, history, question, summary=""):
+    system_prompt = STYLIST_PROMPT.format(context=context)
+    if summary:
+        system_prompt += f"\nTÓM TẮT CÁC LƯỢT TRAO ĐỔI TRƯỚC (đã rút gọn):\n{summary}\n"
+
+    contents = []
+    contents.append({
+        "role": "user",
+        "parts": [{"text": system_prompt}]
+    })
+    contents.append({
+        "role": "model",
+        "parts": [{"text": "Tôi đã hiểu. Tôi sẵn sàng tư vấn thời trang dựa trên danh sách hệ thống cung cấp!"}]
+    })
+    for role, text in history:
         contents.append({
-            "role": "model",
-            "parts": [{"text": "Tôi đã hiểu. Tôi sẵn sàng tư vấn thời trang dựa trên danh sách hệ thống cung cấp!"}]
+            "role": role,
+            "parts": [{"text": text}]
         })
+    contents.append({
+        "role": "user",
+        "parts": [{"text": question}]
+    })
+    return contents
+
+semantic_cache = SemanticCache()
+_semantic_catalog_version = None
+
+def _product_versions(product_ids):
+    """{id: (giá, tồn kho)} theo snapshot danh mục; đổi catalog thì huỷ ngay các câu trả lời cache lỗi thời"""
+    global _semantic_catalog_version
+    snapshot = catalog.get()
+    if snapshot.version != _semantic_catalog_version:
+        if _semantic_catalog_version is not None:
+            semantic_cache.invalidate_products(snapshot.price_stock)
+        _semantic_catalog_version = snapshot.version
+    return {int(pid): snapshot.price_stock(pid) for pid in product_ids}
+
+def prepare_chat(req: ChatRequest):
+    """
+    Tìm sản phẩm qua RAG, dựng nội dung gửi Gemini (đã cắt gọn theo ngân sách token).
+    Trả về (contents, khoá cache chính xác, khoá cache ngữ nghĩa hoặc None)
+    """
+    products, query_vector = get_top_5_products_from_rag(req.question)
+    product_ids = [p['id'] for p in products or []]
+    picks = get_personal_picks(req.userId, product_ids)
+    product_ids += [p['id'] for p in picks]
+    versions = _product_versions(product_ids)
+
+    history = [(item.role if item.role in ['user', 'model'] else 'user', item.content) for item in (req.history or [])]
+    recent_history = history[-prompt_budget.HISTORY_TURNS:] if prompt_budget.HISTORY_TURNS > 0 else []
+
+    with tracing.stage("prompt_budget"):
+        # Sản phẩm đã giới thiệu ở lượt trước chỉ nhắc lại 1 dòng, lịch sử cũ được tóm tắt
+        shown = prompt_budget.shown_product_ids(recent_history)
+        context, dropped = _render_context(products, picks, shown, prompt_budget.CONTEXT_BUDGET)
+        summary, kept = prompt_budget.compact_history(recent_history)
+        contents = _chat_contents(context, kept, req.question, summary)
+        full_contents = _chat_contents(_render_context(products, picks)[0], recent_history, req.question)
+        prompt_budget.report(full_contents, contents, dropped, len(recent_history) - len(kept))
+
+    # Giá/tồn kho nằm trong khoá -> đổi giá thì không dùng lại câu trả lời cũ
+    cache_key = gemini.chat_cache_key([f"{pid}:{v}" for pid, v in versions.items()], req.question, recent_history)
+    semantic_key = None
+    if versions and query_vector is not None:
+        # Dùng lại vector câu hỏi retriever vừa encode (không hỏi lại QueryEncoder -> không thổi phồng tỉ lệ trúng cache)
+        history_key = gemini.chat_cache_key((), "", recent_history) if recent_history else ""
+        semantic_key = (query_vector, versions, history_key)
+    return contents, cache_key, semantic_key
+
+def _cached_reply(cache_key, semantic_key):
+    cached = gemini.response_cache.get(cache_key)
+    if cached is None and semantic_key is not None:
+        vector, versions, history_key = semantic_key
+        cached = semantic_cache.get(vector, versions, history_key)
+    return cached
+
+def _store_reply(cache_key, semantic_key, reply):
+    gemini.response_cache.put(cache_key, reply)
+    if semantic_key is not None:
+        vector, versions, history_key = semantic_key
+        semantic_cache.put(vector, versions, reply, history_key)
 
-        for item in (req.history or [])[-6:]:
-            role = item.role if item.role in ['user', 'model'] else 'user'
-            contents.append({
-                "role": role,
-                "parts": [{"text": item.content}]
-            })
-        contents.append({
-            "role": "user",
-            "parts": [{"text": req.question}]
-        })
+# --- API 1: CHATBOT ---
+@app.post("/chatbot")
+async def chat_endpoint(req: ChatRequest):
+    # Hạn chót của cả request (backend chờ tối đa CHATBOT_TIMEOUT_MS): Gemini không thử lại quá hạn này
+    deadline = time.monotonic() + gemini.CHAT_DEADLINE
+    try:
+        # Encode câu hỏi + truy vấn Chroma là tác vụ chặn -> chạy trong threadpool
+        contents, cache_key, semantic_key = await run_in_threadpool(prepare_chat, req)
 
-        payload = {"contents": contents}
+        cached = _cached_reply(cache_key, semantic_key)
+        if cached is not None:
+            return {"reply": cached}
 
-        response = requests.post(
-            url,
-            headers={'Content-Type': 'application/json'},
-            json=payload,
-            timeout=18 
-        )
-        result = response.json()
+        reply = "".join([chunk async for chunk in gemini.stream_generate(contents, GOOGLE_API_KEY, deadline=deadline)])
+        if not reply:
+            return {"reply": "Xin lỗi, AI chưa hiểu rõ ý bạn. Bạn có thể hỏi lại không?"}
+        _store_reply(cache_key, semantic_key, reply)
+        return {"reply": reply}
 
-        if "candidates" in result:
-            return {"reply": result['candidates'][0]['content']['parts'][0]['text']}
-        print(">>> LỖI CHATBOT:", result)
-        return {"reply": "Xin lỗi, AI chưa hiểu rõ ý bạn. Bạn có thể hỏi lại không?"}
-
-    except requests.exceptions.Timeout:
+    except (httpx.TimeoutException, gemini.GeminiUnavailable):
         return {"reply": "AI đang bận, vui lòng thử lại sau vài giây nhé!"}
+    except gemini.GeminiError as e:
+        print(">>> LỖI CHATBOT:", e)
+        return {"reply": "Xin lỗi, AI chưa hiểu rõ ý bạn. Bạn có thể hỏi lại không?"}
     except Exception as e:
         print(f"LỖI CHATBOT: {e}")
         return {"reply": "Hệ thống đang bảo trì."}
-    
-# --- API 2: DỰ BÁO DOANH THU & TOP BÁN CHẠY ---
-@app.get("/predict-revenue")
-def predict_revenue():
-    conn = None
-    try:
-        conn = mysql.connector.connect(host="localhost", user="root", password="", database="shop_ai_db")
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute("SELECT createdAt, totalAmount FROM `Order` WHERE status = 'COMPLETED' OR paymentStatus = 'PAID'")
-        order_rows = cursor.fetchall()
-
-        if not order_rows:
-            return {
-                "data": [],
-                "analysis": {
-                    "trend": "CHƯA RÕ", "growth_rate": 0,
-                    "advice": "Chưa có dữ liệu", "season_tip": "Chưa có dữ liệu",
-                    "top_products": []
-                }
-            }
 
-        df = pd.DataFrame(order_rows)
-        df['createdAt'] = pd.to_datetime(df['createdAt'])
-        df['totalAmount'] = df['totalAmount'].astype(float)
-        df = df.sort_values('createdAt')
+def _sse(data):
+    return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-        try:
-            monthly_revenue = df.resample('ME', on='createdAt')['totalAmount'].sum().reset_index()
-        except Exception:
-            monthly_revenue = df.resample('M', on='createdAt')['totalAmount'].sum().reset_index()
-
-        monthly_revenue.columns = ['Date', 'Revenue']
-        monthly_revenue['Revenue'] = monthly_revenue['Revenue'].astype(float)
-
-        monthly_revenue = monthly_revenue.tail(12).reset_index(drop=True)
-
-        monthly_revenue['Month_Index'] = np.arange(len(monthly_revenue))
-        X = monthly_revenue[['Month_Index']]
-        y = monthly_revenue['Revenue']
-
-        model = LinearRegression()
-        model.fit(X, y)
-        future_X = pd.DataFrame({'Month_Index': [len(monthly_revenue)]})
-        next_month_revenue = float(model.predict(future_X)[0])  
-
-        chart_data = []
-        for _, row in monthly_revenue.iterrows():
-            chart_data.append({
-                "name": row['Date'].strftime("T%m/%y"),        
-                "revenue": round(float(row['Revenue'])),       
-                "prediction": None
-            })
-
-        last_date = monthly_revenue.iloc[-1]['Date']
-        next_date = last_date + pd.DateOffset(months=1)
-        chart_data.append({
-            "name": next_date.strftime("T%m/%y"),
-            "revenue": None,
-            "prediction": max(0, round(next_month_revenue))    
-        })
+@app.post("/chatbot/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    """Giống /chatbot nhưng trả từng đoạn câu trả lời về client qua SSE (text/event-stream)"""
+    deadline = time.monotonic() + gemini.CHAT_DEADLINE
 
-        last_revenue = float(y.iloc[-1])
-        growth_rate = ((next_month_revenue - last_revenue) / last_revenue) * 100 if last_revenue > 0 else 0
-        trend_status = "TĂNG TRƯỞNG" if next_month_revenue > last_revenue else "SUY GIẢM"
-
-        current_month = datetime.now().month
-        if current_month in [3, 4, 5]:   season_advice = "Mùa Xuân. Nên nhập: Áo Cardigan mỏng, Váy hoa."
-        elif current_month in [6, 7, 8]: season_advice = "Mùa Hè. Ưu tiên: Áo thun cotton, Quần Short."
-        elif current_month in [9, 10, 11]: season_advice = "Mùa Thu. Nên nhập: Áo Hoodie, Blazer."
-        else: season_advice = "Mùa Đông/Tết. Cần nhập gấp: Áo phao, Len dày."
-
-        if growth_rate > 10:   advice = f"Tăng mạnh (+{growth_rate:.1f}%). NHẬP THÊM HÀNG."
-        elif growth_rate > 0:  advice = f"Tăng nhẹ (+{growth_rate:.1f}%). Duy trì ổn định."
-        else:                   advice = f"Giảm ({growth_rate:.1f}%). Hạn chế nhập, Xả kho."
-
-        cursor.execute("""
-            SELECT p.name, SUM(oi.quantity) as total_sold
-            FROM OrderItem oi
-            JOIN Product p ON oi.productId = p.id
-            GROUP BY p.name
-            ORDER BY total_sold DESC
-            LIMIT 3
-        """)
-        raw_top_products = cursor.fetchall()
-        conn.close()
-
-        top_products = [
-            {"name": item['name'], "total_sold": int(item['total_sold'])}
-            for item in raw_top_products
-        ]
+    async def event_stream():
+        try:
+            contents, cache_key, semantic_key = await run_in_threadpool(prepare_chat, req)
+
+            cached = _cached_reply(cache_key, semantic_key)
+            if cached is not None:
+                yield _sse({"text": cached, "cached": True})
+                return
+
+            parts = []
+            async for chunk in gemini.stream_generate(contents, GOOGLE_API_KEY, deadline=deadline):
+                parts.append(chunk)
+                yield _sse({"text": chunk})
+            if parts:
+                _store_reply(cache_key, semantic_key, "".join(parts))
+            else:
+                yield _sse({"text": "Xin lỗi, AI chưa hiểu rõ ý bạn. Bạn có thể hỏi lại không?"})
+
+        except (httpx.TimeoutException, gemini.GeminiUnavailable):
+            yield _sse({"text": "AI đang bận, vui lòng thử lại sau vài giây nhé!", "error": True})
+        except gemini.GeminiError as e:
+            print(">>> LỖI CHATBOT:", e)
+            yield _sse({"text": "Xin lỗi, AI chưa hiểu rõ ý bạn. Bạn có thể hỏi lại không?", "error": True})
+        except Exception as e:
+            print(f"LỖI CHATBOT: {e}")
+            yield _sse({"text": "Hệ thống đang bảo trì.", "error": True})
+        finally:
+            yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    
+# --- API 2: DỰ BÁO DOANH THU & TOP BÁN CHẠY ---
+def _revenue_report(force=False):
+    # Chỉ nạp đơn mới kể từ lần trước, dự báo được cache tới khi rollup thay đổi
+    revenue.rollup.refresh(force=force)
+    forecast = revenue.rollup.forecast()
 
+    if not forecast:
         return {
-            "data": chart_data,
+            "data": [],
             "analysis": {
-                "trend": trend_status,
-                "growth_rate": round(growth_rate, 1),
-                "advice": advice,
-                "season_tip": season_advice,
-                "top_products": top_products
+                "trend": "CHƯA RÕ", "growth_rate": 0,
+                "advice": "Chưa có dữ liệu", "season_tip": "Chưa có dữ liệu",
+                "top_products": []
             }
         }
 
+    next_month_revenue = forecast['next_month_revenue']
+    last_revenue = forecast['last_revenue']
+    growth_rate = ((next_month_revenue - last_revenue) / last_revenue) * 100 if last_revenue > 0 else 0
+    trend_status = "TĂNG TRƯỞNG" if next_month_revenue > last_revenue else "SUY GIẢM"
+
+    current_month = datetime.now().month
+    if current_month in [3, 4, 5]:   season_advice = "Mùa Xuân. Nên nhập: Áo Cardigan mỏng, Váy hoa."
+    elif current_month in [6, 7, 8]: season_advice = "Mùa Hè. Ưu tiên: Áo thun cotton, Quần Short."
+    elif current_month in [9, 10, 11]: season_advice = "Mùa Thu. Nên nhập: Áo Hoodie, Blazer."
+    else: season_advice = "Mùa Đông/Tết. Cần nhập gấp: Áo phao, Len dày."
+
+    if growth_rate > 10:   advice = f"Tăng mạnh (+{growth_rate:.1f}%). NHẬP THÊM HÀNG."
+    elif growth_rate > 0:  advice = f"Tăng nhẹ (+{growth_rate:.1f}%). Duy trì ổn định."
+    else:                   advice = f"Giảm ({growth_rate:.1f}%). Hạn chế nhập, Xả kho."
+
+    return {
+        "data": forecast['chart_data'],
+        "analysis": {
+            "trend": trend_status,
+            "growth_rate": round(growth_rate, 1),
+            "advice": advice,
+            "season_tip": season_advice,
+            "top_products": forecast['top_products']
+        }
+    }
+
+@app.get("/predict-revenue")
+def predict_revenue(refresh: bool = False):
+    """Kết quả dự báo do job nền 'predict-revenue' tính sẵn; refresh=true để tính lại ngay"""
+    try:
+        report, meta = jobs.scheduler.result("predict-revenue", refresh, force=refresh)
+        return {**report, "job": meta}
     except Exception as e:
         print(f"LỖI PREDICT REVENUE: {e}")
         return {"error": str(e), "data": [], "analysis": {}}
-    finally:
-        if conn and conn.is_connected():
-            conn.close()
+
+@app.get("/revenue-daily")
+def revenue_daily(days: int = 30):
+    """Doanh thu theo ngày (từ rollup) cho `days` ngày gần nhất"""
+    try:
+        revenue.rollup.refresh()
+        return {
+            "data": [{"date": d.isoformat(), "revenue": round(v)} for d, v in revenue.rollup.daily_series(days)],
+            "rollup": revenue.rollup.stats()
+        }
+    except Exception as e:
+        print(f"LỖI REVENUE DAILY: {e}")
+        return {"error": str(e), "data": []}
 # API 3: PHÂN KHÚC KHÁCH HÀNG BẰNG K-MEANS 
 @app.get("/customer-segments")
-def customer_segments():
+def customer_segments(page: int = 1, page_size: int = 100, label: Optional[str] = None,
+                      refit: bool = False, refresh: bool = False):
+    """
+    Trả kết quả phân khúc đã lưu (model MiniBatchKMeans được fit lại định kỳ,
+    khách mới/thay đổi được gán theo centroid đã lưu). Việc tính toán chạy trong
+    process pool của job 'customer-segments'; refresh=true / refit=true để tính lại ngay.
+    details hỗ trợ phân trang (page, page_size; page_size=0 = lấy hết) và lọc theo label.
+    """
     try:
-        conn = mysql.connector.connect(host="localhost", user="root", password="", database="shop_ai_db")
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT 
-                userId, 
-                COUNT(id) as Frequency, 
-                SUM(totalAmount) as Monetary, 
-                MAX(createdAt) as LastPurchaseDate
-            FROM `Order` 
-            WHERE status = 'COMPLETED'
-            GROUP BY userId
-        """)
-        raw_data = cursor.fetchall()
-        conn.close()
-
-        if not raw_data:
-            return {"status": "error", "message": "Chưa đủ dữ liệu đơn hàng để phân tích", "chart_data": [], "details": []}
+        report, meta = jobs.scheduler.result("customer-segments", refresh or refit, refit=refit)
 
-        df = pd.DataFrame(raw_data)
-        df['LastPurchaseDate'] = pd.to_datetime(df['LastPurchaseDate'])
-        
-        snapshot_date = df['LastPurchaseDate'].max() + pd.Timedelta(days=1)
-        df['Recency'] = (snapshot_date - df['LastPurchaseDate']).dt.days
-        df['Monetary'] = df['Monetary'].astype(float)
-
-        scaler = StandardScaler()
-        rfm_scaled = scaler.fit_transform(df[['Recency', 'Frequency', 'Monetary']])
-
-        n_clusters = 4 if len(df) >= 4 else len(df)
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        kmeans.fit(rfm_scaled)
-        df['Cluster'] = kmeans.labels_
-
-        cluster_avg = df.groupby('Cluster').agg({'Monetary': 'mean'}).reset_index()
-        cluster_avg = cluster_avg.sort_values(by='Monetary', ascending=False)
-        
-        sorted_clusters = cluster_avg['Cluster'].tolist()
-        label_map = {}
-        
-        if len(sorted_clusters) >= 4:
-            label_map[sorted_clusters[0]] = "VIP (Chi tiêu cao)"
-            label_map[sorted_clusters[1]] = "Khách hàng Tiềm năng"
-            label_map[sorted_clusters[2]] = "Khách hàng Thường xuyên"
-            label_map[sorted_clusters[3]] = "Nguy cơ rời bỏ"
-        else:
-            for idx, c in enumerate(sorted_clusters):
-                label_map[c] = f"Nhóm {idx + 1}"
-
-        df['Label'] = df['Cluster'].map(label_map)
-
-        segment_summary = df['Label'].value_counts().reset_index()
-        segment_summary.columns = ['name', 'value'] 
+        if not report:
+            return {"status": "error", "message": "Chưa đủ dữ liệu đơn hàng để phân tích", "chart_data": [], "details": []}
 
+        details, total = SegmentTable.from_payload(report['assignments']).details(label, page, page_size)
         return {
             "status": "success",
-            "chart_data": segment_summary.to_dict(orient='records'),
-            "details": df[['userId', 'Label', 'Recency', 'Frequency', 'Monetary']].to_dict(orient='records')
+            "chart_data": report['chart_data'],
+            "details": details,
+            "pagination": {"page": page, "page_size": page_size, "total": total},
+            "model": report['model'],
+            "job": meta
         }
 
+    except jobs.JobUnavailable as e:
+        return _job_unavailable(e)
     except Exception as e:
         print(f"LỖI PHÂN KHÚC: {e}")
         return {"status": "error", "error": str(e)}
 # === API 4: PHÂN TÍCH CẢM XÚC ĐÁNH GIÁ ===
+async def _review_report(retry_fallback=False):
+    """Phân loại review mới rồi tổng hợp thống kê trên toàn bộ nhãn đã lưu (job 'analyze-reviews')"""
+    store = sentiment.get_store()
+    processed = await sentiment.analyze_new_reviews(store, GOOGLE_API_KEY, retry_fallback)
+
+    counts = await run_in_threadpool(store.counts)
+    total = sum(counts.values())
+    if not total:
+        return {"status": "success", "stats": {"positive": 0, "negative": 0, "neutral": 0}, "warnings": [],
+                "total_reviews": 0}
+
+    percentages = {
+        "positive": round((counts.get(sentiment.POSITIVE, 0) / total) * 100, 1),
+        "negative": round((counts.get(sentiment.NEGATIVE, 0) / total) * 100, 1),
+        "neutral": round((counts.get(sentiment.NEUTRAL, 0) / total) * 100, 1)
+    }
+
+    products = await run_in_threadpool(store.product_stats)
+    warnings = [
+        f"Sản phẩm '{p['productName']}' đang bị phàn nàn nhiều ({p['negative']} đánh giá tiêu cực)! Cần kiểm tra lại chất lượng." 
+        for p in products if p['negative'] >= 2
+    ]
+
+    return {
+        "status": "success",
+        "stats": percentages,
+        "warnings": warnings,
+        "products": products,
+        "processed": processed,
+        "total_reviews": total
+    }
+
 @app.get("/analyze-reviews")
-def analyze_reviews():
+async def analyze_reviews(retry_fallback: bool = False, limit: int = 50, refresh: bool = False):
+    """
+    Chỉ gửi cho Gemini các review chưa được phân loại (chia lô, gửi song song có giới hạn),
+    nhãn được lưu lại; thống kê/cảnh báo tính trên toàn bộ nhãn đã lưu.
+    Kết quả do job nền 'analyze-reviews' tính sẵn; refresh=true để phân loại review mới ngay.
+    retry_fallback=true: thử phân loại lại các review đang dùng nhãn dự phòng theo số sao.
+    """
     try:
-        conn = mysql.connector.connect(host="localhost", user="root", password="", database="shop_ai_db")
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT r.id, r.content, r.rating, p.name as productName
-            FROM review r
-            JOIN product p ON r.productId = p.id
-            ORDER BY r.id DESC LIMIT 50
-        """)
-        reviews = cursor.fetchall()
-        conn.close()
-
-        if not reviews:
-            return {"status": "success", "stats": {"positive": 0, "negative": 0, "neutral": 0}, "warnings": [], "details": []}
-
-        review_texts = [{"id": r["id"], "content": r["content"]} for r in reviews]
-        
-        prompt_text = f"""
-        Bạn là một AI phân tích cảm xúc (Sentiment Analysis) chuyên nghiệp.
-        Hãy đọc danh sách các bình luận sau và phân loại thành đúng 1 trong 3 nhãn: 'Tích cực', 'Tiêu cực', hoặc 'Trung lập'.
-        CHỈ TRẢ VỀ MẢNG JSON THUẦN TÚY (Không dùng markdown, không giải thích gì thêm), định dạng mẫu:
-        [ {{"id": 1, "sentiment": "Tích cực"}}, {{"id": 2, "sentiment": "Tiêu cực"}} ]
-        
-        Dữ liệu đầu vào:
-        {json.dumps(review_texts, ensure_ascii=False)}
-        """
-
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GOOGLE_API_KEY}"
-        payload = {"contents": [{"parts": [{"text": prompt_text}]}]}
-        
-        response = requests.post(
-            url, 
-            headers={'Content-Type': 'application/json'}, 
-            json=payload,
-            timeout=18 
+        report, meta = await jobs.scheduler.result_async(
+            "analyze-reviews", refresh or retry_fallback, retry_fallback=retry_fallback
         )
-        result = response.json()
-        
-        if "candidates" not in result:
-            print(">>> LỖI TỪ GEMINI API:", result)
-            error_msg = result.get('error', {}).get('message', 'Lỗi không xác định từ Gemini')
-            return {"status": "error", "error": f"Gemini API Error: {error_msg}"}
-
-        raw_text = result['candidates'][0]['content']['parts'][0]['text']
-        raw_text = raw_text.replace("```json", "").replace("```", "").strip()
-        
-        try:
-            ai_results = json.loads(raw_text) 
-        except json.JSONDecodeError:
-            print(">>> LỖI PARSE JSON TỪ GEMINI:", raw_text)
-            ai_results = [] 
-
-        sentiment_map = {item['id']: item['sentiment'] for item in ai_results}
-        
-        stats = {"Tích cực": 0, "Tiêu cực": 0, "Trung lập": 0}
-        product_negative_count = {}
-        
-        for r in reviews:
-            fallback_sentiment = "Tích cực" if r["rating"] >= 4 else ("Tiêu cực" if r["rating"] <= 2 else "Trung lập")
-            sentiment = sentiment_map.get(r["id"], fallback_sentiment)
-            
-            if "Tích" in sentiment: sentiment = "Tích cực"
-            elif "Tiêu" in sentiment: sentiment = "Tiêu cực"
-            else: sentiment = "Trung lập"
-
-            r["sentiment"] = sentiment
-            stats[sentiment] += 1
-                
-            if sentiment == "Tiêu cực":
-                prod_name = r["productName"]
-                product_negative_count[prod_name] = product_negative_count.get(prod_name, 0) + 1
-
-        total = len(reviews)
-        percentages = {
-            "positive": round((stats["Tích cực"] / total) * 100, 1),
-            "negative": round((stats["Tiêu cực"] / total) * 100, 1),
-            "neutral": round((stats["Trung lập"] / total) * 100, 1)
-        }
-
-        warnings = [
-            f"Sản phẩm '{name}' đang bị phàn nàn nhiều ({count} đánh giá tiêu cực)! Cần kiểm tra lại chất lượng." 
-            for name, count in product_negative_count.items() if count >= 2
-        ]
-
-        return {
-            "status": "success",
-            "stats": percentages,
-            "warnings": warnings,
-            "details": reviews
-        }
+        details = []
+        if report.get("total_reviews"):
+            details = await run_in_threadpool(sentiment.get_store().latest, limit)
+        return {**report, "details": details, "job": meta}
 
+    except jobs.JobUnavailable as e:
+        return _job_unavailable(e)
     except Exception as e:
         print(f"LỖI PHÂN TÍCH CẢM XÚC: {e}")
         return {"status": "error", "error": str(e)}
 # === API 5: VISUAL SEARCH (TÌM KIẾM BẰNG HÌNH ẢNH) ===
+VISUAL_TOP_K = int(os.getenv("VISUAL_TOP_K", "12"))
+VISUAL_RERANK = os.getenv("VISUAL_RERANK", "0") == "1"
+
 class ImageSearchRequest(BaseModel):
     image_base64: str
+    rerank: Optional[bool] = None
 
-@app.post("/visual-search")
-def visual_search(req: ImageSearchRequest):
-    print(">>> [PYTHON] Đã nhận request! Đang kết nối Database...")
-    try:
-        base64_data = req.image_base64
-        mime_type = "image/jpeg"  # mặc định
-
-        if "," in base64_data:
-            header, base64_data = base64_data.split(",", 1)
-            if "image/png" in header:
-                mime_type = "image/png"
-            elif "image/webp" in header:
-                mime_type = "image/webp"
-            elif "image/gif" in header:
-                mime_type = "image/gif"
-            elif "image/jpeg" in header or "image/jpg" in header:
-                mime_type = "image/jpeg"
-
-        print(f">>> [PYTHON] Loại ảnh phát hiện: {mime_type}")
-
-        conn = mysql.connector.connect(host="localhost", user="root", password="", database="shop_ai_db")
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT id, name, category, price, image FROM Product")
-        products = cursor.fetchall()
-        conn.close()
+visual = components.register("visual_index", lambda: visual_index.VisualIndex(chroma_client.get()))
 
-        if not products:
-            return {"status": "error", "message": "Không có sản phẩm trong DB", "data": []}
-
-        prod_list = [{"id": p["id"], "name": p["name"], "category": p["category"]} for p in products]
+@app.get("/api/ai/sync-image-index")
+def sync_image_index():
+    """Đồng bộ chỉ mục vector ảnh sản phẩm (chỉ encode ảnh mới/đổi link)"""
+    try:
+        products = catalog.get(force_check=True).rows(["id", "name", "category", "price", "image"])
+        report = compute.call(visual.get().sync, products)
+        return {"status": "success", "report": report, "indexed": visual.get().count()}
+    except Exception as e:
+        print(f"LỖI SYNC IMAGE INDEX: {e}")
+        return {"status": "error", "message": str(e)}
 
-        prompt_text = f"""
+def _parse_id_list(raw_text):
+    raw_text = raw_text.replace("```json", "").replace("```", "").strip()
+    try:
+        with tracing.stage("json_parse"):
+            ids = json.loads(raw_text)
+        return ids if isinstance(ids, list) else []
+    except json.JSONDecodeError:
+        print(">>> LỖI PARSE JSON:", raw_text)
+        return []
+
+async def _ask_gemini_for_ids(prod_list, mime_type, base64_data):
+    prompt_text = f"""
         Bạn là chuyên gia thời trang AI. Khách hàng vừa tải lên một bức ảnh.
         Hãy quan sát bức ảnh này và tìm ra TỐI ĐA 4 sản phẩm CÓ KIỂU DÁNG HOẶC MÀU SẮC GIỐNG NHẤT từ danh sách cửa hàng sau:
         {json.dumps(prod_list, ensure_ascii=False)}
@@ -553,119 +764,181 @@ def visual_search(req: ImageSearchRequest):
         CHỈ TRẢ VỀ MẢNG JSON chứa ID của các sản phẩm bạn chọn (ví dụ: [1, 5, 12]). 
         Không giải thích, không dùng markdown.
         """
+    contents = [{
+        "parts": [
+            {"text": prompt_text},
+            {"inline_data": {"mime_type": mime_type, "data": base64_data}}
+        ]
+    }]
+    return _parse_id_list(await gemini.generate(contents, GOOGLE_API_KEY, timeout=30))
+
+def _fetch_products_by_ids(ids):
+    snapshot = catalog.get()
+    out = []
+    for i in ids:
+        p = snapshot.get(i) if isinstance(i, int) or str(i).isdigit() else None
+        if p:
+            out.append({k: p[k] for k in ("id", "name", "category", "price", "image")})
+    return out
 
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GOOGLE_API_KEY}"
-
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": prompt_text},
-                        {
-                            "inline_data": {
-                                "mime_type": mime_type,  # ✅ FIX: dùng mime_type động, không hardcode
-                                "data": base64_data
-                            }
-                        }
-                    ]
-                }
-            ]
-        }
-
-        print(">>> [PYTHON] Đang gửi ảnh sang Gemini AI...")
-        response = requests.post(
-            url,
-            headers={'Content-Type': 'application/json'},
-            json=payload,
-            timeout=30  
-        )
-
-        print(">>> [PYTHON] Gemini đã trả lời xong! Đang phân tích kết quả...")
-        result = response.json()
-
-        if "candidates" not in result:
-            print(">>> LỖI GEMINI VISUAL SEARCH:", result)
-            error_msg = result.get('error', {}).get('message', 'Lỗi không xác định')
-            return {"status": "error", "message": f"Gemini lỗi: {error_msg}", "data": []}
-
-        raw_text = result['candidates'][0]['content']['parts'][0]['text']
-        raw_text = raw_text.replace("```json", "").replace("```", "").strip()
-
-        try:
-            matched_ids = json.loads(raw_text)
-            if not isinstance(matched_ids, list):
-                matched_ids = []
-        except json.JSONDecodeError:
-            print(">>> LỖI PARSE JSON:", raw_text)
-            matched_ids = []
-            
-        matched_products = [p for p in products if p["id"] in matched_ids]
-
-        print(f">>> [PYTHON] Tìm thấy {len(matched_products)} sản phẩm phù hợp.")
+@app.post("/visual-search")
+async def visual_search(req: ImageSearchRequest):
+    try:
+        with tracing.stage("decode_image"):
+            image, mime_type, base64_data = await run_in_threadpool(visual_index.decode_image, req.image_base64)
+
+        # 1. Encode ảnh trên CPU và lấy danh sách ứng viên gần nhất từ chỉ mục ảnh
+        candidates = await run_in_threadpool(visual.get().search, image, VISUAL_TOP_K)
+
+        if not candidates:
+            # Chỉ mục ảnh chưa được đồng bộ -> quay về cách cũ: gửi toàn bộ danh mục cho Gemini
+            products = (await catalog.get_async()).rows(["id", "name", "category", "price", "image"])
+            if not products:
+                return {"status": "error", "message": "Không có sản phẩm trong DB", "data": []}
+            prod_list = [{"id": p["id"], "name": p["name"], "category": p["category"]} for p in products]
+            print(">>> [PYTHON] Chỉ mục ảnh trống, gửi toàn bộ danh mục sang Gemini AI...")
+            matched_ids = await _ask_gemini_for_ids(prod_list, mime_type, base64_data)
+            matched_products = [p for p in products if p["id"] in matched_ids]
+            return {"status": "success", "data": matched_products}
+
+        matched_ids = [c["id"] for c in candidates[:4]]
+
+        # 2. (Tuỳ chọn) nhờ Gemini xếp hạng lại, chỉ gửi danh sách ứng viên ngắn
+        rerank = VISUAL_RERANK if req.rerank is None else req.rerank
+        if rerank:
+            shortlist = [{"id": c["id"], "name": c["name"], "category": c["category"]} for c in candidates]
+            try:
+                candidate_ids = {c["id"] for c in candidates}
+                reranked = [i for i in await _ask_gemini_for_ids(shortlist, mime_type, base64_data) if i in candidate_ids]
+                if reranked:
+                    matched_ids = reranked[:4]
+            except (gemini.GeminiError, httpx.HTTPError) as e:
+                print(f">>> LỖI GEMINI RERANK, dùng thứ tự vector: {e}")
+
+        matched_products = await run_in_threadpool(_fetch_products_by_ids, matched_ids)
         return {
             "status": "success",
             "data": matched_products
         }
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         print(">>> LỖI: Gemini timeout sau 30 giây!")
         return {"status": "error", "message": "AI phân tích quá lâu, vui lòng thử lại.", "data": []}
+    except gemini.GeminiUnavailable as e:
+        return {"status": "error", "message": f"AI đang bận, vui lòng thử lại sau ({e}).", "data": []}
+    except gemini.GeminiError as e:
+        print(">>> LỖI GEMINI VISUAL SEARCH:", e)
+        return {"status": "error", "message": f"Gemini lỗi: {e}", "data": []}
     except Exception as e:
         print(f"LỖI VISUAL SEARCH: {e}")
         return {"status": "error", "message": str(e), "data": []}
     
+CART_TOP_K = 10
+
+def _top_k(mask, key, k=CART_TOP_K):
+    """Chỉ số của k phần tử có key lớn nhất trong mask (giữ thứ tự gốc khi bằng nhau)"""
+    idx = np.flatnonzero(mask)
+    return idx[np.argsort(-key[idx], kind="stable")[:k]]
+
+def _cart_item(snapshot, pos, adds, removes):
+    return {
+        "id": int(snapshot.ids[pos]),
+        "name": snapshot.names[pos],
+        "price": float(snapshot.prices[pos]),
+        "image": snapshot.images[pos],
+        "adds_count": int(adds),
+        "removes_count": int(removes),
+    }
+
+def _cart_window_insights(snapshot, window):
+    """Tỉ lệ bỏ giỏ + lọc + top-k tính trên mảng, chỉ tạo dict cho tối đa 2*CART_TOP_K sản phẩm trả về"""
+    pids, counts = cart_counters.counters.count_arrays(window)
+    pos = snapshot.positions(pids)
+    adds, removes = counts[:, 0], counts[:, 1]
+
+    # removes / adds * 100, chưa có lượt thêm nào -> 100%
+    abandon_rate = np.divide(removes, adds, out=np.ones(len(pids)), where=adds > 0) * 100
+    active = (pos >= 0) & (adds + removes > 0)
+    trending = active & (adds >= 5) & (abandon_rate < 30)
+    flashsale = active & ~trending & (removes >= 3) & (abandon_rate >= 50)
+
+    trending_products = []
+    for i in _top_k(trending, adds):
+        item = _cart_item(snapshot, pos[i], adds[i], removes[i])
+        item['reason'] = f"Được thêm {item['adds_count']} lần, giữ lại giỏ hàng tốt."
+        trending_products.append(item)
+
+    flashsale_candidates = []
+    for i in _top_k(flashsale, removes):
+        item = _cart_item(snapshot, pos[i], adds[i], removes[i])
+        rate = round(float(abandon_rate[i]), 1) if adds[i] > 0 else 100
+        item['abandon_rate'] = rate
+        item['reason'] = f"Tỷ lệ bỏ giỏ: {rate}% ({item['removes_count']} lần xoá). Cần giảm giá!"
+        flashsale_candidates.append(item)
+
+    return {
+        "trending": trending_products,
+        "flashsale_needed": flashsale_candidates,
+    }
+
+def _cart_report(force=False):
+    """Insight giỏ hàng cho mọi cửa sổ thời gian (job 'cart-insights')"""
+    # Bộ đếm chỉ đọc thêm các dòng UserInteraction mới (id > watermark) thay vì GROUP BY toàn bảng
+    cart_counters.counters.refresh(force=force)
+    snapshot = catalog.get()
+    return {window: _cart_window_insights(snapshot, window) for window in ("all", *cart_counters.WINDOWS)}
+
 @app.get("/cart-insights")
-def cart_insights():
+def cart_insights(window: str = "all", refresh: bool = False):
     try:
-        conn = mysql.connector.connect(host="localhost", user="root", password="", database="shop_ai_db")
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT 
-                p.id, 
-                p.name, 
-                p.price,
-                p.image,
-                SUM(CASE WHEN ui.action = 'ADD_TO_CART' THEN 1 ELSE 0 END) as adds_count,
-                SUM(CASE WHEN ui.action = 'REMOVE_FROM_CART' THEN 1 ELSE 0 END) as removes_count
-            FROM Product p
-            JOIN UserInteraction ui ON p.id = ui.productId
-            GROUP BY p.id
-        """)
-        cart_data = cursor.fetchall()
-        conn.close()
-
-        trending_products = []
-        flashsale_candidates = []
-
-        for item in cart_data:
-            adds = int(item['adds_count'])
-            removes = int(item['removes_count'])
-            total_interactions = adds + removes
-
-            if total_interactions == 0:
-                continue
-
-            abandon_rate = (removes / adds) * 100 if adds > 0 else 100
-
-            if adds >= 5 and abandon_rate < 30:
-                item['reason'] = f"Được thêm {adds} lần, giữ lại giỏ hàng tốt."
-                trending_products.append(item)
-            
-            elif removes >= 3 and abandon_rate >= 50:
-                item['abandon_rate'] = round(abandon_rate, 1)
-                item['reason'] = f"Tỷ lệ bỏ giỏ: {round(abandon_rate, 1)}% ({removes} lần xoá). Cần giảm giá!"
-                flashsale_candidates.append(item)
-
-        trending_products = sorted(trending_products, key=lambda x: x['adds_count'], reverse=True)
-        flashsale_candidates = sorted(flashsale_candidates, key=lambda x: x['removes_count'], reverse=True)
-
-        return {
-            "status": "success",
-            "trending": trending_products[:10], 
-            "flashsale_needed": flashsale_candidates[:10]
-        }
+        if window != "all" and window not in cart_counters.WINDOWS:
+            return {"status": "error", "message": f"window phải là all hoặc {', '.join(cart_counters.WINDOWS)}",
+                    "trending": [], "flashsale_needed": []}
+        report, meta = jobs.scheduler.result("cart-insights", refresh, force=refresh)
+        return {"status": "success", **report[window], "window": window, "job": meta}
 
     except Exception as e:
         print(f"LỖI PHÂN TÍCH GIỎ HÀNG: {e}")
         return {"status": "error", "message": str(e), "trending": [], "flashsale_needed": []}
+
+def _recommender_report(force=False):
+    """Nạp tương tác mới + tính lại hàng xóm (job 'recommender'), request chỉ đọc kết quả đang có"""
+    recommender.refresh(force=force)
+    return recommender.stats()
+
+@app.get("/recommendations/{user_id}")
+def recommendations(user_id: int, k: int = 10):
+    """Gợi ý cho khách theo sản phẩm tương tự những gì họ đã xem/thêm giỏ/mua (item-item CF)"""
+    try:
+        t = time.perf_counter()
+        recommender.ensure_fresh()
+        products = _recommended_products(recommender.recommend(user_id, k=k * 2), k)
+        return {"status": "success", "userId": user_id, "data": products,
+                "took_ms": round((time.perf_counter() - t) * 1000, 2)}
+    except Exception as e:
+        print(f"LỖI GỢI Ý: {e}")
+        return {"status": "error", "message": str(e), "data": []}
+
+@app.get("/similar-products/{product_id}")
+def similar_products(product_id: int, k: int = 10):
+    """Sản phẩm hay được cùng xem/mua với sản phẩm này"""
+    try:
+        t = time.perf_counter()
+        recommender.ensure_fresh()
+        products = _recommended_products(recommender.similar(product_id, k=k * 2), k)
+        return {"status": "success", "productId": product_id, "data": products,
+                "took_ms": round((time.perf_counter() - t) * 1000, 2)}
+    except Exception as e:
+        print(f"LỖI SẢN PHẨM TƯƠNG TỰ: {e}")
+        return {"status": "error", "message": str(e), "data": []}
+
+@app.get("/api/ai/recommender-stats")
+def recommender_stats(refresh: bool = False):
+    if refresh:
+        recommender.refresh(force=True)
+    return recommender.stats()
+
+@app.get("/api/ai/cart-counter-stats")
+def cart_counter_stats():
+    """Watermark, số sản phẩm và số bucket giờ của bộ đếm giỏ hàng"""
+    return cart_counters.counters.stats()
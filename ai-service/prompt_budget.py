@@ -0,0 +1,183 @@
+# ai_service/prompt_budget.py
+# Giới hạn kích thước prompt chatbot: cắt/tóm tắt lịch sử cũ, không lặp lại sản phẩm đã giới thiệu,
+# giới hạn phần context sản phẩm theo số token và đếm số token tiết kiệm được mỗi request
+import os
+import re
+import threading
+
+import tracing
+from gemini import estimate_tokens
+
+CONTEXT_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKENS", "1200"))     # danh sách sản phẩm (RAG + gợi ý)
+HISTORY_BUDGET = int(os.getenv("CHAT_HISTORY_TOKENS", "800"))      # lịch sử hội thoại (nguyên văn + tóm tắt)
+HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "6"))
+# Số lượt gần nhất được gửi nguyên văn (mỗi lượt tối đa TURN_MAX_TOKENS), lượt cũ hơn chỉ gửi bản tóm tắt
+HISTORY_KEEP = int(os.getenv("CHAT_HISTORY_KEEP", "2"))
+TURN_MAX_TOKENS = int(os.getenv("CHAT_TURN_MAX_TOKENS", "300"))
+SUMMARY_TURN_TOKENS = int(os.getenv("CHAT_SUMMARY_TURN_TOKENS", "60"))
+
+_IMAGE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+_PRODUCT_LINK = re.compile(r"\[[^\]]*\]\(/product/(\d+)\)")
+_LONG_URL = re.compile(r"(?:https?://|data:)\S{40,}")
+_SHOWN = re.compile(r"/product/(\d+)")
+
+
+def truncate(text, max_tokens):
+    """Cắt text còn khoảng max_tokens token (theo cách ước lượng của gemini.estimate_tokens), cắt ở khoảng trắng"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cut = text.encode("utf-8")[:max_tokens * 4].decode("utf-8", "ignore")
+    space = cut.rfind(" ")
+    return (cut[:space] if space > len(cut) // 2 else cut).rstrip() + "…"
+
+
+def strip_media(text):
+    """Bỏ ảnh markdown / link dài khỏi câu trả lời cũ: ![Áo](https://...) -> [ảnh: Áo]"""
+    text = _IMAGE.sub(lambda m: f"[ảnh: {m.group(1)}]", text)
+    text = _PRODUCT_LINK.sub(lambda m: f"(SP {m.group(1)})", text)
+    return _LONG_URL.sub("[link]", text)
+
+
+def shown_product_ids(history):
+    """ID sản phẩm shop đã giới thiệu (có link /product/ID) trong các lượt trả lời trước"""
+    ids = set()
+    for role, text in history:
+        if role == "model":
+            ids.update(int(i) for i in _SHOWN.findall(text))
+    return ids
+
+
+def _product_block(p):
+    block = f"- Tên sản phẩm: {p.get('name')} (ID: {p['id']})\n"
+    block += f"  Giá: {p.get('price')} VNĐ\n"
+    if p.get('category'):
+        block += f"  Loại: {p['category']} | Còn: {p.get('stock')}\n"
+    block += f"  Link ảnh: {p.get('image')}\n"
+    return block + "----------\n"
+
+
+def _shown_block(p):
+    return f"- {p.get('name')} (ID: {p['id']}) | Giá: {p.get('price')} VNĐ | đã giới thiệu ở lượt trước\n"
+
+
+def _pick_line(p):
+    return f"- Tên sản phẩm: {p['name']} (ID: {p['id']}) | Giá: {p['price']} VNĐ | Link ảnh: {p['image']}\n"
+
+
+def render_products(products, shown=(), budget=None):
+    """
+    Danh sách sản phẩm RAG theo thứ tự liên quan; sản phẩm đã giới thiệu chỉ còn 1 dòng ngắn.
+    Dừng khi vượt budget token; sản phẩm đầu tiên luôn được giữ, tự nó vượt budget (vd. ảnh data URL
+    dài) thì bị cắt còn budget. Trả về (text, id đã đưa vào, số bị bỏ).
+    """
+    text, ids = "", []
+    for i, p in enumerate(products):
+        block = _shown_block(p) if int(p['id']) in shown else _product_block(p)
+        if budget is not None and estimate_tokens(text + block) > budget:
+            if ids:
+                return text, ids, len(products) - i
+            block = truncate(block, budget) + "\n"
+        text += block
+        ids.append(p['id'])
+    return text, ids, 0
+
+
+def render_picks(picks, shown=(), budget=None):
+    picks = [p for p in picks if int(p['id']) not in shown]
+    text, ids = "", []
+    for p in picks:
+        line = _pick_line(p)
+        if budget is not None and estimate_tokens(text + line) > budget:
+            break
+        text += line
+        ids.append(p['id'])
+    return text, ids
+
+
+def compact_history(history):
+    """
+    (tóm tắt các lượt cũ, các lượt gần nhất gửi nguyên văn). Lượt cũ bị bỏ ảnh/link và rút gọn,
+    lịch sử vượt HISTORY_BUDGET thì bỏ bớt dòng tóm tắt cũ nhất.
+    """
+    history = history[-HISTORY_TURNS:] if HISTORY_TURNS > 0 else []
+    split = max(len(history) - HISTORY_KEEP, 0)
+    older, recent = history[:split], history[split:]
+
+    recent = [(role, truncate(strip_media(text) if role == "model" else text, TURN_MAX_TOKENS))
+              for role, text in recent]
+    lines = [f"{'Khách' if role == 'user' else 'Shop'}: {truncate(strip_media(text), SUMMARY_TURN_TOKENS)}"
+             for role, text in older]
+
+    used = sum(estimate_tokens(text) for _, text in recent)
+    while lines and used + sum(estimate_tokens(line) for line in lines) > HISTORY_BUDGET:
+        lines.pop(0)
+    while len(recent) > 1 and used > HISTORY_BUDGET:
+        used -= estimate_tokens(recent.pop(0)[1])
+    return "\n".join(lines), recent
+
+
+class _BudgetStats:
+    def __init__(self):
+        self.requests = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.products_dropped = 0
+        self.turns_summarized = 0
+        self._lock = threading.Lock()
+
+    def record(self, report):
+        with self._lock:
+            self.requests += 1
+            self.tokens_before += report["tokens_before"]
+            self.tokens_after += report["tokens_after"]
+            self.products_dropped += report["products_dropped"]
+            self.turns_summarized += report["turns_summarized"]
+
+    def snapshot(self):
+        with self._lock:
+            saved = self.tokens_before - self.tokens_after
+            return {
+                "requests": self.requests,
+                "tokens_before": self.tokens_before,
+                "tokens_after": self.tokens_after,
+                "tokens_saved": saved,
+                "saved_ratio": round(saved / self.tokens_before, 3) if self.tokens_before else 0,
+                "avg_tokens_per_request": round(self.tokens_after / self.requests, 1) if self.requests else 0,
+                "products_dropped": self.products_dropped,
+                "turns_summarized": self.turns_summarized,
+            }
+
+
+budget_stats = _BudgetStats()
+
+
+def contents_tokens(contents):
+    return sum(estimate_tokens(part.get("text", "")) for c in contents for part in c.get("parts", []))
+
+
+def report(contents_before, contents_after, products_dropped, turns_summarized):
+    """Ghi nhận số token trước/sau khi cắt gọn vào trace của request + thống kê chung"""
+    result = {
+        "tokens_before": contents_tokens(contents_before),
+        "tokens_after": contents_tokens(contents_after),
+        "products_dropped": products_dropped,
+        "turns_summarized": turns_summarized,
+    }
+    result["tokens_saved"] = result["tokens_before"] - result["tokens_after"]
+    tracing.size("prompt", "tokens", result["tokens_after"])
+    tracing.size("prompt", "tokens_saved", max(result["tokens_saved"], 0))
+    budget_stats.record(result)
+    return result
+
+
+def stats():
+    return {
+        "budgets": {
+            "context_tokens": CONTEXT_BUDGET,
+            "history_tokens": HISTORY_BUDGET,
+            "history_turns": HISTORY_TURNS,
+            "history_keep": HISTORY_KEEP,
+            "turn_max_tokens": TURN_MAX_TOKENS,
+        },
+        **budget_stats.snapshot(),
+    }
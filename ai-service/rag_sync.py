@@ -0,0 +1,126 @@
+# ai_service/rag_sync.py
+# Đồng bộ tăng dần (incremental) bảng Product -> ChromaDB
+import os
+import time
+import hashlib
+
+import tracing
+
+SYNC_BATCH_SIZE = int(os.getenv("RAG_SYNC_BATCH_SIZE", "256"))
+
+SYNC_MODES = ("incremental", "new", "full")
+
+
+def build_document(p):
+    return f"Tên sản phẩm: {p['name']}. Mô tả: {p['description']}"
+
+
+def build_metadata(p):
+    # price giữ dạng chuỗi như cũ; price_value/stock/category dùng để lọc (where) khi truy xuất
+    return {
+        "name": p['name'],
+        "price": str(p['price']),
+        "price_value": float(p['price']),
+        "stock": int(p.get('stock') or 0),
+        "category": p.get('category') or "",
+        "image": p['image'] if p['image'] else ""
+    }
+
+
+def _hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _created_ts(p):
+    created = p.get('createdAt')
+    return int(created.timestamp()) if created else 0
+
+
+def load_existing(collection):
+    """Lấy id + metadata đang có trong ChromaDB (không lấy vector)"""
+    existing = collection.get(include=["metadatas"])
+    return dict(zip(existing["ids"], existing["metadatas"]))
+
+
+def get_watermark(existing_metas):
+    """Mốc createdAt lớn nhất đã có trong Vector DB (dùng cho mode 'new')"""
+    return max((m.get("created_at", 0) for m in existing_metas.values() if m), default=0)
+
+
+def sync_products(products, collection, encode, mode="incremental", all_ids=None, existing_metas=None):
+    """
+    So sánh sản phẩm trong MySQL với ChromaDB và chỉ cập nhật phần thay đổi.
+    - incremental: băm nội dung từng sản phẩm, chỉ encode lại sản phẩm mới / đổi mô tả
+    - new: chỉ nhận sản phẩm mới (products đã được lọc theo watermark createdAt),
+           all_ids là danh sách id hiện có để phát hiện sản phẩm bị xoá
+    - full: encode lại toàn bộ nhưng vẫn upsert (không xoá trắng collection)
+    """
+    timings = {}
+    t0 = time.perf_counter()
+
+    if existing_metas is None:
+        existing_metas = load_existing(collection)
+    timings["load_existing"] = time.perf_counter() - t0
+
+    # 1. Phân loại sản phẩm: bỏ qua / chỉ đổi metadata / cần encode lại
+    t0 = time.perf_counter()
+    to_embed, meta_only = [], []
+    skipped = 0
+    for p in products:
+        pid = str(p['id'])
+        doc = build_document(p)
+        meta = build_metadata(p)
+        meta["doc_hash"] = _hash(doc)
+        meta["meta_hash"] = _hash("|".join(str(meta[key]) for key in sorted(meta) if key != "doc_hash"))
+        meta["created_at"] = _created_ts(p)
+
+        old = existing_metas.get(pid)
+        if mode == "full" or not old or old.get("doc_hash") != meta["doc_hash"]:
+            to_embed.append((pid, doc, meta))
+        elif old.get("meta_hash") != meta["meta_hash"]:
+            meta_only.append((pid, meta))
+        else:
+            skipped += 1
+
+    current_ids = set(all_ids) if all_ids is not None else {str(p['id']) for p in products}
+    removed_ids = [pid for pid in existing_metas if pid not in current_ids]
+    timings["diff"] = time.perf_counter() - t0
+
+    # 2. Encode + upsert theo từng lô để không giữ toàn bộ vector trong RAM
+    t0 = time.perf_counter()
+    embed_time = 0.0
+    for i in range(0, len(to_embed), SYNC_BATCH_SIZE):
+        batch = to_embed[i:i + SYNC_BATCH_SIZE]
+        t_enc = time.perf_counter()
+        embeddings = encode([doc for _, doc, _ in batch]).tolist()
+        embed_time += time.perf_counter() - t_enc
+        tracing.record("embed.batch", time.perf_counter() - t_enc)
+        collection.upsert(
+            ids=[pid for pid, _, _ in batch],
+            embeddings=embeddings,
+            documents=[doc for _, doc, _ in batch],
+            metadatas=[meta for _, _, meta in batch]
+        )
+    if meta_only:
+        collection.update(
+            ids=[pid for pid, _ in meta_only],
+            metadatas=[meta for _, meta in meta_only]
+        )
+    timings["embed"] = embed_time
+    timings["upsert"] = time.perf_counter() - t0 - embed_time
+
+    # 3. Chỉ xoá những sản phẩm không còn trong MySQL
+    t0 = time.perf_counter()
+    if removed_ids:
+        collection.delete(ids=removed_ids)
+    timings["delete"] = time.perf_counter() - t0
+
+    return {
+        "mode": mode,
+        "total": len(current_ids),
+        "embedded": len(to_embed),
+        "metadata_updated": len(meta_only),
+        "skipped": skipped,
+        "deleted": len(removed_ids),
+        "timings_ms": {k: round(v * 1000, 1) for k, v in timings.items()},
+    }
@@ -0,0 +1,251 @@
+# ai_service/recommend.py
+# Gợi ý sản phẩm kiểu collaborative filtering: ma trận thưa user x sản phẩm + top-k sản phẩm tương tự
+import os
+import time
+import threading
+
+import numpy as np
+
+import db
+
+TOP_K_NEIGHBOURS = int(os.getenv("RECO_NEIGHBOURS", "20"))
+REFRESH_INTERVAL = float(os.getenv("RECO_REFRESH_INTERVAL", "60"))
+FETCH_CHUNK = int(os.getenv("RECO_FETCH_CHUNK", "10000"))
+# Khi số sản phẩm bị ảnh hưởng vượt tỉ lệ này thì tính lại toàn bộ thay vì từng hàng
+FULL_REBUILD_RATIO = float(os.getenv("RECO_FULL_REBUILD_RATIO", "0.3"))
+
+# Trọng số tín hiệu quan tâm; mua hàng tính theo số lượng
+ACTION_WEIGHTS = {"VIEW": 1.0, "ADD_TO_CART": 3.0, "REMOVE_FROM_CART": -2.0}
+PURCHASE_WEIGHT = 5.0
+CANCELLED_STATUSES = ("CANCELLED", "CANCELED", "REFUNDED")
+
+INTERACTION_SCHEMA = {'id': 'int64', 'userId': 'int64', 'productId': 'int64', 'action': 'object'}
+ORDER_ITEM_SCHEMA = {'id': 'int64', 'userId': 'int64', 'productId': 'int64', 'quantity': 'int64', 'status': 'object'}
+
+
+def _positions(index, ids):
+    """Chỉ số hàng/cột của từng id (mảng); id mới được cấp chỉ số tiếp theo (chỉ lặp trên id khác nhau)"""
+    unique, inverse = np.unique(ids, return_inverse=True)
+    pos = np.fromiter((index.setdefault(i, len(index)) for i in unique.tolist()), dtype=np.int32, count=len(unique))
+    return pos[inverse]
+
+
+class Recommender:
+    """
+    Điểm quan tâm user x sản phẩm giữ dạng COO (hàng, cột, điểm): tương tác mới (theo id watermark của
+    UserInteraction và OrderItem) chỉ được nối thêm vào cuối, lúc dựng ma trận scipy cộng dồn các ô
+    trùng rồi thu gọn lại. neighbours[productId] = [(productId, cosine)] top-k, chỉ tính lại cho sản
+    phẩm có tương tác mới và các sản phẩm đang đứng cạnh chúng.
+    """
+
+    def __init__(self):
+        self.user_index = {}        # userId -> hàng
+        self.item_index = {}        # productId -> cột
+        self._coo = (np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0, np.float64))
+        self._pending = []          # các lô (hàng, cột, điểm) chưa gộp vào _coo
+        self._history = None        # (ma trận điểm đã cộng dồn dạng CSR, productId theo cột)
+        self.neighbours = {}
+        self.popular = []           # [(productId, điểm)] cho user chưa có lịch sử
+        self.interaction_watermark = 0
+        self.item_watermark = 0
+        self.version = 0
+        self.last_refresh = 0.0
+        self.last_build = {}
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    # ---------- nạp dữ liệu ----------
+
+    def _append(self, user_ids, product_ids, weights, touched):
+        if len(weights):
+            self._pending.append((_positions(self.user_index, user_ids), _positions(self.item_index, product_ids),
+                                  np.asarray(weights, dtype=np.float64)))
+            touched.append(product_ids)
+
+    def _load_new(self):
+        touched = []
+        for chunk in db.iter_columns(
+            "SELECT id, userId, productId, action FROM UserInteraction WHERE id > %s ORDER BY id",
+            (self.interaction_watermark,), INTERACTION_SCHEMA, FETCH_CHUNK
+        ):
+            weights = np.zeros(len(chunk['id']))
+            known = np.zeros(len(chunk['id']), dtype=bool)
+            for action, weight in ACTION_WEIGHTS.items():
+                hit = chunk['action'] == action
+                weights[hit] = weight
+                known |= hit
+            self._append(chunk['userId'][known], chunk['productId'][known], weights[known], touched)
+            self.interaction_watermark = int(chunk['id'][-1])
+        for chunk in db.iter_columns(
+            "SELECT oi.id, o.userId, oi.productId, oi.quantity, o.status FROM OrderItem oi "
+            "JOIN `Order` o ON oi.orderId = o.id WHERE oi.id > %s ORDER BY oi.id",
+            (self.item_watermark,), ORDER_ITEM_SCHEMA, FETCH_CHUNK
+        ):
+            keep = ~np.isin(chunk['status'], CANCELLED_STATUSES)
+            weights = PURCHASE_WEIGHT * np.maximum(chunk['quantity'][keep], 1)
+            self._append(chunk['userId'][keep], chunk['productId'][keep], weights, touched)
+            self.item_watermark = int(chunk['id'][-1])
+        return set(np.unique(np.concatenate(touched)).tolist()) if touched else set()
+
+    # ---------- ma trận + độ tương tự ----------
+
+    def _matrix(self):
+        """
+        Gộp các lô mới vào COO (cộng dồn ô trùng trong scipy, không lặp Python theo từng ô) rồi trả về
+        ma trận user x sản phẩm (log1p điểm dương), cột đã chuẩn hoá L2 để X.T @ X là cosine
+        """
+        from scipy import sparse
+        rows, cols, vals = (np.concatenate(parts) for parts in zip(self._coo, *self._pending))
+        raw = sparse.csr_matrix((vals, (rows, cols)), shape=(len(self.user_index), len(self.item_index)))
+        raw.sum_duplicates()
+        compact = raw.tocoo()
+        self._coo = (compact.row.astype(np.int32), compact.col.astype(np.int32), compact.data)
+        self._pending = []
+        item_ids = np.fromiter(self.item_index, dtype=np.int64, count=len(self.item_index))
+        self._history = (raw, item_ids)
+
+        X = raw.copy()
+        X.data = np.log1p(np.maximum(X.data, 0)).astype(np.float32)
+        X.eliminate_zeros()
+        norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=0)).ravel())
+        norms[norms == 0] = 1.0
+        X = sparse.csr_matrix(X.multiply(1.0 / norms[np.newaxis, :]))
+        return X, item_ids
+
+    def _top_k_rows(self, X, columns, item_ids):
+        """Tính lại danh sách hàng xóm cho các cột (chỉ số) cho trước"""
+        from scipy import sparse
+        out = {}
+        if not len(columns):
+            return out
+        sims = sparse.csr_matrix(X[:, columns].T @ X)
+        for r, j in enumerate(columns):
+            start, end = sims.indptr[r], sims.indptr[r + 1]
+            idx, val = sims.indices[start:end], sims.data[start:end]
+            keep = idx != j
+            idx, val = idx[keep], val[keep]
+            if len(val) > TOP_K_NEIGHBOURS:
+                part = np.argpartition(-val, TOP_K_NEIGHBOURS)[:TOP_K_NEIGHBOURS]
+                idx, val = idx[part], val[part]
+            order = np.argsort(-val)
+            out[int(item_ids[j])] = [(int(item_ids[i]), round(float(v), 4)) for i, v in zip(idx[order], val[order])]
+        return out
+
+    def _rebuild(self, touched, full):
+        from scipy import sparse
+        t0 = time.perf_counter()
+        X, item_ids = self._matrix()
+        item_index = self.item_index
+        # Sản phẩm không còn điểm dương nào -> cột rỗng
+        active = X.getnnz(axis=0) > 0
+        if full:
+            affected = np.flatnonzero(active)
+        else:
+            touched_cols = [item_index[p] for p in touched if p in item_index]
+            # sim(j, t) chỉ đổi khi j có chung user với t, hoặc t đang nằm trong top-k của j
+            co = np.unique(sparse.csr_matrix(X[:, touched_cols].T @ X).indices) if touched_cols else np.array([], dtype=np.int64)
+            listed = [item_index[p] for p, neigh in self.neighbours.items()
+                      if p in item_index and any(n in touched for n, _ in neigh)]
+            affected = np.unique(np.concatenate([
+                np.asarray(touched_cols, dtype=np.int64), co.astype(np.int64), np.asarray(listed, dtype=np.int64)
+            ]))
+        if not full and len(affected) > FULL_REBUILD_RATIO * int(active.sum()):
+            full, affected = True, np.flatnonzero(active)
+
+        updated = self._top_k_rows(X, affected, item_ids)
+        neighbours = {} if full else dict(self.neighbours)
+        neighbours.update(updated)
+        # Sản phẩm không còn điểm dương nào -> bỏ khỏi bảng
+        for p in [p for p in neighbours if not active[item_index[p]]]:
+            del neighbours[p]
+
+        popularity = np.asarray(X.sum(axis=0)).ravel()
+        top = np.argsort(-popularity)[:100]
+        self.popular = [(int(item_ids[j]), float(popularity[j])) for j in top if popularity[j] > 0]
+        self.neighbours = neighbours
+        self.version += 1
+        self.last_build = {
+            "full": full,
+            "users": X.shape[0],
+            "items": X.shape[1],
+            "nnz": int(X.nnz),
+            "recomputed_items": int(len(affected)),
+            "build_ms": round((time.perf_counter() - t0) * 1000, 1),
+        }
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self.last_refresh < REFRESH_INTERVAL:
+                return
+            first = self.version == 0
+            touched = self._load_new()
+            if touched or first:
+                self._rebuild(touched, full=first)
+            self.last_refresh = time.monotonic()
+
+    def _refresh_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f">>> [PYTHON] Lỗi cập nhật gợi ý: {e}")
+        finally:
+            self._refreshing = False
+
+    def ensure_fresh(self):
+        """
+        Không bao giờ dựng ma trận trong request: trả dữ liệu đang có (chưa dựng xong lần đầu thì rỗng,
+        job 'recommender' dựng ngay khi service khởi động) và cập nhật ở thread nền khi đã cũ
+        """
+        if not self._refreshing and time.monotonic() - self.last_refresh >= REFRESH_INTERVAL:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_background, daemon=True).start()
+
+    # ---------- phục vụ ----------
+
+    def similar(self, product_id, k=10):
+        return self.neighbours.get(int(product_id), [])[:k]
+
+    def history(self, user_id):
+        """{productId: tổng điểm quan tâm} của 1 khách, đọc từ hàng tương ứng của ma trận đã dựng"""
+        row = self.user_index.get(int(user_id))
+        if self._history is None or row is None:
+            return {}
+        raw, item_ids = self._history
+        if row >= raw.shape[0]:
+            return {}   # khách mới, chưa được gộp vào lần dựng gần nhất
+        start, end = raw.indptr[row], raw.indptr[row + 1]
+        return dict(zip(item_ids[raw.indices[start:end]].tolist(), raw.data[start:end].tolist()))
+
+    def recommend(self, user_id, k=10, exclude_seen=True):
+        """Điểm(j) = Σ_i điểm_user(i) * cosine(i, j) trên các sản phẩm user đã tương tác"""
+        history = self.history(user_id)
+        scores = {}
+        for product_id, w in history.items():
+            if w <= 0:
+                continue
+            weight = float(np.log1p(w))
+            for other, sim in self.neighbours.get(product_id, ()):
+                scores[other] = scores.get(other, 0.0) + weight * sim
+        if exclude_seen:
+            for product_id in history:
+                scores.pop(product_id, None)
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+        if len(ranked) < k:
+            # Bù bằng sản phẩm phổ biến (user mới / lịch sử quá ít)
+            seen = set(scores) | set(history)
+            ranked += [(p, 0.0) for p, _ in self.popular if p not in seen][:k - len(ranked)]
+        return [(p, round(s, 4)) for p, s in ranked]
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "users": len(self.user_index),
+            "coo_entries": len(self._coo[0]) + sum(len(part[0]) for part in self._pending),
+            "items_with_neighbours": len(self.neighbours),
+            "interaction_watermark": self.interaction_watermark,
+            "order_item_watermark": self.item_watermark,
+            "last_build": self.last_build,
+        }
+
+
+recommender = Recommender()
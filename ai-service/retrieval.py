@@ -0,0 +1,301 @@
+# ai_service/retrieval.py
+# Truy xuất lai (hybrid) cho RAG: lọc metadata trước + vector (Chroma) + từ khoá (BM25), gộp bằng RRF
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+import tracing
+from embeddings import normalize_query
+from exact_search import EXACT_SEARCH_MAX, ExactVectorIndex
+
+CANDIDATE_MULTIPLIER = int(os.getenv("RAG_CANDIDATE_MULTIPLIER", "4"))
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Từ khách hay dùng -> category trong DB
+CATEGORY_SYNONYMS = {
+    "đầm": "váy",
+    "chân váy": "váy",
+    "jeans": "quần",
+    "short": "quần",
+    "sơ mi": "áo",
+    "khoác": "áo",
+    "hoodie": "áo",
+}
+
+# Số không được cắt giữa chừng ("38" không được khớp thành "3") và không phải tuổi/size/số đo
+_NUMBER = r"(\d+(?:[.,]\d+)*)(?![.,]?\d)\s*(?:(k|nghìn|ngàn|tr|triệu|củ|m|đ|vnd|vnđ)\b)?" \
+          r"(?!\s*(?:tuổi|tháng|size|cm|kg|số\b|năm\b))"
+_RANGE_SEP = r"\s*(?:đến|tới|-|~)\s*"
+_UNITS = {"k": 1_000, "nghìn": 1_000, "ngàn": 1_000, "tr": 1_000_000, "triệu": 1_000_000,
+          "củ": 1_000_000, "m": 1_000_000}
+
+
+def _to_amount(number, unit):
+    unit = (unit or "").strip()
+    if unit in _UNITS:
+        # "1,5tr" / "1.5 triệu" -> số thập phân
+        value = float(number.replace(",", "."))
+        if number.count(".") + number.count(",") > 1:
+            value = float(re.sub(r"[.,]", "", number))
+        return value * _UNITS[unit]
+    # "300.000" / "300,000" -> dấu phân tách hàng nghìn
+    value = float(re.sub(r"[.,]", "", number))
+    # "dưới 300" thường là 300k
+    return value * 1000 if value < 10_000 else value
+
+
+def parse_constraints(question, categories=()):
+    """
+    Rút các điều kiện đơn giản từ câu hỏi:
+    'áo thun dưới 300k' -> {'max_price': 300000, 'category': 'Áo'}
+    """
+    text = unicodedata.normalize("NFC", question or "").lower()
+    constraints = {}
+
+    m = re.search(r"(?:giá|từ)\s*(?:từ\s*)?" + _NUMBER + _RANGE_SEP + _NUMBER, text)
+    if not m:
+        # Khoảng số trần ("38-40", "5-7") chỉ là giá khi có đơn vị tiền
+        m = re.search(_NUMBER + _RANGE_SEP + _NUMBER, text)
+        if m and not (m.group(2) or m.group(4)):
+            m = None
+    if m:
+        low_unit = m.group(2) or m.group(4)
+        constraints["min_price"] = _to_amount(m.group(1), low_unit)
+        constraints["max_price"] = _to_amount(m.group(3), m.group(4))
+    else:
+        m = re.search(r"(?:dưới|không quá|ko quá|tối đa|max|<=?|rẻ hơn|ít hơn|bé hơn|nhỏ hơn)\s*" + _NUMBER, text)
+        if m:
+            constraints["max_price"] = _to_amount(m.group(1), m.group(2))
+        m = re.search(r"(?:trên|(?<!rẻ )(?<!ít )(?<!bé )(?<!nhỏ )hơn|ít nhất|tối thiểu|min|>=?)\s*" + _NUMBER, text)
+        if m:
+            constraints["min_price"] = _to_amount(m.group(1), m.group(2))
+        if not constraints:
+            m = re.search(r"(?:khoảng|tầm|cỡ|giá)\s*" + _NUMBER, text)
+            if m:
+                amount = _to_amount(m.group(1), m.group(2))
+                constraints["min_price"] = amount * 0.8
+                constraints["max_price"] = amount * 1.2
+
+    words = f" {normalize_query(text)} "
+    by_key = {normalize_query(c): c for c in categories if c}
+    for phrase, target in CATEGORY_SYNONYMS.items():
+        if f" {phrase} " in words and target in by_key:
+            constraints["category"] = by_key[target]
+            break
+    else:
+        for key, category in by_key.items():
+            if f" {key} " in words:
+                constraints["category"] = category
+                break
+    return constraints
+
+
+def relaxations(constraints):
+    """Các mức điều kiện thử lần lượt: đầy đủ -> chỉ category -> chỉ còn hàng"""
+    levels = [constraints]
+    if "category" in constraints and len(constraints) > 1:
+        levels.append({"category": constraints["category"]})
+    if constraints:
+        levels.append({})
+    return levels
+
+
+def build_where(constraints, in_stock=True):
+    conditions = []
+    if in_stock:
+        conditions.append({"stock": {"$gt": 0}})
+    if "max_price" in constraints:
+        conditions.append({"price_value": {"$lte": float(constraints["max_price"])}})
+    if "min_price" in constraints:
+        conditions.append({"price_value": {"$gte": float(constraints["min_price"])}})
+    if "category" in constraints:
+        conditions.append({"category": constraints["category"]})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def matches(meta, constraints, in_stock=True):
+    """Cùng điều kiện như build_where nhưng kiểm tra trong Python (cho nhánh BM25)"""
+    if in_stock and meta.get("stock", 0) <= 0:
+        return False
+    price = meta.get("price_value", 0.0)
+    if "max_price" in constraints and price > constraints["max_price"]:
+        return False
+    if "min_price" in constraints and price < constraints["min_price"]:
+        return False
+    if "category" in constraints and meta.get("category") != constraints["category"]:
+        return False
+    return True
+
+
+def tokenize(text):
+    return normalize_query(text).split()
+
+
+class KeywordIndex:
+    """Chỉ mục BM25 trên tên + mô tả sản phẩm (dựng từ documents đã lưu trong Chroma)"""
+
+    def __init__(self):
+        self.ids = []
+        self.metas = []
+        self.postings = defaultdict(list)   # token -> [(vị trí doc, tf)]
+        self.doc_len = []
+        self.avg_len = 0.0
+
+    def build(self, ids, documents, metadatas):
+        self.ids = list(ids)
+        self.metas = list(metadatas)
+        self.postings = defaultdict(list)
+        self.doc_len = []
+        for i, doc in enumerate(documents):
+            tokens = tokenize(doc or "")
+            self.doc_len.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                self.postings[token].append((i, tf))
+        self.avg_len = sum(self.doc_len) / len(self.doc_len) if self.doc_len else 0.0
+
+    def search(self, query, k, constraints=None, in_stock=True):
+        n = len(self.ids)
+        if not n:
+            return []
+        scores = defaultdict(float)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for i, tf in posting:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[i] / (self.avg_len or 1))
+                scores[i] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+        out = []
+        for i, _ in ranked:
+            if constraints is None or matches(self.metas[i] or {}, constraints, in_stock):
+                out.append(self.ids[i])
+                if len(out) >= k:
+                    break
+        return out
+
+
+class HybridRetriever:
+    """
+    Nhánh vector chọn theo thứ tự:
+    - shared_vectors: SharedVectorIndex (chế độ nhiều worker) -> ma trận mmap dùng chung; khi có bản
+      export mới (worker khác vừa sync) thì dựng lại chỉ mục từ khoá luôn.
+    - danh mục <= exact_max sản phẩm -> ExactVectorIndex trong RAM (tìm chính xác, dựng cùng lúc với
+      chỉ mục từ khoá từ 1 lần collection.get).
+    - còn lại -> Chroma (HNSW).
+    """
+
+    def __init__(self, collection, query_encoder, shared_vectors=None, exact_max=EXACT_SEARCH_MAX):
+        self.collection = collection
+        self.query_encoder = query_encoder
+        self.shared_vectors = shared_vectors
+        self.exact_max = exact_max
+        self.exact = None
+        self.keyword_index = KeywordIndex()
+        self.metas = {}
+        self.categories = []
+        self._built_count = -1
+        self._built_version = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._built_count = -1
+
+    def _ensure_index(self):
+        count = self.collection.count()
+        if self.shared_vectors is not None:
+            self.shared_vectors.refresh()
+        version = self.shared_vectors.version if self.shared_vectors is not None else None
+        if count == self._built_count and version == self._built_version:
+            return
+        with self._lock:
+            if count == self._built_count and version == self._built_version:
+                return
+            use_exact = self.shared_vectors is None and 0 < count <= self.exact_max
+            data = self.collection.get(include=["documents", "metadatas"] + ["embeddings"] * use_exact)
+            self.exact = ExactVectorIndex.from_collection(data) if use_exact else None
+            self.keyword_index.build(data["ids"], data["documents"], data["metadatas"])
+            self.metas = dict(zip(data["ids"], data["metadatas"]))
+            self.categories = sorted({m.get("category") for m in data["metadatas"] if m and m.get("category")})
+            self._built_count = count
+            self._built_version = version
+
+    def vector_backend(self):
+        """Chỉ mục đang phục vụ nhánh vector (None = Chroma)"""
+        if self.shared_vectors is not None and self.shared_vectors.ready:
+            return self.shared_vectors
+        return self.exact
+
+    def stats(self):
+        backend = self.vector_backend()
+        return {
+            "vector_backend": "chroma" if backend is None else
+            "shared_mmap" if backend is self.shared_vectors else "exact_numpy",
+            "exact_max": self.exact_max,
+            "indexed": max(self._built_count, 0),
+            "exact": self.exact.stats() if self.exact is not None else None,
+        }
+
+    def retrieve(self, question, k=5):
+        """
+        Trả về (danh sách sản phẩm, constraints, thời gian từng bước tính bằng ms, vector câu hỏi).
+        Vector được trả kèm để người gọi (khoá semantic cache) không phải encode câu hỏi lần nữa.
+        """
+        timings = {}
+        t = time.perf_counter()
+        self._ensure_index()
+        timings["index"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        constraints = parse_constraints(question, self.categories)
+        timings["parse"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        vector = self.query_encoder.encode(question)
+        query_vector = [vector.tolist()]
+        timings["embed"] = time.perf_counter() - t
+
+        n_candidates = k * CANDIDATE_MULTIPLIER
+        vector_ids, keyword_ids = [], []
+        # Nếu điều kiện quá chặt không ra kết quả -> bỏ khoảng giá (giữ loại sản phẩm), rồi mới bỏ hết
+        for active in relaxations(constraints):
+            t = time.perf_counter()
+            vector_index = self.vector_backend()
+            if vector_index is not None:
+                vector_ids = vector_index.query(query_vector[0], n_candidates, active)
+                vector_metas = {}
+            else:
+                where = build_where(active)
+                n_results = min(n_candidates, max(self.collection.count(), 1))
+                with tracing.stage("chroma.query"):
+                    results = self.collection.query(query_embeddings=query_vector, n_results=n_results, where=where)
+                vector_ids = results["ids"][0]
+                vector_metas = dict(zip(vector_ids, results["metadatas"][0]))
+            timings["vector"] = timings.get("vector", 0) + time.perf_counter() - t
+
+            t = time.perf_counter()
+            keyword_ids = self.keyword_index.search(question, n_candidates, active)
+            timings["keyword"] = timings.get("keyword", 0) + time.perf_counter() - t
+            if vector_ids or keyword_ids:
+                break
+        constraints = active
+
+        t = time.perf_counter()
+        fused = defaultdict(float)
+        for ranking in (vector_ids, keyword_ids):
+            for rank, pid in enumerate(ranking):
+                fused[pid] += 1.0 / (RRF_K + rank + 1)
+        top_ids = [pid for pid, _ in sorted(fused.items(), key=lambda kv: kv[1], reverse=True)[:k]]
+        products = [dict(vector_metas.get(pid) or self.metas.get(pid) or {}, id=pid) for pid in top_ids]
+        timings["fuse"] = time.perf_counter() - t
+
+        return products, constraints, {key: round(v * 1000, 2) for key, v in timings.items()}, vector
@@ -0,0 +1,235 @@
+# ai_service/revenue.py
+# Bảng tổng hợp doanh thu theo tháng/ngày + top bán chạy, cập nhật tăng dần theo id đơn hàng
+import os
+import time
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+import db
+
+REFRESH_INTERVAL = float(os.getenv("REVENUE_REFRESH_INTERVAL", "10"))
+FETCH_CHUNK = int(os.getenv("REVENUE_FETCH_CHUNK", "5000"))
+# Backend không có trạng thái huỷ/hoàn tiền (chỉ PENDING/PROCESSING/COMPLETED) và bảng Order không có
+# updatedAt -> chỉ đối soát lại các đơn tạo trong RECHECK_DAYS ngày gần nhất (trạng thái, totalAmount,
+# đơn bị xoá), mỗi RECHECK_INTERVAL giây; đơn cũ hơn coi như đã chốt.
+RECHECK_DAYS = int(os.getenv("REVENUE_RECHECK_DAYS", "30"))
+RECHECK_INTERVAL = float(os.getenv("REVENUE_RECHECK_INTERVAL", "300"))
+
+ORDER_COLUMNS = "id, createdAt, totalAmount, status, paymentStatus"
+ORDER_SCHEMA = {
+    'id': 'int64',
+    'createdAt': 'datetime64[us]',
+    'totalAmount': 'float64',
+    'status': 'object',
+    'paymentStatus': 'object',
+}
+ITEM_SCHEMA = {'id': 'int64', 'quantity': 'int64', 'name': 'object'}
+
+
+def _is_revenue(orders):
+    """Mảng bool: đơn COMPLETED hoặc đã thanh toán"""
+    return (orders['status'] == 'COMPLETED') | (orders['paymentStatus'] == 'PAID')
+
+
+def _sum_by(keys, values):
+    """Cộng values theo từng giá trị khác nhau của keys -> (keys duy nhất, tổng)"""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=values)
+
+
+def _settle(total):
+    # Cộng rồi trừ cùng 1 khoản có thể để lại sai số kiểu 1e-9
+    return total if abs(total) > 1e-6 else 0.0
+
+
+def _add_months(year, month, n):
+    idx = year * 12 + (month - 1) + n
+    return idx // 12, idx % 12 + 1
+
+
+class RevenueRollup:
+    def __init__(self):
+        self.monthly = {}       # (năm, tháng) -> doanh thu
+        self.daily = {}         # date -> doanh thu
+        self.top_sellers = {}   # tên sản phẩm -> tổng số lượng bán
+        self.order_watermark = 0
+        self.item_watermark = 0
+        # id đơn tạo trong RECHECK_DAYS ngày gần nhất -> (createdAt, doanh thu đang được tính: 0 nếu chưa)
+        self.recent = {}
+        self.version = 0
+        self.last_refresh = 0.0
+        self.last_recheck = 0.0
+        self._forecast = None   # (version, kết quả)
+        self._lock = threading.Lock()
+
+    def _fold(self, created, amount):
+        """Cộng doanh thu (âm = trừ bớt) vào bảng tháng/ngày, gom nhóm bằng numpy"""
+        months, totals = _sum_by(created.astype('datetime64[M]'), amount)
+        for month, total in zip(months.tolist(), totals.tolist()):
+            key = (month.year, month.month)
+            self.monthly[key] = _settle(self.monthly.get(key, 0.0) + total)
+        days, totals = _sum_by(created.astype('datetime64[D]'), amount)
+        for day, total in zip(days.tolist(), totals.tolist()):
+            self.daily[day] = _settle(self.daily.get(day, 0.0) + total)
+
+    def _fold_orders(self, orders, mask):
+        """Cộng doanh thu các đơn được chọn (mask)"""
+        self._fold(orders['createdAt'][mask], orders['totalAmount'][mask])
+
+    def _load_new_orders(self, window_start):
+        changed = False
+        # 1 câu SELECT đọc dần theo lô FETCH_CHUNK dòng; watermark tiến theo từng lô đã cộng xong
+        for orders in db.iter_columns(
+            f"SELECT {ORDER_COLUMNS} FROM `Order` WHERE id > %s ORDER BY id",
+            (self.order_watermark,), ORDER_SCHEMA, FETCH_CHUNK
+        ):
+            revenue = _is_revenue(orders)
+            if revenue.any():
+                self._fold_orders(orders, revenue)
+                changed = True
+            recent = orders['createdAt'] >= window_start
+            counted = np.where(revenue, orders['totalAmount'], 0.0)[recent]
+            self.recent.update(zip(orders['id'][recent].tolist(), zip(orders['createdAt'][recent], counted.tolist())))
+            self.order_watermark = int(orders['id'][-1])
+        return changed
+
+    def _recheck_recent(self, window_start):
+        """
+        Đọc lại các đơn trong cửa sổ đối soát (1 khoảng id liên tục, theo khoá chính) và cộng/trừ phần
+        chênh lệch: đơn vừa COMPLETED/PAID, đơn bị chuyển khỏi COMPLETED, sửa totalAmount, đơn bị xoá.
+        """
+        if not self.recent:
+            return False
+        tracked, self.recent = self.recent, {}
+        created, delta = [], []
+        for orders in db.iter_columns(
+            f"SELECT {ORDER_COLUMNS} FROM `Order` WHERE id >= %s AND id <= %s ORDER BY id",
+            (min(tracked), self.order_watermark), ORDER_SCHEMA, FETCH_CHUNK
+        ):
+            counted = np.where(_is_revenue(orders), orders['totalAmount'], 0.0)
+            for order_id, at, amount in zip(orders['id'].tolist(), orders['createdAt'], counted.tolist()):
+                previous = tracked.pop(order_id, None)
+                if previous is None:
+                    continue
+                if amount != previous[1]:
+                    created.append(previous[0])
+                    delta.append(amount - previous[1])
+                if at >= window_start:
+                    self.recent[order_id] = (previous[0], amount)
+        # Còn lại trong tracked = đơn đã bị xoá khỏi DB
+        for at, amount in tracked.values():
+            if amount:
+                created.append(at)
+                delta.append(-amount)
+        if not delta:
+            return False
+        self._fold(np.array(created, dtype='datetime64[us]'), np.array(delta, dtype=np.float64))
+        return True
+
+    def _load_new_items(self):
+        changed = False
+        for items in db.iter_columns(
+            "SELECT oi.id, oi.quantity, p.name FROM OrderItem oi "
+            "JOIN Product p ON oi.productId = p.id "
+            "WHERE oi.id > %s ORDER BY oi.id",
+            (self.item_watermark,), ITEM_SCHEMA, FETCH_CHUNK
+        ):
+            names, sold = _sum_by(items['name'], items['quantity'])
+            for name, qty in zip(names.tolist(), sold.tolist()):
+                self.top_sellers[name] = self.top_sellers.get(name, 0) + int(qty)
+            self.item_watermark = int(items['id'][-1])
+            changed = True
+        return changed
+
+    def refresh(self, force=False):
+        """Nạp các đơn/OrderItem mới kể từ lần trước; tối đa 1 lần mỗi REFRESH_INTERVAL giây"""
+        with self._lock:
+            if not force and time.monotonic() - self.last_refresh < REFRESH_INTERVAL:
+                return
+            window_start = np.datetime64(db.utc_now() - timedelta(days=RECHECK_DAYS), 'us')
+            changed = self._load_new_orders(window_start)
+            if force or time.monotonic() - self.last_recheck >= RECHECK_INTERVAL:
+                changed = self._recheck_recent(window_start) or changed
+                self.last_recheck = time.monotonic()
+            changed = self._load_new_items() or changed
+            if changed:
+                self.version += 1
+            self.last_refresh = time.monotonic()
+
+    def monthly_series(self, months=12):
+        """Chuỗi doanh thu liên tục theo tháng (tháng không có đơn = 0), lấy `months` tháng cuối"""
+        if not self.monthly:
+            return []
+        first, last = min(self.monthly), max(self.monthly)
+        total = (last[0] - first[0]) * 12 + (last[1] - first[1]) + 1
+        start = max(0, total - months)
+        series = []
+        for n in range(start, total):
+            key = _add_months(first[0], first[1], n)
+            series.append((key, self.monthly.get(key, 0.0)))
+        return series
+
+    def daily_series(self, days=30):
+        # createdAt lưu theo UTC -> "hôm nay" cũng tính theo UTC
+        today = db.utc_now().date()
+        return [
+            (day, self.daily.get(day, 0.0))
+            for day in (date.fromordinal(today.toordinal() - i) for i in range(days - 1, -1, -1))
+        ]
+
+    def top_products(self, limit=3):
+        ranked = sorted(self.top_sellers.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return [{"name": name, "total_sold": int(qty)} for name, qty in ranked]
+
+    def forecast(self):
+        """Dự báo tháng tới; chỉ tính lại khi rollup có thay đổi (version tăng)"""
+        with self._lock:
+            if self._forecast is not None and self._forecast[0] == self.version:
+                return self._forecast[1]
+
+            series = self.monthly_series(12)
+            if not series:
+                result = None
+            else:
+                revenue = np.array([v for _, v in series], dtype=float)
+                X = np.arange(len(revenue)).reshape(-1, 1)
+                from sklearn.linear_model import LinearRegression  # nạp khi cần dự báo
+                model = LinearRegression()
+                model.fit(X, revenue)
+                next_month_revenue = float(model.predict([[len(revenue)]])[0])
+
+                chart_data = [
+                    {"name": f"T{m:02d}/{y % 100:02d}", "revenue": round(v), "prediction": None}
+                    for (y, m), v in series
+                ]
+                ny, nm = _add_months(series[-1][0][0], series[-1][0][1], 1)
+                chart_data.append({
+                    "name": f"T{nm:02d}/{ny % 100:02d}",
+                    "revenue": None,
+                    "prediction": max(0, round(next_month_revenue))
+                })
+                result = {
+                    "chart_data": chart_data,
+                    "next_month_revenue": next_month_revenue,
+                    "last_revenue": float(revenue[-1]),
+                    "top_products": self.top_products(3),
+                }
+            self._forecast = (self.version, result)
+            return result
+
+    def stats(self):
+        return {
+            "months": len(self.monthly),
+            "days": len(self.daily),
+            "products": len(self.top_sellers),
+            "order_watermark": self.order_watermark,
+            "item_watermark": self.item_watermark,
+            "recent_orders": len(self.recent),
+            "recheck_days": RECHECK_DAYS,
+            "version": self.version,
+        }
+
+
+rollup = RevenueRollup()
@@ -0,0 +1,45 @@
+# ai_service/segment_table.py
+# Kết quả phân khúc dạng cột numpy: job (process riêng) chỉ gửi về vài mảng thay vì list dict từng khách,
+# process chính phân trang/lọc theo nhãn trên mảng mà không cần import pandas/sklearn
+import numpy as np
+
+DETAIL_COLUMNS = ('userId', 'Recency', 'Frequency', 'Monetary')
+
+
+class SegmentTable:
+    """columns: userId/Recency/Frequency/Monetary + cluster (mã cụm); labels[cluster] = tên nhãn"""
+
+    def __init__(self, columns, labels):
+        self.columns = columns
+        self.labels = list(labels)
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload['columns'], payload['labels'])
+
+    def payload(self):
+        """dict chỉ gồm mảng numpy + list tên nhãn (pickle rẻ khi gửi giữa các process)"""
+        return {"columns": self.columns, "labels": self.labels}
+
+    def __len__(self):
+        return len(self.columns['userId'])
+
+    def details(self, label=None, page=1, page_size=100):
+        """(1 trang khách [{userId, Label, Recency, Frequency, Monetary}], tổng số khách khớp label)"""
+        clusters = self.columns['cluster']
+        if label:
+            codes = [code for code, name in enumerate(self.labels) if name == label]
+            rows = np.flatnonzero(np.isin(clusters, codes))
+        else:
+            rows = np.arange(len(clusters))
+        total = len(rows)
+        if page_size > 0:
+            start = (max(page, 1) - 1) * page_size
+            rows = rows[start:start + page_size]
+        values = {name: self.columns[name][rows].tolist() for name in DETAIL_COLUMNS}
+        labels = [self.labels[code] for code in clusters[rows].tolist()]
+        return [
+            {'userId': user_id, 'Label': name, 'Recency': recency, 'Frequency': frequency, 'Monetary': monetary}
+            for user_id, name, recency, frequency, monetary in zip(
+                values['userId'], labels, values['Recency'], values['Frequency'], values['Monetary'])
+        ], total
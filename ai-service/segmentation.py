@@ -0,0 +1,301 @@
+# ai_service/segmentation.py
+# Phân khúc khách hàng RFM bằng MiniBatchKMeans, lưu model + kết quả phân cụm ra đĩa
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from sklearn.cluster import MiniBatchKMeans
+
+import db
+import compute
+from segment_table import SegmentTable
+
+MODEL_DIR = os.getenv("AI_MODEL_DIR", "./model_store")
+MODEL_PATH = os.path.join(MODEL_DIR, "segmentation.joblib")
+REFRESH_INTERVAL = float(os.getenv("SEGMENT_REFRESH_INTERVAL", "30"))
+# Khi số khách được gán thêm vượt tỉ lệ này so với lúc fit -> fit lại toàn bộ
+REFIT_RATIO = float(os.getenv("SEGMENT_REFIT_RATIO", "0.2"))
+FETCH_CHUNK = int(os.getenv("SEGMENT_FETCH_CHUNK", "5000"))
+# Giống revenue: chỉ đối soát lại đơn tạo trong RECHECK_DAYS ngày gần nhất (vừa COMPLETED, bị chuyển
+# khỏi COMPLETED, sửa totalAmount, bị xoá); đơn cũ hơn coi như đã chốt
+RECHECK_DAYS = int(os.getenv("SEGMENT_RECHECK_DAYS", "30"))
+
+RFM_COLUMNS = ['Recency', 'Frequency', 'Monetary']
+RFM_SQL = """
+    SELECT
+        userId,
+        COUNT(id) as Frequency,
+        SUM(totalAmount) as Monetary,
+        MAX(createdAt) as LastPurchaseDate
+    FROM `Order`
+    WHERE status = 'COMPLETED' {where}
+    GROUP BY userId
+"""
+# Kiểu cột theo thứ tự SELECT của RFM_SQL (đọc thẳng vào mảng numpy, không qua dict từng dòng)
+RFM_SCHEMA = {
+    'userId': 'int64',
+    'Frequency': 'int64',
+    'Monetary': 'float64',
+    'LastPurchaseDate': 'datetime64[us]',
+}
+ORDER_COLUMNS = "id, userId, status, totalAmount, createdAt"
+ORDER_SCHEMA = {
+    'id': 'int64',
+    'userId': 'int64',
+    'status': 'object',
+    'totalAmount': 'float64',
+    'createdAt': 'datetime64[us]',
+}
+
+
+def _to_frame(columns):
+    return pd.DataFrame(columns).set_index('userId')
+
+
+def _load_rfm(where, params):
+    return _to_frame(db.fetch_columns(RFM_SQL.format(where=where), params, RFM_SCHEMA, FETCH_CHUNK))
+
+
+def _label_map(centroids_monetary):
+    """Cụm có Monetary trung bình cao nhất = VIP, ... giống cách gán nhãn cũ"""
+    sorted_clusters = list(np.argsort(-np.asarray(centroids_monetary)))
+    if len(sorted_clusters) >= 4:
+        names = ["VIP (Chi tiêu cao)", "Khách hàng Tiềm năng", "Khách hàng Thường xuyên", "Nguy cơ rời bỏ"]
+        return {int(c): names[i] for i, c in enumerate(sorted_clusters[:4])}
+    return {int(c): f"Nhóm {idx + 1}" for idx, c in enumerate(sorted_clusters)}
+
+
+class SegmentationEngine:
+    def __init__(self):
+        self.scaler = None
+        self.kmeans = None
+        self.label_map = {}
+        self.snapshot_date = None  # mốc Recency lúc fit, cố định tới lần fit sau
+        self.fitted_at = None
+        self.fitted_count = 0
+        self.assigned_since_fit = 0
+        self.order_watermark = 0
+        # orderId (tạo trong RECHECK_DAYS ngày) -> (userId, totalAmount nếu COMPLETED, None nếu chưa)
+        self.recent_orders = {}
+        # DataFrame index=userId: Frequency, Monetary, LastPurchaseDate, Cluster, Label
+        # (Recency không lưu, tính lúc trả kết quả -> mốc thời gian đổi không phải phân cụm lại)
+        self.assignments = None
+        self.last_refresh = 0.0
+        self._lock = threading.Lock()
+
+    # ---------- lưu / nạp ----------
+    def save(self):
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        joblib.dump({
+            "scaler": self.scaler,
+            "kmeans": self.kmeans,
+            "label_map": self.label_map,
+            "snapshot_date": self.snapshot_date,
+            "fitted_at": self.fitted_at,
+            "fitted_count": self.fitted_count,
+            "assigned_since_fit": self.assigned_since_fit,
+            "order_watermark": self.order_watermark,
+            "recent_orders": self.recent_orders,
+            "assignments": self.assignments,
+        }, MODEL_PATH)
+
+    def load(self):
+        if not os.path.exists(MODEL_PATH):
+            return False
+        state = joblib.load(MODEL_PATH)
+        for key, value in state.items():
+            setattr(self, key, value)
+        return True
+
+    # ---------- fit toàn bộ ----------
+    def _features(self, df):
+        """
+        Ma trận RFM với Recency tính theo mốc lúc fit (không kẹp về 0): đặc trưng của 1 khách chỉ đổi
+        khi đơn của khách đó đổi, nên cụm đã gán của khách khác vẫn đúng. Khách mua sau lúc fit có
+        Recency âm = gần đây hơn mọi khách lúc fit.
+        """
+        recency = (self.snapshot_date - df['LastPurchaseDate']).dt.days
+        return np.column_stack([recency.to_numpy(dtype=float), df['Frequency'].to_numpy(dtype=float),
+                                df['Monetary'].to_numpy(dtype=float)])
+
+    def _classify(self, df):
+        """Cụm/nhãn theo centroid đã lưu, chỉ cho các dòng của df"""
+        df['Cluster'] = self.kmeans.predict(self.scaler.transform(self._features(df)))
+        df['Label'] = df['Cluster'].map(self.label_map)
+
+    def fit(self):
+        max_order = db.fetch_all("SELECT MAX(id) as max_id FROM `Order`")
+        watermark = (max_order[0]['max_id'] if max_order else None) or 0
+        df = _load_rfm("AND id <= %s", (watermark,))
+        if df.empty:
+            return False
+
+        self.snapshot_date = df['LastPurchaseDate'].max() + pd.Timedelta(days=1)
+        X = self._features(df)
+        self.scaler = StandardScaler().fit(X)
+        X_scaled = self.scaler.transform(X)
+
+        n_clusters = 4 if len(df) >= 4 else len(df)
+        self.kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters, random_state=42, batch_size=2048, n_init=3
+        ).fit(X_scaled)
+        df['Cluster'] = self.kmeans.labels_
+
+        centroids = self.scaler.inverse_transform(self.kmeans.cluster_centers_)
+        self.label_map = _label_map(centroids[:, RFM_COLUMNS.index('Monetary')])
+        df['Label'] = df['Cluster'].map(self.label_map)
+
+        self.assignments = df
+        self.fitted_at = datetime.now()
+        self.fitted_count = len(df)
+        self.assigned_since_fit = 0
+        self.order_watermark = watermark
+        self.recent_orders = {}
+        window_start = _window_start()
+        for orders in db.iter_columns(
+            f"SELECT {ORDER_COLUMNS} FROM `Order` WHERE id <= %s AND createdAt >= %s ORDER BY id",
+            (watermark, window_start.item()), ORDER_SCHEMA, FETCH_CHUNK
+        ):
+            self._track(orders, window_start)
+        self.save()
+        return True
+
+    # ---------- gán tăng dần ----------
+    def _track(self, orders, window_start):
+        recent = orders['createdAt'] >= window_start
+        completed = orders['status'][recent] == 'COMPLETED'
+        amounts = orders['totalAmount'][recent].tolist()
+        self.recent_orders.update(
+            (order_id, (user_id, amount if done else None))
+            for order_id, user_id, amount, done in zip(
+                orders['id'][recent].tolist(), orders['userId'][recent].tolist(), amounts, completed.tolist())
+        )
+
+    def _recheck_recent(self, window_start):
+        """Khách có đơn trong cửa sổ đối soát đổi trạng thái COMPLETED / totalAmount / bị xoá"""
+        changed = set()
+        if not self.recent_orders:
+            return changed
+        tracked, self.recent_orders = self.recent_orders, {}
+        for orders in db.iter_columns(
+            f"SELECT {ORDER_COLUMNS} FROM `Order` WHERE id >= %s AND id <= %s ORDER BY id",
+            (min(tracked), self.order_watermark), ORDER_SCHEMA, FETCH_CHUNK
+        ):
+            completed = (orders['status'] == 'COMPLETED').tolist()
+            for order_id, user_id, amount, done, at in zip(
+                orders['id'].tolist(), orders['userId'].tolist(), orders['totalAmount'].tolist(),
+                completed, orders['createdAt']
+            ):
+                previous = tracked.pop(order_id, None)
+                if previous is None:
+                    continue
+                state = (user_id, amount if done else None)
+                if state != previous:
+                    changed.update((user_id, previous[0]))
+                if at >= window_start:
+                    self.recent_orders[order_id] = state
+        # Còn lại = đơn đã bị xoá khỏi DB
+        changed.update(user_id for user_id, amount in tracked.values() if amount is not None)
+        return changed
+
+    def _changed_users(self):
+        window_start = _window_start()
+        # Đối soát trước khi đọc đơn mới để không đọc lại ngay các đơn vừa thêm vào cửa sổ
+        changed = self._recheck_recent(window_start)
+        for orders in db.iter_columns(
+            f"SELECT {ORDER_COLUMNS} FROM `Order` WHERE id > %s ORDER BY id",
+            (self.order_watermark,), ORDER_SCHEMA, FETCH_CHUNK
+        ):
+            changed.update(orders['userId'][orders['status'] == 'COMPLETED'].tolist())
+            self._track(orders, window_start)
+            self.order_watermark = int(orders['id'][-1])
+        return changed
+
+    def assign(self, user_ids):
+        """Tính lại RFM cho các khách vừa thay đổi và gán vào centroid đã lưu; khách khác giữ nguyên cụm"""
+        user_ids = list(user_ids)
+        for i in range(0, len(user_ids), FETCH_CHUNK):
+            chunk = user_ids[i:i + FETCH_CHUNK]
+            placeholders = ",".join(["%s"] * len(chunk))
+            df = _load_rfm(f"AND userId IN ({placeholders})", tuple(chunk))
+            if not df.empty:
+                self._classify(df)
+            self.assigned_since_fit += int((~df.index.isin(self.assignments.index)).sum())
+            # Khách không còn đơn COMPLETED nào thì bị bỏ khỏi kết quả
+            self.assignments = pd.concat([self.assignments.drop(chunk, errors='ignore'), df])
+
+    def refresh(self, refit=False):
+        with self._lock:
+            if self.kmeans is None and not refit:
+                self.load()
+            if refit or self.kmeans is None:
+                self.fit()
+            elif time.monotonic() - self.last_refresh >= REFRESH_INTERVAL:
+                changed = self._changed_users()
+                if changed:
+                    self.assign(changed)
+                if self.assigned_since_fit > REFIT_RATIO * max(self.fitted_count, 1):
+                    self.fit()
+                elif changed:
+                    self.save()
+            self.last_refresh = time.monotonic()
+
+    # ---------- phục vụ API ----------
+    def summary(self):
+        counts = self.assignments['Label'].value_counts()
+        return [{"name": name, "value": int(value)} for name, value in counts.items()]
+
+    def table(self):
+        """
+        Phân cụm hiện tại dạng SegmentTable (cột numpy, không dựng dict cho từng khách).
+        Recency hiển thị tính lúc này theo mốc = ngày mua gần nhất của mọi khách + 1 ngày.
+        """
+        df = self.assignments
+        last_purchase = df['LastPurchaseDate'].to_numpy()
+        reference = last_purchase.max() + np.timedelta64(1, 'D')
+        columns = {
+            'userId': df.index.to_numpy(dtype=np.int64),
+            'Recency': ((reference - last_purchase) // np.timedelta64(1, 'D')).astype(np.int64),
+            'Frequency': df['Frequency'].to_numpy(dtype=np.int64),
+            'Monetary': df['Monetary'].to_numpy(dtype=np.float64),
+            'cluster': df['Cluster'].to_numpy(dtype=np.int16),
+        }
+        return SegmentTable(columns, [self.label_map[c] for c in range(len(self.label_map))])
+
+    def details(self, label=None, page=1, page_size=100):
+        return self.table().details(label, page, page_size)
+
+    def stats(self):
+        return {
+            "fitted_at": self.fitted_at.isoformat() if self.fitted_at else None,
+            "fitted_count": self.fitted_count,
+            "assigned_since_fit": self.assigned_since_fit,
+            "customers": 0 if self.assignments is None else len(self.assignments),
+            "order_watermark": self.order_watermark,
+            "recent_orders": len(self.recent_orders),
+        }
+
+
+def _window_start():
+    return np.datetime64(db.utc_now() - timedelta(days=RECHECK_DAYS), 'us')
+
+
+engine = SegmentationEngine()
+
+
+def build_report(refit=False):
+    """
+    Cập nhật phân khúc và trả kết quả pickle được để chạy trong process pool: process worker giữ
+    `engine` của riêng nó giữa các lần chạy, model vẫn được lưu ra MODEL_PATH. Chi tiết từng khách chỉ
+    gửi về dạng mảng (SegmentTable.payload), API phân trang bằng SegmentTable.details.
+    """
+    with compute.batch_threads():
+        engine.refresh(refit=refit)
+    if engine.assignments is None or engine.assignments.empty:
+        return None
+    return {"chart_data": engine.summary(), "assignments": engine.table().payload(), "model": engine.stats()}
@@ -0,0 +1,157 @@
+# ai_service/semantic_cache.py
+# Cache câu trả lời chatbot theo ngữ nghĩa: câu hỏi diễn đạt khác nhưng cùng ý (vector gần nhau)
+# và tìm ra cùng tập sản phẩm thì dùng lại câu trả lời, không gọi Gemini
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+SEMANTIC_CACHE_SIZE = int(os.getenv("CHAT_SEMANTIC_CACHE_SIZE", "2000"))
+SEMANTIC_CACHE_TTL = float(os.getenv("CHAT_SEMANTIC_CACHE_TTL", "1800"))
+# Cosine similarity tối thiểu giữa 2 câu hỏi để coi là cùng ý
+SIMILARITY_THRESHOLD = float(os.getenv("CHAT_SEMANTIC_THRESHOLD", "0.92"))
+
+
+def _unit(vector):
+    v = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+class _Bucket:
+    """Các câu hỏi cùng tập sản phẩm + cùng lịch sử, vector xếp thành 1 ma trận để so sánh 1 lần"""
+
+    def __init__(self, dim):
+        self.keys = []
+        self.matrix = np.empty((0, dim), dtype=np.float32)
+
+    def add(self, key, vector):
+        self.keys.append(key)
+        self.matrix = np.vstack([self.matrix, vector[None, :]])
+
+    def remove(self, key):
+        i = self.keys.index(key)
+        del self.keys[i]
+        self.matrix = np.delete(self.matrix, i, axis=0)
+
+    def best(self, vector):
+        if not self.keys:
+            return None, 0.0
+        scores = self.matrix @ vector
+        i = int(np.argmax(scores))
+        return self.keys[i], float(scores[i])
+
+
+class SemanticCache:
+    """
+    Mỗi mục: (vector câu hỏi, {id sản phẩm: (giá, tồn kho)} lúc trả lời, câu trả lời).
+    Chỉ so sánh vector trong cùng nhóm (tập id sản phẩm RAG + lịch sử) -> mỗi lần tra chỉ nhân
+    với vài vector; giá/tồn kho của sản phẩm nào đổi thì mục đó bị huỷ.
+    """
+
+    def __init__(self, maxsize=SEMANTIC_CACHE_SIZE, ttl=SEMANTIC_CACHE_TTL, threshold=SIMILARITY_THRESHOLD):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()   # key -> (bucket key, vector, versions, answer, hết hạn lúc)
+        self._buckets = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evicted = 0
+
+    @staticmethod
+    def _bucket_key(versions, history_key):
+        return frozenset(versions), history_key
+
+    def _drop(self, key):
+        bucket_key = self._entries.pop(key)[0]
+        bucket = self._buckets[bucket_key]
+        bucket.remove(key)
+        if not bucket.keys:
+            del self._buckets[bucket_key]
+
+    def get(self, vector, versions, history_key=""):
+        """versions: {id sản phẩm: (giá, tồn kho)} hiện tại của các sản phẩm RAG tìm được"""
+        if not versions:
+            return None
+        vector = _unit(vector)
+        with self._lock:
+            bucket = self._buckets.get(self._bucket_key(versions, history_key))
+            key, score = bucket.best(vector) if bucket else (None, 0.0)
+            if key is not None and score >= self.threshold:
+                _, _, cached_versions, answer, expires = self._entries[key]
+                if expires <= time.monotonic():
+                    self._drop(key)
+                elif cached_versions != versions:
+                    # Giá/tồn kho đã đổi sau khi câu trả lời được sinh ra
+                    self._drop(key)
+                    self.invalidated += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return answer
+            self.misses += 1
+            return None
+
+    def put(self, vector, versions, answer, history_key=""):
+        if not versions or self.maxsize <= 0:
+            return
+        vector = _unit(vector)
+        bucket_key = self._bucket_key(versions, history_key)
+        with self._lock:
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self._buckets[bucket_key] = _Bucket(len(vector))
+            else:
+                # Câu gần như trùng với 1 mục sẵn có -> thay câu trả lời thay vì thêm mục mới
+                key, score = bucket.best(vector)
+                if key is not None and score >= 0.999:
+                    self._drop(key)
+                    bucket = self._buckets.setdefault(bucket_key, _Bucket(len(vector)))
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = (bucket_key, vector, dict(versions), answer, time.monotonic() + self.ttl)
+            bucket.add(key, vector)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+                self.evicted += 1
+
+    def invalidate_products(self, current_versions):
+        """
+        Xoá ngay các mục có sản phẩm đã đổi giá/tồn kho hoặc bị xoá.
+        current_versions(id) -> (giá, tồn kho) hiện tại hoặc None.
+        """
+        with self._lock:
+            stale = [
+                key for key, (_, _, versions, _, _) in self._entries.items()
+                if any(current_versions(pid) != version for pid, version in versions.items())
+            ]
+            for key in stale:
+                self._drop(key)
+            self.invalidated += len(stale)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "groups": len(self._buckets),
+                "maxsize": self.maxsize,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "invalidated": self.invalidated,
+                "evicted": self.evicted,
+            }
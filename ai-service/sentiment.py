@@ -0,0 +1,313 @@
+# ai_service/sentiment.py
+# Phân tích cảm xúc đánh giá: chỉ gửi review chưa phân loại (hoặc vừa bị sửa), chia lô gửi song song,
+# lưu nhãn lại; review bị xoá khỏi DB thì bỏ nhãn
+import os
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import threading
+
+import httpx
+from starlette.concurrency import run_in_threadpool
+
+import db
+import gemini
+import tracing
+
+MODEL_DIR = os.getenv("AI_MODEL_DIR", "./model_store")
+STORE_PATH = os.path.join(MODEL_DIR, "sentiment.sqlite3")
+CHUNK_SIZE = int(os.getenv("SENTIMENT_CHUNK_SIZE", "40"))
+CONCURRENCY = int(os.getenv("SENTIMENT_CONCURRENCY", "4"))
+REQUESTS_PER_MINUTE = float(os.getenv("SENTIMENT_RPM", "30"))
+MAX_RETRIES = int(os.getenv("SENTIMENT_MAX_RETRIES", "3"))
+FETCH_CHUNK = int(os.getenv("SENTIMENT_FETCH_CHUNK", "5000"))
+# Mỗi lần gọi API chỉ phân loại tối đa chừng này review, phần còn lại để lần sau
+MAX_PER_RUN = int(os.getenv("SENTIMENT_MAX_PER_RUN", "2000"))
+
+POSITIVE, NEGATIVE, NEUTRAL = "Tích cực", "Tiêu cực", "Trung lập"
+
+PROMPT = """
+Bạn là một AI phân tích cảm xúc (Sentiment Analysis) chuyên nghiệp.
+Hãy đọc danh sách các bình luận sau và phân loại thành đúng 1 trong 3 nhãn: 'Tích cực', 'Tiêu cực', hoặc 'Trung lập'.
+CHỈ TRẢ VỀ MẢNG JSON THUẦN TÚY (Không dùng markdown, không giải thích gì thêm), định dạng mẫu:
+[ {{"id": 1, "sentiment": "Tích cực"}}, {{"id": 2, "sentiment": "Tiêu cực"}} ]
+
+Dữ liệu đầu vào:
+{reviews}
+"""
+
+
+def normalize_label(sentiment):
+    if "Tích" in sentiment: return POSITIVE
+    if "Tiêu" in sentiment: return NEGATIVE
+    return NEUTRAL
+
+
+def rating_fallback(rating):
+    return POSITIVE if rating >= 4 else (NEGATIVE if rating <= 2 else NEUTRAL)
+
+
+class SentimentStore:
+    """Lưu nhãn cảm xúc của từng review (SQLite cục bộ) để không phân loại lại"""
+
+    def __init__(self, path=STORE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS review_sentiment (
+                    review_id INTEGER PRIMARY KEY,
+                    product_id INTEGER,
+                    product_name TEXT,
+                    content TEXT,
+                    rating INTEGER,
+                    sentiment TEXT,
+                    source TEXT,
+                    classified_at REAL,
+                    content_hash INTEGER
+                )
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(review_sentiment)")}
+            if "content_hash" not in columns:
+                # File lưu từ bản cũ: hash được điền ở lần đối soát đầu tiên, không phân loại lại
+                self._conn.execute("ALTER TABLE review_sentiment ADD COLUMN content_hash INTEGER")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rs_product ON review_sentiment(product_id)")
+            self._conn.commit()
+
+    def max_review_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(review_id), 0) FROM review_sentiment").fetchone()[0]
+
+    def fingerprints(self):
+        """review_id -> (CRC32 nội dung lúc phân loại, số sao)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT review_id, content_hash, rating FROM review_sentiment").fetchall()
+        return {rid: (content_hash, rating) for rid, content_hash, rating in rows}
+
+    def set_hashes(self, pairs):
+        """pairs: [(review_id, content_hash)]"""
+        with self._lock:
+            self._conn.executemany("UPDATE review_sentiment SET content_hash = ? WHERE review_id = ?",
+                                   [(h, rid) for rid, h in pairs])
+            self._conn.commit()
+
+    def delete(self, review_ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM review_sentiment WHERE review_id = ?", [(rid,) for rid in review_ids])
+            self._conn.commit()
+
+    def fallback_ids(self, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT review_id FROM review_sentiment WHERE source = 'rating' ORDER BY review_id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def save(self, reviews, labels, source):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO review_sentiment (review_id, product_id, product_name, content, rating, "
+                "sentiment, source, classified_at, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(r['id'], r['productId'], r['productName'], r['content'], r['rating'], labels[r['id']], source, now,
+                  r.get('contentHash')) for r in reviews]
+            )
+            self._conn.commit()
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT sentiment, COUNT(*) FROM review_sentiment GROUP BY sentiment").fetchall()
+        return dict(rows)
+
+    def product_stats(self, limit=50):
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT product_id, product_name,
+                       SUM(sentiment = ?), SUM(sentiment = ?), SUM(sentiment = ?), COUNT(*)
+                FROM review_sentiment
+                GROUP BY product_id
+                ORDER BY SUM(sentiment = ?) DESC
+                LIMIT ?
+            """, (POSITIVE, NEGATIVE, NEUTRAL, NEGATIVE, limit)).fetchall()
+        return [
+            {"productId": pid, "productName": name, "positive": pos, "negative": neg, "neutral": neu, "total": total}
+            for pid, name, pos, neg, neu, total in rows
+        ]
+
+    def latest(self, limit):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT review_id, content, rating, product_name, sentiment FROM review_sentiment "
+                "ORDER BY review_id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [
+            {"id": rid, "content": content, "rating": rating, "productName": name, "sentiment": sentiment}
+            for rid, content, rating, name, sentiment in rows
+        ]
+
+
+class RateLimiter:
+    """Giãn cách các lần gọi Gemini để không vượt quá REQUESTS_PER_MINUTE"""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Phần RPM dành cho job phân tích review (giới hạn chung của cả service: GEMINI_RPM trong gemini.py)
+_limiter = RateLimiter(REQUESTS_PER_MINUTE)
+
+
+async def _classify_chunk(chunk, api_key, semaphore, limiter):
+    """
+    Gửi 1 lô review cho Gemini, thử lại khi Gemini trả JSON lỗi (429/5xx/timeout đã được client
+    dùng chung thử lại). Trả về {id: nhãn}; lô lỗi sẽ dùng nhãn dự phòng theo số sao.
+    """
+    review_texts = [{"id": r["id"], "content": r["content"]} for r in chunk]
+    contents = [{"parts": [{"text": PROMPT.format(reviews=json.dumps(review_texts, ensure_ascii=False))}]}]
+
+    for attempt in range(MAX_RETRIES):
+        try:
+            async with semaphore:
+                await limiter.wait()
+                raw_text = await gemini.generate(contents, api_key)
+            with tracing.stage("json_parse"):
+                raw_text = raw_text.replace("```json", "").replace("```", "").strip()
+                ai_results = json.loads(raw_text)
+            chunk_ids = {r["id"] for r in chunk}
+            return {
+                item['id']: normalize_label(item['sentiment'])
+                for item in ai_results if item.get('id') in chunk_ids and 'sentiment' in item
+            }
+        except (gemini.GeminiError, httpx.HTTPError) as e:
+            print(">>> LỖI TỪ GEMINI API:", e)
+            return {}
+        except (json.JSONDecodeError, TypeError, AttributeError) as e:
+            print(f">>> LỖI PHÂN LOẠI LÔ REVIEW (lần {attempt + 1}): {e}")
+        await asyncio.sleep(min(2 ** attempt, 10) + random.random())
+    return {}
+
+
+async def classify(reviews, api_key):
+    """Chia review thành các lô và phân loại song song; review nào lỗi sẽ không có trong kết quả"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    chunks = [reviews[i:i + CHUNK_SIZE] for i in range(0, len(reviews), CHUNK_SIZE)]
+    results = await asyncio.gather(*[_classify_chunk(c, api_key, semaphore, _limiter) for c in chunks])
+    labels = {}
+    for r in results:
+        labels.update(r)
+    return labels
+
+
+REVIEW_SQL = """
+    SELECT r.id, r.content, r.rating, r.productId, p.name as productName, CRC32(r.content) as contentHash
+    FROM Review r
+    JOIN Product p ON r.productId = p.id
+    {where}
+    ORDER BY r.id
+    LIMIT %s
+"""
+# Bảng Review không có updatedAt -> mỗi lần chạy so "dấu vân tay" (CRC32 nội dung do MySQL tính + số sao)
+# của mọi review với bản đã lưu; chỉ đọc 3 cột số, không kéo nội dung review về
+FINGERPRINT_SQL = "SELECT id, CRC32(content), rating FROM Review ORDER BY id"
+FINGERPRINT_SCHEMA = {'id': 'int64', 'contentHash': 'int64', 'rating': 'int64'}
+
+
+def reconcile(store):
+    """Bỏ nhãn của review đã bị xoá; trả về (id các review đã bị sửa nội dung/số sao, số review đã xoá)"""
+    known = store.fingerprints()
+    if not known:
+        return [], 0
+    seen, edited, adopt = set(), [], []
+    for chunk in db.iter_columns(FINGERPRINT_SQL, (), FINGERPRINT_SCHEMA, FETCH_CHUNK):
+        for rid, content_hash, rating in zip(
+            chunk['id'].tolist(), chunk['contentHash'].tolist(), chunk['rating'].tolist()
+        ):
+            stored = known.get(rid)
+            if stored is None:
+                continue  # review mới, đọc theo watermark
+            seen.add(rid)
+            if stored[0] is None and stored[1] == rating:
+                adopt.append((rid, content_hash))
+            elif stored != (content_hash, rating):
+                edited.append(rid)
+    deleted = [rid for rid in known if rid not in seen]
+    if deleted:
+        store.delete(deleted)
+    if adopt:
+        store.set_hashes(adopt)
+    return edited, len(deleted)
+
+
+def _load_by_ids(ids):
+    if not ids:
+        return []
+    placeholders = ",".join(["%s"] * len(ids))
+    return db.fetch_all(REVIEW_SQL.format(where=f"WHERE r.id IN ({placeholders})"), (*ids, len(ids)))
+
+
+def load_unclassified(store, retry_fallback=False):
+    """
+    Review mới (id > review lớn nhất đã lưu) + review đã bị sửa + tuỳ chọn các review đang dùng nhãn
+    dự phòng theo rating. Trả về (danh sách review, số review đã bị xoá khỏi kho nhãn).
+    """
+    edited, deleted = reconcile(store)
+    reviews = []
+    watermark = store.max_review_id()
+    while len(reviews) < MAX_PER_RUN:
+        rows = db.fetch_all(REVIEW_SQL.format(where="WHERE r.id > %s"),
+                            (watermark, min(FETCH_CHUNK, MAX_PER_RUN - len(reviews))))
+        reviews.extend(rows)
+        if rows:
+            watermark = rows[-1]['id']
+        if len(rows) < FETCH_CHUNK:
+            break
+
+    # Review bị sửa chưa đủ chỗ trong lần này vẫn lệch dấu vân tay -> lần sau được lấy tiếp
+    reviews.extend(_load_by_ids(edited[:MAX_PER_RUN - len(reviews)]))
+    if retry_fallback and len(reviews) < MAX_PER_RUN:
+        queued = {r['id'] for r in reviews}
+        ids = [rid for rid in store.fallback_ids(MAX_PER_RUN) if rid not in queued]
+        reviews.extend(_load_by_ids(ids[:MAX_PER_RUN - len(reviews)]))
+    return reviews, deleted
+
+
+async def analyze_new_reviews(store, api_key, retry_fallback=False):
+    """Phân loại các review chưa có nhãn, lưu lại; trả về số review đã xử lý theo nguồn nhãn"""
+    reviews, deleted = await run_in_threadpool(load_unclassified, store, retry_fallback)
+    if not reviews:
+        return {"ai": 0, "rating": 0, "deleted": deleted}
+
+    labels = await classify(reviews, api_key)
+    classified = [r for r in reviews if r['id'] in labels]
+    failed = [r for r in reviews if r['id'] not in labels]
+
+    if classified:
+        await run_in_threadpool(store.save, classified, labels, "ai")
+    if failed:
+        fallback = {r['id']: rating_fallback(r['rating']) for r in failed}
+        await run_in_threadpool(store.save, failed, fallback, "rating")
+    return {"ai": len(classified), "rating": len(failed), "deleted": deleted}
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = SentimentStore()
+    return _store
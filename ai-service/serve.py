@@ -0,0 +1,128 @@
+# ai_service/serve.py
+# Chạy nhiều worker dùng chung model embedding: process cha import app + nạp model 1 lần rồi fork,
+# các worker kế thừa trang nhớ của model (copy-on-write, model chỉ đọc nên không bị sao chép)
+# và cùng mmap 1 file vector sản phẩm (AI_SHARED_VECTORS). `uvicorn --workers N` thì mỗi worker
+# spawn lại từ đầu -> N bản model trong RAM.
+#   python serve.py --workers 4 --port 8000
+#   curl localhost:8000/api/ai/workers      (RSS/PSS từng worker)
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Chỉ nạp trước những thành phần không mở socket/thread (connection MySQL, Chroma không sống sót qua fork)
+DEFAULT_PRELOAD = "embedding_model"
+
+
+def _bind(host, port, backlog):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _preload(names):
+    import components
+    from threadpoolctl import threadpool_limits
+    # Không để BLAS/OpenMP tạo thread ở process cha: thread không được fork sang worker
+    with threadpool_limits(limits=1):
+        for name in names:
+            components.get(name)
+
+
+def _configure_worker(index):
+    import jobs
+
+    # Job định kỳ chỉ chạy ở worker 0. Job ghi dữ liệu (Chroma, SQLite nhãn review, file model)
+    # cũng chỉ chạy ở worker 0: worker khác đọc kết quả worker 0 công bố, cần tính lại thì gửi yêu cầu
+    if index != 0:
+        jobs.SCHEDULER_ENABLED = False
+    jobs.scheduler.share(jobs.JOB_SHARED_DIR, owner=index == 0)
+
+
+def _run_worker(index, sock, app, args):
+    import uvicorn
+    import compute
+
+    _configure_worker(index)
+    compute.apply_interactive_limits()
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ai-service nhiều worker, model + vector sản phẩm dùng chung")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("AI_WORKERS", "2")))
+    parser.add_argument("--host", default=os.getenv("AI_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("AI_PORT", "8000")))
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--preload", default=os.getenv("AI_PRELOAD", DEFAULT_PRELOAD),
+                        type=lambda s: [x.strip() for x in s.split(",") if x.strip()])
+    args = parser.parse_args()
+
+    # Phải đặt trước khi import main: các module đọc biến môi trường lúc import
+    os.environ.setdefault("AI_SHARED_VECTORS", "1")
+    os.environ["AI_SERVE_MASTER_PID"] = str(os.getpid())
+    sys.path.insert(0, SERVICE_DIR)
+
+    t0 = time.perf_counter()
+    import main as service
+    _preload(args.preload)
+    print(f">>> [PYTHON] Đã nạp app + {args.preload} trong {round(time.perf_counter() - t0, 1)}s, "
+          f"fork {args.workers} worker")
+
+    sock = _bind(args.host, args.port, args.backlog)
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(index, sock, service.app, args)
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    def stop(signum, _frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for i in range(args.workers):
+        spawn(i)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        # Worker chết bất thường -> fork lại (vẫn dùng chung model của process cha)
+        print(f">>> [PYTHON] Worker {index} (pid {pid}) dừng với mã {os.waitstatus_to_exitcode(status)}, khởi động lại")
+        time.sleep(1)
+        spawn(index)
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# ai_service/shared_vectors.py
+# Ma trận vector sản phẩm chỉ đọc, lưu thành file .npy và mở bằng mmap: mọi worker uvicorn
+# dùng chung 1 bản trong page cache của hệ điều hành thay vì mỗi process nạp chỉ mục HNSW riêng
+import os
+import time
+import fcntl
+import threading
+
+import numpy as np
+
+import tracing
+from exact_search import VectorArrays
+
+SHARED_VECTORS = os.getenv("AI_SHARED_VECTORS", "0") == "1"
+SHARED_VECTORS_DIR = os.getenv("AI_SHARED_VECTORS_DIR",
+                               os.path.join(os.getenv("AI_MODEL_DIR", "./model_store"), "shared_vectors"))
+# Mỗi worker kiểm tra file meta tối đa 1 lần / khoảng này để nhận bản export mới của worker khác
+CHECK_INTERVAL = float(os.getenv("AI_SHARED_VECTORS_CHECK_INTERVAL", "2"))
+
+META_FILE = "meta.npz"
+LOCK_FILE = ".lock"
+
+ARRAY_FIELDS = ("ids", "sq_norms", "prices", "stocks", "category_codes")
+
+
+class SharedVectorIndex:
+    """
+    Export: vectors-<version>.npy (float32, n x dim) + meta.npz (id, bình phương chuẩn, giá, tồn kho,
+    mã category). meta.npz được thay bằng os.replace sau khi file vector đã ghi xong nên worker khác
+    không bao giờ đọc phải bản dở dang; mmap bản cũ vẫn dùng được cho tới khi đóng.
+    Tìm kiếm giống exact_search.ExactVectorIndex, chỉ khác ma trận nằm trong file mmap.
+    """
+
+    def __init__(self, path=SHARED_VECTORS_DIR):
+        self.path = path
+        self._mapped = None
+        self.exports = 0
+        self.reloads = 0
+        self._meta_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return 0 if self._mapped is None else len(self._mapped.ids)
+
+    @property
+    def ready(self):
+        return self._mapped is not None
+
+    @property
+    def version(self):
+        return None if self._mapped is None else self._mapped.version
+
+    def _meta_path(self):
+        return os.path.join(self.path, META_FILE)
+
+    def _vector_file_on_disk(self):
+        try:
+            with np.load(self._meta_path()) as meta:
+                return str(meta["vector_file"])
+        except FileNotFoundError:
+            return None
+
+    # ---------- export (worker chạy sync-rag) ----------
+    def export(self, collection):
+        """Ghi toàn bộ vector + metadata lọc của collection Chroma ra file dùng chung"""
+        data = collection.get(include=["embeddings", "metadatas"])
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, LOCK_FILE), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            version = f"{time.time_ns()}-{os.getpid()}"
+            arrays = VectorArrays.from_collection(data, version)
+            vector_file = f"vectors-{version}.npy"
+            tmp = os.path.join(self.path, vector_file + ".tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, arrays.vectors)
+            os.replace(tmp, os.path.join(self.path, vector_file))
+
+            previous = self._vector_file_on_disk()
+            tmp = self._meta_path() + ".tmp"
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f,
+                    version=np.array(version),
+                    vector_file=np.array(vector_file),
+                    categories=np.array(arrays.categories, dtype=str),
+                    **{name: getattr(arrays, name) for name in ARRAY_FIELDS},
+                )
+            os.replace(tmp, self._meta_path())
+            self._remove_old(keep={vector_file, previous})
+        self.exports += 1
+        self.refresh(force=True)
+        print(f">>> [PYTHON] Đã export {len(arrays)} vector sản phẩm ra {self.path}")
+        return len(arrays)
+
+    def _remove_old(self, keep):
+        # Giữ bản hiện tại + bản worker khác có thể vẫn đang mmap; bản cũ hơn xoá được
+        # (process đang mmap vẫn đọc được tới khi đóng vì inode chưa bị giải phóng)
+        for name in os.listdir(self.path):
+            if name.startswith("vectors-") and name.endswith(".npy") and name not in keep:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+    # ---------- đọc (mọi worker) ----------
+    def refresh(self, force=False):
+        """Mở lại bằng mmap nếu có bản export mới; trả về True khi version thay đổi"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < CHECK_INTERVAL:
+            return False
+        self._checked_at = now
+        try:
+            st = os.stat(self._meta_path())
+        except FileNotFoundError:
+            return False
+        # os.replace tạo inode mới: 2 lần export trong cùng 1 nhịp mtime vẫn phân biệt được
+        mtime = (st.st_ino, st.st_mtime_ns)
+        if mtime == self._meta_mtime:
+            return False
+        with self._lock:
+            if mtime == self._meta_mtime:
+                return False
+            with np.load(self._meta_path()) as meta:
+                vectors = np.load(os.path.join(self.path, str(meta["vector_file"])), mmap_mode="r")
+                self._mapped = VectorArrays(str(meta["version"]), vectors, categories=meta["categories"].tolist(),
+                                            **{name: meta[name] for name in ARRAY_FIELDS})
+            self._meta_mtime = mtime
+            self.reloads += 1
+        return True
+
+    def query(self, vector, n, constraints=None, in_stock=True):
+        """id (chuỗi, như Chroma) của n sản phẩm gần nhất thoả điều kiện, tìm chính xác trên toàn bộ ma trận"""
+        self.refresh()
+        m = self._mapped
+        if m is None:
+            return []
+        with tracing.stage("vectors.query"):
+            return m.top_k(vector, n, constraints, in_stock)[0]
+
+    def stats(self):
+        m = self._mapped
+        return {
+            "enabled": SHARED_VECTORS,
+            "path": self.path,
+            "version": self.version,
+            "count": len(self),
+            "dim": None if m is None else int(m.vectors.shape[1]),
+            "mmap_bytes": 0 if m is None else int(m.vectors.nbytes),
+            "exports": self.exports,
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,11 @@
+# ai_service/tests/conftest.py
+# Chạy: cd ai-service && python -m pytest -q   (không cần MySQL/Chroma/Gemini thật)
+import os
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+# Các module đọc biến môi trường lúc import
+os.environ.setdefault("JOB_SCHEDULER", "0")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import cart_counters
+import db
+
+NOW = datetime(2026, 3, 10, 12, 30)   # UTC, giống createdAt do Prisma ghi
+
+
+class FakeInteractions:
+    """Bảng UserInteraction trong RAM cho các câu SELECT của CartCounters"""
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, product_id, action, created):
+        self.rows.append((len(self.rows) + 1, product_id, action, created))
+
+    def fetch_all(self, sql, params=None):
+        if "MAX(id)" in sql:
+            return [{"max_id": len(self.rows)}]
+        totals = {}
+        for row_id, pid, action, _ in self.rows:
+            if row_id <= params[0]:
+                counts = totals.setdefault(pid, [0, 0, 0])
+                counts[cart_counters.ACTIONS[action]] += 1
+        return [{"productId": pid, "adds": a, "removes": r, "views": v} for pid, (a, r, v) in totals.items()]
+
+    def iter_columns(self, sql, params=None, schema=None, chunk_size=db.STREAM_CHUNK):
+        if "createdAt >=" in sql:
+            rows = [r for r in self.rows if r[0] <= params[0] and r[3] >= params[1]]
+        else:
+            rows = [r for r in self.rows if r[0] > params[0]]
+        if rows:
+            yield db._to_columns(rows, schema)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [NOW]
+    monkeypatch.setattr(db, "utc_now", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def interactions(monkeypatch):
+    table = FakeInteractions()
+    monkeypatch.setattr(db, "fetch_all", table.fetch_all)
+    monkeypatch.setattr(db, "iter_columns", table.iter_columns)
+    return table
+
+
+def test_window_edge_uses_utc_clock(clock, interactions):
+    interactions.add(1, "ADD_TO_CART", NOW - timedelta(hours=23, minutes=30))   # giờ thứ 24 tính từ giờ hiện tại
+    interactions.add(2, "ADD_TO_CART", NOW - timedelta(hours=24, minutes=30))   # vừa ra khỏi 24h
+    interactions.add(3, "VIEW", NOW - timedelta(days=10))
+    counters = cart_counters.CartCounters()
+    counters.refresh(force=True)
+
+    assert counters.counts("24h") == {1: (1, 0, 0)}
+    assert counters.counts("7d") == {1: (1, 0, 0), 2: (1, 0, 0)}
+    assert counters.counts("30d") == counters.counts("all") == {1: (1, 0, 0), 2: (1, 0, 0), 3: (0, 0, 1)}
+
+    # 1 giờ sau: dòng sát mép rơi khỏi 24h, dòng mới được cộng thêm
+    clock[0] = NOW + timedelta(hours=1)
+    interactions.add(2, "REMOVE_FROM_CART", clock[0] - timedelta(minutes=5))
+    counters.refresh(force=True)
+    assert counters.counts("24h") == {2: (0, 1, 0)}
+    assert counters.counts("7d") == {1: (1, 0, 0), 2: (1, 1, 0)}
@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import catalog
+import db
+
+
+class FakeProducts:
+    def __init__(self, legacy=False):
+        self.rows = []
+        self.edits = 0
+        self.legacy = legacy
+        self.version_queries = []
+        self.loads = 0
+
+    def put(self, product_id, name, price=100.0, stock=5, category="Áo"):
+        self.rows = [r for r in self.rows if r["id"] != product_id] + [{
+            "id": product_id, "name": name, "price": price, "stock": stock, "category": category,
+            "image": "", "description": "", "createdAt": None}]
+        self.rows.sort(key=lambda r: r["id"])
+        self.edits += 1
+
+    def fetch_all(self, sql, params=None):
+        if sql == catalog.PRODUCT_SQL:
+            self.loads += 1
+            return [dict(r) for r in self.rows]
+        self.version_queries.append(sql)
+        if sql == catalog.VERSION_SQL and self.legacy:
+            error = Exception("Unknown column 'updatedAt' in 'field list'")
+            error.errno = catalog.ER_BAD_FIELD_ERROR
+            raise error
+        # updatedAt = thời điểm sửa gần nhất; checksum cũ = hash nội dung các dòng
+        updated = datetime(2026, 3, 1, 0, 0, self.edits) if sql == catalog.VERSION_SQL \
+            else hash(tuple(map(str, self.rows)))
+        return [{"n": len(self.rows), "max_id": max((r["id"] for r in self.rows), default=0), "updated": updated}]
+
+    async def fetch_all_async(self, sql, params=None):
+        return self.fetch_all(sql, params)
+
+
+@pytest.fixture
+def products(monkeypatch):
+    table = FakeProducts()
+    monkeypatch.setattr(db, "fetch_all", table.fetch_all)
+    monkeypatch.setattr(db, "fetch_all_async", table.fetch_all_async)
+    monkeypatch.setattr(catalog, "VERSION_CHECK_INTERVAL", 0)
+    table.put(1, "Áo thun")
+    table.put(2, "Quần jeans", category="Quần")
+    return table
+
+
+def test_reloads_only_when_version_changes(products):
+    c = catalog.Catalog()
+    first = c.get()
+    assert c.get() is first and products.loads == 1
+    assert products.version_queries == [catalog.VERSION_SQL] * 2
+
+    products.put(1, "Áo thun", price=80.0)   # sửa giá -> updatedAt đổi
+    snapshot = c.get()
+    assert snapshot is not first and snapshot.price_stock(1) == (80.0, 5)
+
+    products.rows.pop()                        # xoá sản phẩm -> COUNT đổi
+    assert len(c.get()) == 1
+    assert products.loads == 3
+
+
+def test_falls_back_to_checksum_before_migration(products):
+    products.legacy = True
+    c = catalog.Catalog()
+    assert len(c.get()) == 2
+    assert c.version_sql is catalog.LEGACY_VERSION_SQL
+    assert c.stats()["version_source"] == "checksum"
+    products.version_queries.clear()
+    c.get()
+    assert products.version_queries == [catalog.LEGACY_VERSION_SQL]
+
+
+def test_other_errors_are_not_swallowed(products, monkeypatch):
+    def broken(sql, params=None):
+        raise RuntimeError("mất kết nối")
+    monkeypatch.setattr(db, "fetch_all", broken)
+    with pytest.raises(RuntimeError):
+        catalog.Catalog().get()
+
+
+def test_async_get_builds_snapshot_off_the_event_loop(products, monkeypatch):
+    built = []
+
+    async def in_thread(fn, *args):
+        built.append(fn)
+        return fn(*args)
+
+    monkeypatch.setattr(catalog, "run_in_threadpool", in_thread)
+    c = catalog.Catalog()
+    snapshot = asyncio.run(c.get_async())
+    assert built == [catalog.CatalogSnapshot]
+    assert asyncio.run(c.get_async()) is snapshot
+
+
+def test_concurrent_async_gets_check_and_load_once(products, monkeypatch):
+    async def slow_fetch(sql, params=None):
+        await asyncio.sleep(0.01)     # nhường event loop như query thật
+        return products.fetch_all(sql, params)
+
+    async def in_thread(fn, *args):
+        return fn(*args)
+
+    monkeypatch.setattr(db, "fetch_all_async", slow_fetch)
+    monkeypatch.setattr(catalog, "run_in_threadpool", in_thread)
+    c = catalog.Catalog()
+
+    async def burst(**kwargs):
+        return await asyncio.gather(*[c.get_async(**kwargs) for _ in range(5)])
+
+    async def scenario():
+        snapshots = await burst()
+        assert all(s is snapshots[0] for s in snapshots)
+        assert (len(products.version_queries), products.loads) == (1, 1)
+
+        products.put(3, "Váy", category="Váy")
+        snapshots = await burst(force_check=True)
+        assert all(len(s) == 3 for s in snapshots)
+        assert (len(products.version_queries), products.loads) == (2, 2)
+
+    asyncio.run(scenario())
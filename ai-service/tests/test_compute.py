@@ -0,0 +1,68 @@
+import sys
+import threading
+import types
+
+import numpy  # noqa: F401  (nạp BLAS để threadpoolctl có thư viện để chỉnh)
+import pytest
+from threadpoolctl import threadpool_info, threadpool_limits
+
+import compute
+
+
+class FakeTorch(types.ModuleType):
+    def __init__(self, threads):
+        super().__init__("torch")
+        self.threads = threads
+
+    def get_num_threads(self):
+        return self.threads
+
+    def set_num_threads(self, n):
+        self.threads = n
+
+
+@pytest.fixture
+def torch(monkeypatch):
+    fake = FakeTorch(1)
+    monkeypatch.setitem(sys.modules, "torch", fake)
+    monkeypatch.setattr(compute, "_batch", compute._BatchThreads())
+    with threadpool_limits(limits=1):
+        yield fake
+
+
+def _blas_threads():
+    return {lib["num_threads"] for lib in threadpool_info()}
+
+
+def test_overlapping_calls_restore_only_after_the_last_exit(torch):
+    before = _blas_threads()
+    first, second = compute.batch_threads(4), compute.batch_threads(2)
+    first.__enter__()
+    second.__enter__()
+    assert torch.threads == 4
+    # Ra khỏi lần đầu trước: lần còn lại vẫn giữ số thread đã nâng
+    first.__exit__(None, None, None)
+    assert torch.threads == 4
+    second.__exit__(None, None, None)
+    assert torch.threads == 1
+    assert _blas_threads() == before
+
+
+def test_concurrent_threads_leave_original_limits(torch):
+    barrier = threading.Barrier(4)
+    seen = []
+
+    def work(n):
+        with compute.batch_threads(n):
+            barrier.wait(5)
+            seen.append(torch.threads)
+            barrier.wait(5)
+
+    workers = [threading.Thread(target=work, args=(n,)) for n in (2, 3, 4, 5)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join(5)
+    assert seen == [5] * 4     # cả 4 cùng chạy -> dùng mức cao nhất được yêu cầu
+    assert torch.threads == 1
+    assert compute._batch.depth == 0
@@ -0,0 +1,229 @@
+import asyncio
+import threading
+
+import pytest
+
+import db
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.closed = False
+        self.executed = None
+
+    def execute(self, sql, params=()):
+        self.executed = (sql, params)
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, pool, connection_id):
+        self.pool = pool
+        self.connection_id = connection_id
+        self.pings = 0
+        self.cursors = []
+        self.consumed = False
+
+    def ping(self, reconnect=True, attempts=1, delay=0):
+        self.pings += 1
+
+    def cursor(self, **kwargs):
+        cursor = FakeCursor(self.pool.rows)
+        self.cursors.append(cursor)
+        return cursor
+
+    def consume_results(self):
+        self.consumed = True
+
+    def close(self):
+        self.pool.returned.append(self)
+
+
+class FakePool:
+    def __init__(self, rows=()):
+        self.rows = rows
+        self.returned = []
+        self.issued = []
+
+    def get_connection(self):
+        conn = FakeConnection(self, len(self.issued) + 1)
+        self.issued.append(conn)
+        return conn
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db, "_get_pool", lambda: pool)
+    monkeypatch.setattr(db, "_pool_slots", threading.BoundedSemaphore(2))
+    monkeypatch.setattr(db, "_last_used", {})
+    monkeypatch.setattr(db, "sync_metrics", db._PoolMetrics(2))
+    return pool
+
+
+def test_connection_is_returned_and_counted(fake_pool):
+    with db.get_connection() as conn:
+        assert db.sync_metrics.snapshot()["in_use"] == 1
+        assert conn.pings == 1  # connection mới chưa dùng lần nào -> ping trước
+    stats = db.sync_metrics.snapshot()
+    assert stats["in_use"] == 0 and stats["checkouts"] == 1
+    assert fake_pool.returned == [conn]
+
+
+def test_checkout_times_out_when_pool_is_exhausted(fake_pool, monkeypatch):
+    monkeypatch.setattr(db, "CHECKOUT_TIMEOUT", 0.01)
+    with db.get_connection(), db.get_connection():
+        with pytest.raises(db.PoolTimeoutError):
+            with db.get_connection():
+                pass
+    assert db.sync_metrics.snapshot()["timeouts"] == 1
+    # Slot được trả lại sau khi ra khỏi with
+    with db.get_connection():
+        pass
+
+
+def test_connection_released_when_body_raises(fake_pool):
+    with pytest.raises(RuntimeError):
+        with db.get_connection():
+            raise RuntimeError("boom")
+    assert db.sync_metrics.snapshot()["in_use"] == 0
+    assert len(fake_pool.returned) == 1
+
+
+def test_fetch_all_closes_cursor(fake_pool):
+    fake_pool.rows = [{"id": 1}, {"id": 2}]
+    assert db.fetch_all("SELECT id FROM Product WHERE id > %s", (0,)) == [{"id": 1}, {"id": 2}]
+    cursor = fake_pool.issued[0].cursors[0]
+    assert cursor.closed and cursor.executed == ("SELECT id FROM Product WHERE id > %s", (0,))
+
+
+class FakeAsyncCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params=()):
+        self.executed = (sql, params)
+
+    async def fetchall(self):
+        return tuple(self.rows)
+
+
+class FakeAsyncConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.cursor_class = None
+
+    async def ping(self, reconnect=True):
+        if self.pool.ping_error:
+            raise self.pool.ping_error
+
+    def cursor(self, cursor_class=None):
+        self.cursor_class = cursor_class
+        return FakeAsyncCursor(self.pool.rows)
+
+
+class FakeAsyncPool:
+    """Giống aiomysql.Pool: acquire() chờ khi đã cho mượn hết maxsize connection"""
+
+    def __init__(self, maxsize=1, rows=()):
+        self.rows = list(rows)
+        self.ping_error = None
+        self.released = []
+        self._free = asyncio.Semaphore(maxsize)
+
+    async def acquire(self):
+        await self._free.acquire()
+        return FakeAsyncConnection(self)
+
+    def release(self, conn):
+        self.released.append(conn)
+        self._free.release()
+
+
+@pytest.fixture
+def async_pool(monkeypatch):
+    pool = FakeAsyncPool(rows=[{"id": 1}, {"id": 2}])
+    monkeypatch.setattr(db, "_async_pool", pool)
+    monkeypatch.setattr(db, "async_metrics", db._PoolMetrics(1))
+    return pool
+
+
+def test_async_fetch_uses_dict_cursor_and_returns_connection(async_pool):
+    rows = asyncio.run(db.fetch_all_async("SELECT id FROM Product", ()))
+    assert rows == [{"id": 1}, {"id": 2}]
+    conn = async_pool.released[0]
+    assert conn.cursor_class is db.aiomysql.DictCursor
+    stats = db.async_metrics.snapshot()
+    assert stats["checkouts"] == 1 and stats["in_use"] == 0
+
+
+def test_async_checkout_times_out_and_ping_errors_release(async_pool, monkeypatch):
+    monkeypatch.setattr(db, "CHECKOUT_TIMEOUT", 0.01)
+
+    async def exhausted():
+        async with db.get_async_connection():
+            with pytest.raises(db.PoolTimeoutError):
+                async with db.get_async_connection():
+                    pass
+
+    asyncio.run(exhausted())
+    assert db.async_metrics.snapshot()["timeouts"] == 1
+
+    async_pool.ping_error = ConnectionError("MySQL server has gone away")
+    with pytest.raises(ConnectionError):
+        asyncio.run(db.fetch_all_async("SELECT 1"))
+    stats = db.async_metrics.snapshot()
+    assert stats["errors"] == 1 and stats["in_use"] == 0
+    assert len(async_pool.released) == 2
+
+
+def test_async_pool_is_created_once(monkeypatch):
+    created = []
+
+    async def create_pool(**kwargs):
+        await asyncio.sleep(0.01)
+        created.append(kwargs)
+        return FakeAsyncPool()
+
+    monkeypatch.setattr(db, "_async_pool", None)
+    monkeypatch.setattr(db, "_async_pool_lock", None)
+    monkeypatch.setattr(db.aiomysql, "create_pool", create_pool)
+
+    async def burst():
+        return await asyncio.gather(*[db._get_async_pool() for _ in range(5)])
+
+    pools = asyncio.run(burst())
+    assert len(created) == 1 and all(p is pools[0] for p in pools)
+    assert created[0]["maxsize"] == db.ASYNC_POOL_SIZE and created[0]["autocommit"]
+
+
+def test_last_used_is_shared_safely_between_threads(fake_pool):
+    def borrow():
+        for _ in range(200):
+            with db.get_connection():
+                pass
+
+    threads = [threading.Thread(target=borrow) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    assert db.sync_metrics.snapshot()["checkouts"] == 800 and db.sync_metrics.snapshot()["in_use"] == 0
+    assert len(db._last_used) == len(fake_pool.issued)
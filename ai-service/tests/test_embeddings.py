@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+import pytest
+
+import cache
+import embeddings
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeModel:
+    """Ghi lại từng lô được encode; vector = (độ dài, số khoảng trắng)"""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def encode(self, texts):
+        self.batches.append(list(texts))
+        if self.fail:
+            raise RuntimeError("model lỗi")
+        return np.array([[len(t), t.count(" ")] for t in texts], dtype=np.float32)
+
+
+def test_ttl_cache_expires_and_evicts_least_recent(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    ttl = TTLCache(maxsize=2, ttl=60)
+    ttl.put("a", 1)
+    ttl.put("b", 2)
+    assert ttl.get("a") == 1            # "a" vừa dùng -> "b" bị đẩy ra khi thêm "c"
+    ttl.put("c", 3)
+    assert ttl.get("b") is None and ttl.get("c") == 3
+
+    clock.now += 59
+    assert ttl.get("a") == 1
+    clock.now += 2
+    assert ttl.get("a") is None and ttl.stats()["size"] == 1
+    assert (ttl.hits, ttl.misses) == (3, 2)
+
+
+def test_batch_flushes_when_full():
+    model = FakeModel()
+    batcher = embeddings.MicroBatchEncoder(model.encode, max_wait_ms=5000, max_batch=3)
+    t0 = time.monotonic()
+    futures = [batcher.submit(text) for text in ("áo", "quần jeans", "áo")]
+    vectors = [f.result(timeout=2) for f in futures]
+    # Đủ 3 câu thì encode ngay, không chờ hết max_wait; câu trùng trong lô chỉ encode 1 lần
+    assert time.monotonic() - t0 < 2
+    assert model.batches == [["áo", "quần jeans"]]
+    assert vectors[0].tolist() == vectors[2].tolist() == [2, 0]
+    assert batcher.stats() == {"batches": 1, "queries": 3, "avg_batch_size": 3.0, "max_batch_size": 3}
+
+
+def test_batch_flushes_after_max_wait():
+    model = FakeModel()
+    batcher = embeddings.MicroBatchEncoder(model.encode, max_wait_ms=50, max_batch=100)
+    futures = [batcher.submit(text) for text in ("váy", "đầm")]
+    assert [f.result(timeout=2).tolist() for f in futures] == [[3, 0], [3, 0]]
+    assert model.batches == [["váy", "đầm"]]
+
+
+def test_batch_error_reaches_every_caller():
+    batcher = embeddings.MicroBatchEncoder(FakeModel(fail=True).encode, max_wait_ms=20, max_batch=2)
+    futures = [batcher.submit(text) for text in ("a", "b")]
+    for f in futures:
+        with pytest.raises(RuntimeError):
+            f.result(timeout=2)
+
+
+def test_query_encoder_caches_normalized_questions():
+    model = FakeModel()
+    encoder = embeddings.QueryEncoder(model)
+    first = encoder.encode("Áo thun  NAM??")
+    assert encoder.encode("áo thun nam") is first
+    assert model.batches == [["áo thun nam"]]
+    assert encoder.stats()["cache"]["hits"] == 1
@@ -0,0 +1,47 @@
+import uuid
+
+import numpy as np
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+
+import exact_search
+import retrieval
+
+CATEGORIES = ["Áo", "Quần", "Váy"]
+
+
+@pytest.fixture
+def collection():
+    rng = np.random.default_rng(7)
+    client = chromadb.EphemeralClient()
+    name = f"test-{uuid.uuid4().hex}"
+    collection = client.create_collection(name)   # mặc định L2 như collection sản phẩm
+    n = 60
+    collection.add(
+        ids=[str(i) for i in range(1, n + 1)],
+        embeddings=rng.normal(size=(n, 8)).astype(np.float32).tolist(),
+        metadatas=[{"category": CATEGORIES[i % 3], "price_value": float(100_000 + 10_000 * i), "stock": i % 4}
+                   for i in range(n)],
+    )
+    yield collection
+    client.delete_collection(name)
+
+
+def test_exact_order_matches_chroma(collection):
+    exact = exact_search.ExactVectorIndex.from_collection(collection.get(include=["embeddings", "metadatas"]))
+    queries = np.random.default_rng(11).normal(size=(5, 8)).astype(np.float32)
+    for constraints in ({}, {"category": "Quần"}, {"min_price": 200_000, "max_price": 500_000}):
+        for vector in queries:
+            chroma = collection.query(query_embeddings=[vector.tolist()], n_results=5,
+                                      where=retrieval.build_where(constraints), include=[])["ids"][0]
+            assert exact.query(vector, 5, constraints) == chroma
+        assert exact.query_batch(queries, 5, constraints) == [exact.query(v, 5, constraints) for v in queries]
+
+
+def test_recall_report_requires_positive_k(collection):
+    queries = np.random.default_rng(3).normal(size=(4, 8)).astype(np.float32)
+    report = exact_search.recall_report(collection, queries, k=3)
+    assert report["queries"] == 4 and report["recall"] == 1.0 and report["misses"] == []
+    with pytest.raises(ValueError):
+        exact_search.recall_report(collection, queries, k=0)
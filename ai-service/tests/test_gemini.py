@@ -0,0 +1,141 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+import gemini
+
+CONTENTS = [{"role": "user", "parts": [{"text": "xin chào"}]}]
+
+
+def _sse(*chunks):
+    return "".join(f"data: {chunk}\n\n" for chunk in chunks).encode("utf-8")
+
+
+def _text(text):
+    return json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]})
+
+
+class FakeGemini:
+    """Server Gemini giả: mỗi lần gọi lấy phản hồi kế tiếp trong danh sách"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def handle(self, request):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    def install(*responses):
+        fake = FakeGemini(*responses)
+        monkeypatch.setattr(gemini, "_client", httpx.AsyncClient(transport=httpx.MockTransport(fake.handle)))
+        return fake
+
+    monkeypatch.setattr(gemini, "breaker", gemini.CircuitBreaker(threshold=2, cooldown=30))
+    monkeypatch.setattr(gemini, "bucket", gemini.TokenBucket(0, 1))
+    monkeypatch.setattr(gemini, "metrics", gemini._UpstreamMetrics())
+    monkeypatch.setattr(gemini, "_semaphore", None)
+    monkeypatch.setattr(gemini, "_backoff", lambda attempt, error: 0)
+    monkeypatch.setattr(gemini, "MAX_RETRIES", 2)
+    return install
+
+
+def _stream():
+    async def collect():
+        return [chunk async for chunk in gemini.stream_generate(CONTENTS, "key")]
+    return asyncio.run(collect())
+
+
+def test_broken_chunk_before_output_is_settled_and_retried(upstream):
+    fake = upstream(
+        httpx.Response(200, content=_sse('{"candidates": [')),
+        httpx.Response(200, content=_sse(_text("Chào"), _text(" bạn"))),
+    )
+    assert _stream() == ["Chào", " bạn"]
+    assert fake.calls == 2
+    assert gemini.metrics.errors == {"bad_response": 1}
+    assert gemini.metrics.ok == 1 and gemini.metrics.retries == 1
+    assert gemini.breaker.state == gemini.CircuitBreaker.CLOSED
+
+
+def test_broken_chunk_after_output_is_not_retried(upstream):
+    fake = upstream(httpx.Response(200, content=_sse(_text("Chào"), '{"candidates": "x"}')))
+    received = []
+
+    async def collect():
+        async for chunk in gemini.stream_generate(CONTENTS, "key"):
+            received.append(chunk)
+
+    with pytest.raises(gemini.GeminiBadResponse):
+        asyncio.run(collect())
+    assert received == ["Chào"]
+    assert fake.calls == 1
+    assert gemini.metrics.errors == {"bad_response": 1}
+    assert gemini.breaker.failures == 1
+
+
+def test_generate_retries_server_errors_only(upstream):
+    fake = upstream(httpx.Response(503, json={}), httpx.Response(200, content=_text("ok").encode()))
+    assert asyncio.run(gemini.generate(CONTENTS, "key")) == "ok"
+    assert fake.calls == 2 and gemini.metrics.errors == {"http_503": 1}
+
+    fake = upstream(httpx.Response(400, json={"error": {"message": "sai request"}}))
+    with pytest.raises(gemini.GeminiError, match="sai request"):
+        asyncio.run(gemini.generate(CONTENTS, "key"))
+    assert fake.calls == 1
+    # Lỗi do request không làm mở mạch
+    assert gemini.breaker.failures == 0
+
+
+def test_circuit_opens_then_probes(upstream, monkeypatch):
+    fake = upstream(*[httpx.Response(500, json={}) for _ in range(3)])
+    with pytest.raises(gemini.GeminiError):
+        asyncio.run(gemini.generate(CONTENTS, "key"))
+    # threshold=2: lần thứ 2 mở mạch, lần thử lại thứ 3 bị từ chối không cần gọi Gemini
+    assert fake.calls == 2
+    assert gemini.breaker.state == gemini.CircuitBreaker.OPEN
+    with pytest.raises(gemini.GeminiUnavailable):
+        asyncio.run(gemini.generate(CONTENTS, "key"))
+    assert gemini.metrics.rejected == 2
+
+    monkeypatch.setattr(gemini.breaker, "opened_at", gemini.breaker.opened_at - 31)
+    fake = upstream(httpx.Response(200, content=_text("đã ổn").encode()))
+    assert asyncio.run(gemini.generate(CONTENTS, "key")) == "đã ổn"
+    assert gemini.breaker.state == gemini.CircuitBreaker.CLOSED
+
+
+def test_deadline_stops_retrying_slow_timeouts(upstream, monkeypatch):
+    timeouts = []
+
+    async def slow(request):
+        timeouts.append(request.extensions["timeout"]["read"])
+        await asyncio.sleep(0.2)
+        raise httpx.ReadTimeout("hết giờ", request=request)
+
+    monkeypatch.setattr(gemini, "_client", httpx.AsyncClient(transport=httpx.MockTransport(slow)))
+    monkeypatch.setattr(gemini, "_backoff", lambda attempt, error: 0.15)
+
+    async def ask():
+        deadline = time.monotonic() + 0.3
+        return "".join([chunk async for chunk in gemini.stream_generate(CONTENTS, "key", deadline=deadline)])
+
+    # Lần 1 hết 0.2s, backoff 0.15s vượt hạn 0.3s -> không thử lại (backend cũng đã bỏ cuộc)
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(ask())
+    assert len(timeouts) == 1 and timeouts[0] <= 0.3
+    assert gemini.metrics.retries == 0 and gemini.metrics.errors == {"timeout": 1}
+
+
+def test_expired_deadline_skips_the_call(upstream):
+    fake = upstream(httpx.Response(200, content=_text("ok").encode()))
+    with pytest.raises(gemini.GeminiUnavailable):
+        asyncio.run(gemini.generate(CONTENTS, "key", deadline=time.monotonic() - 1))
+    assert fake.calls == 0 and gemini.breaker.failures == 0
+    # Không truyền deadline -> như cũ
+    assert asyncio.run(gemini.generate(CONTENTS, "key")) == "ok"
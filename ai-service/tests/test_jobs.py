@@ -0,0 +1,161 @@
+import os
+import asyncio
+import threading
+from functools import partial
+
+import pytest
+
+import jobs
+
+
+def _report(force=False):
+    return {"force": force}
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = jobs.JobScheduler()
+    scheduler.start()
+    yield scheduler
+    scheduler.stop()
+
+
+def _blocked(scheduler, name):
+    """Đăng ký job chạy tới khi release.set() để kiểm tra hành vi khi job đang chạy"""
+    release = threading.Event()
+
+    def run(force=False):
+        release.wait(5)
+        return _report(force)
+
+    scheduler.register(name, run)
+    return release
+
+
+def test_same_arguments_share_the_running_call(scheduler):
+    release = _blocked(scheduler, "report")
+    first = scheduler.trigger("report")
+    # force=False là giá trị mặc định -> cùng 1 lần chạy
+    assert scheduler.trigger("report", force=False) is first
+    assert scheduler.jobs["report"].deduplicated == 1
+    release.set()
+    assert first.result(5) == {"force": False}
+
+
+def test_different_arguments_run_after_the_current_call(scheduler):
+    release = _blocked(scheduler, "report")
+    first = scheduler.trigger("report")
+    queued = scheduler.trigger("report", force=True)
+    assert queued is not first and not queued.done()
+    # Cùng tham số với lần đang xếp hàng -> dùng chung; chạy nền thì dùng lại lần đang chạy
+    assert scheduler.trigger("report", force=True) is queued
+    assert scheduler.kick("report") is first
+    assert scheduler.jobs["report"].status()["queued"] == 1
+
+    waiter = threading.Thread(target=lambda: results.append(scheduler.result("report", refresh=True, force=True)))
+    results = []
+    waiter.start()
+    release.set()
+    waiter.join(5)
+    assert first.result(5) == {"force": False}
+    assert queued.result(5) == {"force": True}
+    # refresh=true chờ lần chạy với đúng tham số của nó, không trả kết quả lần định kỳ
+    assert results[0][0] == {"force": True}
+    assert scheduler.jobs["report"].runs == 2
+
+
+def test_job_that_finishes_instantly_does_not_deadlock(scheduler, monkeypatch):
+    scheduler.register("instant", lambda: 1)
+    submit = scheduler._submit
+
+    def slow_submit(job, kwargs):
+        future = submit(job, kwargs)
+        future.result(5)     # job đã xong trước khi gắn done-callback
+        return future
+
+    monkeypatch.setattr(scheduler, "_submit", slow_submit)
+    done = []
+    caller = threading.Thread(target=lambda: done.append(scheduler.result("instant")), daemon=True)
+    caller.start()
+    caller.join(5)
+    assert not caller.is_alive()
+    assert done[0][0] == 1
+
+
+def test_failed_run_still_starts_queued_call(scheduler):
+    release = threading.Event()
+    calls = []
+
+    def run(fail=True):
+        calls.append(fail)
+        release.wait(5)
+        if fail:
+            raise RuntimeError("MySQL từ chối kết nối")
+        return "ok"
+
+    scheduler.register("flaky", run)
+    first = scheduler.trigger("flaky")
+    queued = scheduler.trigger("flaky", fail=False)
+    release.set()
+    with pytest.raises(RuntimeError):
+        first.result(5)
+    assert queued.result(5) == "ok"
+    assert calls == [True, False]
+    assert scheduler.jobs["flaky"].failures == 1
+
+
+def test_partial_keywords_count_as_defaults():
+    fn = partial(jobs.call_path, "segmentation.build_report", refit=False)
+    assert jobs._call_args(fn, {}) == jobs._call_args(fn, {"refit": False}) == {"refit": False}
+    assert jobs._call_args(fn, {"refit": True}) == {"refit": True}
+
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """2 worker (như serve.py) dùng chung thư mục job: owner chạy job writer, other chỉ đọc/gửi yêu cầu"""
+    monkeypatch.setattr(jobs, "TICK_SECONDS", 0.01)
+    monkeypatch.setattr(jobs, "SHARED_POLL_SECONDS", 0.01)
+    calls = []
+
+    def write(force=False):
+        calls.append(force)
+        return {"force": force, "run": len(calls)}
+
+    started = []
+    for owner in (True, False):
+        scheduler = jobs.JobScheduler()
+        scheduler.share(str(tmp_path), owner=owner)
+        scheduler.register("sync", write, writer=True)
+        scheduler.start()
+        started.append(scheduler)
+    yield (*started, calls)
+    for scheduler in started:
+        scheduler.stop()
+
+
+def test_writer_job_runs_only_on_owner(workers):
+    owner, other, calls = workers
+    with pytest.raises(jobs.JobUnavailable):
+        other.trigger("sync")
+
+    # Chưa có kết quả: worker khác gửi yêu cầu và chờ worker chủ chạy
+    result, meta = other.result("sync")
+    assert result == {"force": False, "run": 1}
+    assert owner.jobs["sync"].runs == 1 and other.jobs["sync"].runs == 0
+
+    # Kết quả đã công bố -> đọc lại không chạy thêm; refresh chờ đúng lần chạy với tham số của mình
+    assert other.result("sync")[0]["run"] == 1
+    result, _ = asyncio.run(other.result_async("sync", refresh=True, force=True))
+    assert result == {"force": True, "run": 2}
+    assert calls == [False, True]
+
+
+def test_writer_job_without_owner_result_is_unavailable(workers, monkeypatch):
+    owner, other, calls = workers
+    owner.stop()
+    monkeypatch.setattr(jobs, "JOB_TIMEOUT", 0.05)
+    with pytest.raises(jobs.JobUnavailable):
+        other.result("sync")
+    assert calls == []
+    # Yêu cầu hết hạn được rút lại, worker chủ khởi động lại không chạy yêu cầu cũ
+    assert not [name for name in os.listdir(other.shared_dir) if jobs.REQUEST_MARK in name]
@@ -0,0 +1,44 @@
+import prompt_budget
+from gemini import estimate_tokens
+
+
+def _product(pid, image="https://cdn.shop.vn/a.jpg"):
+    return {"id": pid, "name": f"Áo thun {pid}", "price": 199000, "category": "Áo", "stock": 3, "image": image}
+
+
+def test_truncate_keeps_short_text_and_cuts_at_a_space():
+    assert prompt_budget.truncate("áo thun", 10) == "áo thun"
+    text = "áo thun cổ tròn màu trắng " * 20
+    cut = prompt_budget.truncate(text, 10)
+    assert cut.endswith("…") and estimate_tokens(cut) <= 11
+    assert text.startswith(cut[:-1])
+
+
+def test_single_product_over_budget_is_truncated():
+    huge = _product(1, image="data:image/png;base64," + "A" * 20000)
+    text, ids, dropped = prompt_budget.render_products([huge, _product(2)], budget=50)
+    # Luôn giữ sản phẩm đầu tiên nhưng cắt còn budget, sản phẩm sau bị bỏ
+    assert ids == [1] and dropped == 1
+    assert estimate_tokens(text) <= 51
+    assert "(ID: 1)" in text and text.endswith("…\n")
+
+
+def test_products_stop_at_budget_and_shown_ones_are_short():
+    products = [_product(i) for i in range(1, 6)]
+    full, ids, dropped = prompt_budget.render_products(products)
+    assert ids == [1, 2, 3, 4, 5] and dropped == 0
+
+    text, ids, dropped = prompt_budget.render_products(products, budget=estimate_tokens(full) // 2)
+    assert 0 < len(ids) < 5 and dropped == 5 - len(ids)
+    shown, _, _ = prompt_budget.render_products(products, shown={1, 2})
+    assert "đã giới thiệu" in shown and estimate_tokens(shown) < estimate_tokens(full)
+
+
+def test_single_long_turn_is_truncated(monkeypatch):
+    monkeypatch.setattr(prompt_budget, "HISTORY_KEEP", 2)
+    monkeypatch.setattr(prompt_budget, "TURN_MAX_TOKENS", 20)
+    reply = "Mẫu này rất hợp ![Áo](https://cdn.shop.vn/" + "x" * 200 + ".jpg) " + "chất cotton thoáng mát " * 30
+    summary, recent = prompt_budget.compact_history([("user", "áo thun"), ("model", reply)])
+    assert summary == ""
+    assert recent[1][1].startswith("Mẫu này rất hợp [ảnh: Áo]")
+    assert estimate_tokens(recent[1][1]) <= 21
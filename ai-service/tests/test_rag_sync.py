@@ -0,0 +1,82 @@
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+
+import rag_sync
+
+
+class FakeEncoder:
+    """Vector = (độ dài mô tả, số khoảng trắng); đếm số tài liệu đã encode"""
+
+    def __init__(self):
+        self.documents = []
+
+    def __call__(self, docs):
+        self.documents.extend(docs)
+        return np.array([[len(d), d.count(" ")] for d in docs], dtype=np.float32)
+
+
+def _product(pid, description="áo cotton", price=199000, stock=5, created=None):
+    return {"id": pid, "name": f"Áo {pid}", "description": description, "price": price, "stock": stock,
+            "category": "Áo", "image": "", "createdAt": created or datetime(2026, 1, pid)}
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    monkeypatch.setattr(rag_sync, "SYNC_BATCH_SIZE", 2)
+    client = chromadb.EphemeralClient()
+    name = f"test-{uuid.uuid4().hex}"
+    yield client.create_collection(name)
+    client.delete_collection(name)
+
+
+def test_incremental_sync_embeds_only_changed_documents(collection):
+    encode = FakeEncoder()
+    products = [_product(i) for i in (1, 2, 3)]
+    report = rag_sync.sync_products(products, collection, encode)
+    assert (report["embedded"], report["skipped"], report["deleted"]) == (3, 0, 0)
+    assert collection.count() == 3
+
+    encode.documents.clear()
+    products = [
+        _product(1),                                   # giữ nguyên
+        _product(2, description="áo cotton dày dặn"),  # đổi mô tả -> encode lại
+        _product(3, price=149000, stock=0),            # đổi giá/tồn kho -> chỉ sửa metadata
+        _product(4),                                   # mới
+    ]
+    report = rag_sync.sync_products(products, collection, encode)
+    assert (report["embedded"], report["metadata_updated"], report["skipped"]) == (2, 1, 1)
+    assert sorted(encode.documents) == sorted([rag_sync.build_document(products[1]),
+                                               rag_sync.build_document(products[3])])
+    meta = collection.get(ids=["3"], include=["metadatas"])["metadatas"][0]
+    assert (meta["price_value"], meta["stock"]) == (149000.0, 0)
+
+    # Sản phẩm không còn trong MySQL bị xoá khỏi Chroma
+    report = rag_sync.sync_products(products[:2], collection, encode)
+    assert report["deleted"] == 2 and sorted(collection.get()["ids"]) == ["1", "2"]
+
+
+def test_new_mode_uses_watermark_and_all_ids(collection):
+    encode = FakeEncoder()
+    rag_sync.sync_products([_product(i) for i in (1, 2)], collection, encode)
+    existing = rag_sync.load_existing(collection)
+    assert rag_sync.get_watermark(existing) == int(datetime(2026, 1, 2).timestamp())
+
+    encode.documents.clear()
+    report = rag_sync.sync_products([_product(5)], collection, encode, mode="new", all_ids=["2", "5"],
+                                    existing_metas=existing)
+    assert (report["embedded"], report["deleted"], report["total"]) == (1, 1, 2)
+    assert sorted(collection.get()["ids"]) == ["2", "5"]
+
+
+def test_full_mode_reembeds_everything_without_clearing(collection):
+    encode = FakeEncoder()
+    products = [_product(i) for i in (1, 2, 3)]
+    rag_sync.sync_products(products, collection, encode)
+    encode.documents.clear()
+    report = rag_sync.sync_products(products, collection, encode, mode="full")
+    assert report["embedded"] == 3 and len(encode.documents) == 3 and collection.count() == 3
@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+
+import db
+import recommend
+
+
+class FakeTables:
+    """UserInteraction + OrderItem JOIN Order trong RAM, trả lời theo id watermark như MySQL"""
+
+    def __init__(self):
+        self.interactions = []   # (id, userId, productId, action)
+        self.items = []          # (id, userId, productId, quantity, status)
+
+    def interact(self, user_id, product_id, action="VIEW"):
+        self.interactions.append((len(self.interactions) + 1, user_id, product_id, action))
+
+    def buy(self, user_id, product_id, quantity=1, status="COMPLETED"):
+        self.items.append((len(self.items) + 1, user_id, product_id, quantity, status))
+
+    def iter_columns(self, sql, params=None, schema=None, chunk_size=db.STREAM_CHUNK):
+        table = self.interactions if "FROM UserInteraction" in sql else self.items
+        rows = [r for r in table if r[0] > params[0]]
+        for i in range(0, len(rows), chunk_size):
+            yield db._to_columns(rows[i:i + chunk_size], schema)
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    table = FakeTables()
+    monkeypatch.setattr(db, "iter_columns", table.iter_columns)
+    monkeypatch.setattr(recommend, "FETCH_CHUNK", 3)
+    return table
+
+
+def _reference(table):
+    """Cosine item-item tính thẳng từ dict, để so với bản dựng từ COO"""
+    weights = {}
+    for _, user, product, action in table.interactions:
+        if action in recommend.ACTION_WEIGHTS:
+            weights[(user, product)] = weights.get((user, product), 0.0) + recommend.ACTION_WEIGHTS[action]
+    for _, user, product, quantity, status in table.items:
+        if status not in recommend.CANCELLED_STATUSES:
+            weights[(user, product)] = weights.get((user, product), 0.0) + recommend.PURCHASE_WEIGHT * max(quantity, 1)
+    vectors = {}
+    for (user, product), w in weights.items():
+        if w > 0:
+            vectors.setdefault(product, {})[user] = np.log1p(w)
+    sims = {}
+    for p, a in vectors.items():
+        for q, b in vectors.items():
+            dot = sum(v * b.get(u, 0.0) for u, v in a.items())
+            if p != q and dot > 0:
+                norm = np.sqrt(sum(v * v for v in a.values()) * sum(v * v for v in b.values()))
+                sims.setdefault(p, {})[q] = dot / norm
+    return weights, sims
+
+
+def _assert_matches(reco, table):
+    weights, sims = _reference(table)
+    assert set(reco.neighbours) == set(sims)
+    for p, neigh in reco.neighbours.items():
+        assert dict(neigh) == pytest.approx(sims[p], abs=1e-3)
+    for (user, product), w in weights.items():
+        assert reco.history(user)[product] == pytest.approx(w)
+
+
+def _seed(tables):
+    tables.interact(1, 10)
+    tables.interact(1, 11, "ADD_TO_CART")
+    tables.interact(2, 10)
+    tables.interact(2, 12)
+    tables.buy(3, 11, 2)
+    tables.buy(3, 12)
+    tables.buy(2, 13, status="CANCELLED")
+
+
+def test_build_matches_dict_reference(tables):
+    _seed(tables)
+    reco = recommend.Recommender()
+    reco.refresh(force=True)
+    _assert_matches(reco, tables)
+    assert 13 not in reco.neighbours
+    assert reco.history(99) == {}
+
+
+def test_incremental_refresh_appends_and_compacts(tables, monkeypatch):
+    monkeypatch.setattr(recommend, "FULL_REBUILD_RATIO", 1.0)
+    _seed(tables)
+    reco = recommend.Recommender()
+    reco.refresh(force=True)
+    # Tương tác lặp lại trên ô đã có, sản phẩm mới, và 1 sản phẩm bị bỏ khỏi giỏ về <= 0
+    tables.interact(1, 10, "ADD_TO_CART")
+    tables.interact(4, 14)
+    tables.interact(4, 10)
+    tables.interact(2, 12, "REMOVE_FROM_CART")
+    reco.refresh(force=True)
+    _assert_matches(reco, tables)
+    assert not reco.last_build["full"]
+    # Các ô trùng đã được cộng dồn: COO chỉ còn 1 dòng cho mỗi cặp (user, sản phẩm)
+    assert reco.stats()["coo_entries"] == len(_reference(tables)[0])
+    assert reco.history(2)[12] == pytest.approx(-1.0)
+
+
+def test_product_without_positive_weight_drops_out(tables):
+    tables.interact(1, 10)
+    tables.interact(1, 11)
+    reco = recommend.Recommender()
+    reco.refresh(force=True)
+    assert reco.similar(10) == [(11, pytest.approx(1.0))]
+    tables.interact(1, 11, "REMOVE_FROM_CART")
+    reco.refresh(force=True)
+    assert reco.similar(10) == []
+    assert 11 not in reco.neighbours
+
+
+def test_ensure_fresh_never_builds_in_request(tables, monkeypatch):
+    _seed(tables)
+    started = []
+
+    class FakeThread:
+        def __init__(self, target, daemon):
+            started.append(target)
+
+        def start(self):
+            pass
+
+    monkeypatch.setattr(recommend.threading, "Thread", FakeThread)
+    reco = recommend.Recommender()
+    reco.ensure_fresh()
+    assert reco.version == 0
+    assert reco.recommend(1) == []
+    reco.ensure_fresh()     # đang cập nhật ở nền -> không mở thêm thread
+    assert len(started) == 1
+    started[0]()
+    assert reco.version == 1
+    assert [p for p, _ in reco.recommend(1)] == [12]
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import retrieval
+
+CATEGORIES = ["Áo", "Quần", "Váy"]
+
+
+@pytest.mark.parametrize("question, expected", [
+    # khoảng giá có đơn vị tiền hoặc từ khoá giá/từ
+    ("quần jeans 200k-300k", {"min_price": 200_000, "max_price": 300_000, "category": "Quần"}),
+    ("váy 200-300k", {"min_price": 200_000, "max_price": 300_000, "category": "Váy"}),
+    ("áo từ 200 đến 300", {"min_price": 200_000, "max_price": 300_000, "category": "Áo"}),
+    ("áo giá 150-250", {"min_price": 150_000, "max_price": 250_000, "category": "Áo"}),
+    ("váy 1tr - 1,5tr", {"min_price": 1_000_000, "max_price": 1_500_000, "category": "Váy"}),
+    ("áo thun dưới 300k", {"max_price": 300_000, "category": "Áo"}),
+    ("quần trên 500.000đ", {"min_price": 500_000, "category": "Quần"}),
+    ("áo khoảng 400k", {"min_price": 320_000, "max_price": 480_000, "category": "Áo"}),
+    # size / tuổi / số đo không phải giá
+    ("áo size 38-40", {"category": "Áo"}),
+    ("áo khoác cho bé 5-7 tuổi", {"category": "Áo"}),
+    ("váy cho bé từ 3 đến 5 tuổi", {"category": "Váy"}),
+    ("quần cho bé dưới 5 tuổi", {"category": "Quần"}),
+    ("quần dài 90-100 cm", {"category": "Quần"}),
+    ("áo size 38-40 dưới 300k", {"max_price": 300_000, "category": "Áo"}),
+    ("áo cho người 50-60kg", {"category": "Áo"}),
+])
+def test_parse_constraints(question, expected):
+    got = retrieval.parse_constraints(question, CATEGORIES)
+    assert got.pop("category", None) == expected.pop("category", None)
+    assert got == pytest.approx(expected)
+
+
+def test_relaxation_keeps_category_before_dropping_everything():
+    constraints = {"min_price": 38_000, "max_price": 40_000, "category": "Áo"}
+    assert retrieval.relaxations(constraints) == [constraints, {"category": "Áo"}, {}]
+    assert retrieval.relaxations({"category": "Áo"}) == [{"category": "Áo"}, {}]
+    assert retrieval.relaxations({}) == [{}]
+
+
+class FakeCollection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def count(self):
+        return len(self.rows)
+
+    def get(self, include=()):
+        ids = [str(r["id"]) for r in self.rows]
+        data = {"ids": ids, "documents": [r["name"] for r in self.rows],
+                "metadatas": [{k: v for k, v in r.items() if k not in ("id", "vector")} for r in self.rows]}
+        if "embeddings" in include:
+            data["embeddings"] = [r["vector"] for r in self.rows]
+        return data
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text):
+        self.calls += 1
+        return np.array([1.0, 0.0], dtype=np.float32)
+
+
+def test_retrieve_relaxes_price_but_keeps_category():
+    rows = [
+        {"id": 1, "name": "áo thun basic", "category": "Áo", "price_value": 500_000.0, "stock": 5, "vector": [1.0, 0.0]},
+        {"id": 2, "name": "quần jeans", "category": "Quần", "price_value": 100_000.0, "stock": 5, "vector": [1.0, 0.1]},
+    ]
+    encoder = FakeEncoder()
+    retriever = retrieval.HybridRetriever(FakeCollection(rows), encoder)
+    products, constraints, _, vector = retriever.retrieve("áo dưới 100k", k=2)
+    assert constraints == {"category": "Áo"}
+    assert [p["id"] for p in products] == ["1"]
+    # Vector câu hỏi được trả kèm cho khoá semantic cache, chỉ encode 1 lần
+    assert vector.tolist() == [1.0, 0.0] and encoder.calls == 1
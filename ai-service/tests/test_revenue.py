@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import db
+import revenue
+
+NOW = datetime(2026, 3, 10, 23, 30)   # UTC; ở UTC+7 đã là ngày 11/03
+
+
+class FakeOrders:
+    """Bảng Order trong RAM, trả lời 2 dạng câu SELECT mà RevenueRollup dùng"""
+
+    def __init__(self):
+        self.rows = {}
+        self.queries = []
+
+    def put(self, order_id, created, amount, status="PENDING", paid="UNPAID"):
+        self.rows[order_id] = (order_id, created, amount, status, paid)
+
+    def iter_columns(self, sql, params=None, schema=None, chunk_size=db.STREAM_CHUNK):
+        self.queries.append((sql, params))
+        if "FROM `Order`" not in sql:
+            return
+        if "id >=" in sql:
+            low, high = params
+            rows = [r for i, r in sorted(self.rows.items()) if low <= i <= high]
+        else:
+            rows = [r for i, r in sorted(self.rows.items()) if i > params[0]]
+        for i in range(0, len(rows), chunk_size):
+            yield db._to_columns(rows[i:i + chunk_size], schema)
+
+
+@pytest.fixture
+def orders(monkeypatch):
+    table = FakeOrders()
+    monkeypatch.setattr(db, "iter_columns", table.iter_columns)
+    monkeypatch.setattr(db, "utc_now", lambda: NOW)
+    monkeypatch.setattr(revenue, "RECHECK_INTERVAL", 0)
+    return table
+
+
+def _day(d):
+    return (NOW - timedelta(days=d)).date()
+
+
+def test_counts_completed_and_paid_orders(orders):
+    orders.put(1, NOW - timedelta(days=1), 100.0, "COMPLETED")
+    orders.put(2, NOW - timedelta(days=1), 50.0, "PENDING", "PAID")
+    orders.put(3, NOW - timedelta(days=1), 70.0, "PROCESSING")
+    rollup = revenue.RevenueRollup()
+    rollup.refresh(force=True)
+    assert rollup.daily[_day(1)] == 150.0
+    assert rollup.monthly[(2026, 3)] == 150.0
+
+
+def test_recent_orders_are_reconciled_in_both_directions(orders):
+    for i, status in enumerate(["COMPLETED", "PENDING", "COMPLETED", "COMPLETED"], start=1):
+        orders.put(i, NOW - timedelta(days=2), 100.0, status)
+    rollup = revenue.RevenueRollup()
+    rollup.refresh(force=True)
+    assert rollup.daily[_day(2)] == 300.0
+
+    orders.put(2, NOW - timedelta(days=2), 100.0, "COMPLETED")    # vừa hoàn thành
+    orders.put(1, NOW - timedelta(days=2), 100.0, "PROCESSING")   # bị chuyển khỏi COMPLETED
+    orders.put(3, NOW - timedelta(days=2), 160.0, "COMPLETED")    # sửa totalAmount
+    del orders.rows[4]                                            # bị xoá
+    version = rollup.version
+    rollup.refresh(force=True)
+    assert rollup.daily[_day(2)] == 260.0
+    assert rollup.monthly[(2026, 3)] == 260.0
+    assert rollup.version == version + 1
+
+
+def test_recheck_window_is_bounded(orders, monkeypatch):
+    monkeypatch.setattr(revenue, "RECHECK_DAYS", 30)
+    orders.put(1, NOW - timedelta(days=90), 100.0, "PENDING")
+    orders.put(2, NOW - timedelta(days=5), 100.0, "PENDING")
+    rollup = revenue.RevenueRollup()
+    rollup.refresh(force=True)
+    assert set(rollup.recent) == {2}
+
+    orders.put(1, NOW - timedelta(days=90), 100.0, "COMPLETED")   # ngoài cửa sổ -> coi như đã chốt
+    orders.put(2, NOW - timedelta(days=5), 100.0, "COMPLETED")
+    orders.queries.clear()
+    rollup.refresh(force=True)
+    assert rollup.daily.get(_day(90), 0.0) == 0.0
+    assert rollup.daily[_day(5)] == 100.0
+    recheck = [params for sql, params in orders.queries if "id >=" in sql]
+    assert recheck == [(2, 2)]
+
+
+def test_orders_leaving_the_window_expire(orders, monkeypatch):
+    orders.put(1, NOW - timedelta(days=29), 100.0, "COMPLETED")
+    rollup = revenue.RevenueRollup()
+    rollup.refresh(force=True)
+    assert set(rollup.recent) == {1}
+    monkeypatch.setattr(db, "utc_now", lambda: NOW + timedelta(days=2))
+    rollup.refresh(force=True)
+    assert rollup.recent == {}
+    assert rollup.daily[_day(29)] == 100.0
+
+
+def test_recheck_only_every_interval(orders, monkeypatch):
+    monkeypatch.setattr(revenue, "RECHECK_INTERVAL", 3600)
+    monkeypatch.setattr(revenue, "REFRESH_INTERVAL", 0)
+    orders.put(1, NOW - timedelta(days=1), 100.0, "PENDING")
+    rollup = revenue.RevenueRollup()
+    rollup.refresh()
+    orders.queries.clear()
+    rollup.refresh()
+    assert [sql for sql, _ in orders.queries if "FROM `Order`" in sql and "id >=" in sql] == []
+
+
+def test_daily_series_ends_at_utc_today(orders):
+    orders.put(1, NOW, 100.0, "COMPLETED")
+    rollup = revenue.RevenueRollup()
+    rollup.refresh(force=True)
+    series = rollup.daily_series(3)
+    assert [d for d, _ in series] == [_day(2), _day(1), NOW.date()]
+    assert series[-1][1] == 100.0
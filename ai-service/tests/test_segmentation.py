@@ -0,0 +1,167 @@
+import pickle
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+from sklearn.cluster import MiniBatchKMeans
+
+import db
+import segmentation
+from segment_table import SegmentTable
+
+NOW = datetime(2026, 3, 10, 12, 0)
+
+
+class FakeOrders:
+    """Bảng Order trong RAM cho các câu SELECT của SegmentationEngine"""
+
+    def __init__(self):
+        self.rows = {}
+        self.queries = []
+
+    def put(self, order_id, user_id, created, amount=100.0, status="COMPLETED"):
+        self.rows[order_id] = (order_id, user_id, status, amount, created)
+
+    def fetch_all(self, sql, params=None):
+        assert "MAX(id)" in sql
+        return [{"max_id": max(self.rows, default=None)}]
+
+    def fetch_columns(self, sql, params=None, schema=None, chunk_size=db.STREAM_CHUNK):
+        rows = [r for r in self.rows.values() if r[2] == "COMPLETED"]
+        if "userId IN" in sql:
+            rows = [r for r in rows if r[1] in params]
+        else:
+            rows = [r for r in rows if r[0] <= params[0]]
+        users = {}
+        for _, user_id, _, amount, created in rows:
+            count, total, last = users.get(user_id, (0, 0.0, created))
+            users[user_id] = (count + 1, total + amount, max(last, created))
+        return db._to_columns([(u, *v) for u, v in sorted(users.items())], schema)
+
+    def iter_columns(self, sql, params=None, schema=None, chunk_size=db.STREAM_CHUNK):
+        self.queries.append((sql, params))
+        rows = [r for _, r in sorted(self.rows.items())]
+        if "createdAt >=" in sql:
+            rows = [r for r in rows if r[0] <= params[0] and r[4] >= params[1]]
+        elif "id >=" in sql:
+            rows = [r for r in rows if params[0] <= r[0] <= params[1]]
+        else:
+            rows = [r for r in rows if r[0] > params[0]]
+        if rows:
+            yield db._to_columns(rows, schema)
+
+
+@pytest.fixture
+def orders(monkeypatch, tmp_path):
+    table = FakeOrders()
+    monkeypatch.setattr(db, "fetch_all", table.fetch_all)
+    monkeypatch.setattr(db, "fetch_columns", table.fetch_columns)
+    monkeypatch.setattr(db, "iter_columns", table.iter_columns)
+    monkeypatch.setattr(db, "utc_now", lambda: NOW)
+    monkeypatch.setattr(segmentation, "MODEL_DIR", str(tmp_path))
+    monkeypatch.setattr(segmentation, "MODEL_PATH", str(tmp_path / "segmentation.joblib"))
+    monkeypatch.setattr(segmentation, "REFRESH_INTERVAL", 0)
+    monkeypatch.setattr(segmentation, "REFIT_RATIO", 100)
+    # 8 khách, mỗi khách 1-3 đơn COMPLETED cách nhau vài tuần
+    order_id = 0
+    for user_id in range(1, 9):
+        for n in range(user_id % 3 + 1):
+            order_id += 1
+            table.put(order_id, user_id, NOW - timedelta(days=7 * user_id + n), 100.0 * user_id)
+    return table
+
+
+def _fitted(table):
+    engine = segmentation.SegmentationEngine()
+    engine.refresh(refit=True)
+    return engine
+
+
+def test_fit_assigns_every_customer(orders):
+    engine = _fitted(orders)
+    assert sorted(engine.assignments.index) == list(range(1, 9))
+    assert engine.snapshot_date == pd.Timestamp(NOW - timedelta(days=7)) + pd.Timedelta(days=1)
+
+
+def _recency(engine):
+    table = engine.table()
+    return dict(zip(table.columns['userId'].tolist(), table.columns['Recency'].tolist()))
+
+
+def test_new_purchase_reclassifies_only_that_customer(orders, monkeypatch):
+    engine = _fitted(orders)
+    before = _recency(engine)
+    clusters = engine.assignments['Cluster'].copy()
+    predicted = []
+    predict = MiniBatchKMeans.predict
+    monkeypatch.setattr(MiniBatchKMeans, "predict", lambda self, X: predicted.append(len(X)) or predict(self, X))
+
+    orders.put(100, 8, NOW + timedelta(days=10))
+    engine.refresh()
+    assert predicted == [1]
+    # Mốc phân cụm giữ nguyên tới lần fit sau; Recency hiển thị tính theo ngày mua mới nhất
+    assert engine.snapshot_date == pd.Timestamp(NOW - timedelta(days=6))
+    assert _recency(engine)[8] == 1   # không bị kẹp về 0
+    assert _recency(engine)[1] == before[1] + 17
+    assert engine.assignments['Cluster'].drop(8).equals(clusters.drop(8))
+    assert engine.assignments['Label'].notna().all()
+
+
+def test_recent_orders_are_rechecked(orders):
+    orders.put(50, 9, NOW - timedelta(days=2), status="PENDING")
+    orders.put(51, 3, NOW - timedelta(days=1))
+    engine = _fitted(orders)
+    assert 9 not in engine.assignments.index
+
+    orders.put(50, 9, NOW - timedelta(days=2), status="COMPLETED")   # vừa hoàn thành
+    engine.refresh()
+    assert engine.assignments.loc[9, 'Frequency'] == 1
+
+    orders.put(50, 9, NOW - timedelta(days=2), status="PROCESSING")  # bị chuyển khỏi COMPLETED
+    del orders.rows[51]                                               # bị xoá
+    frequency = engine.assignments.loc[3, 'Frequency']
+    engine.refresh()
+    assert 9 not in engine.assignments.index
+    assert engine.assignments.loc[3, 'Frequency'] == frequency - 1
+
+
+def test_recheck_window_is_bounded(orders):
+    orders.put(60, 9, NOW - timedelta(days=90), status="PENDING")
+    orders.put(61, 9, NOW - timedelta(days=3), status="PENDING")
+    engine = _fitted(orders)
+    assert 60 not in engine.recent_orders and 61 in engine.recent_orders
+
+    orders.queries.clear()
+    engine.refresh()
+    recheck = [params for sql, params in orders.queries if "id >=" in sql]
+    assert recheck == [(min(engine.recent_orders), 61)]
+
+
+def test_state_survives_save_and_load(orders):
+    engine = _fitted(orders)
+    restored = segmentation.SegmentationEngine()
+    assert restored.load()
+    assert restored.recent_orders == engine.recent_orders
+    assert restored.order_watermark == engine.order_watermark
+
+
+def test_build_report_ships_columns_and_pages_them(orders, monkeypatch):
+    monkeypatch.setattr(segmentation, "engine", segmentation.SegmentationEngine())
+    report = segmentation.build_report(refit=True)
+    assert "details" not in report
+    table = SegmentTable.from_payload(pickle.loads(pickle.dumps(report["assignments"])))
+    assert len(table) == 8
+    assert sum(item["value"] for item in report["chart_data"]) == 8
+
+    everyone, total = table.details(page_size=0)
+    expected = segmentation.engine.assignments.reset_index()
+    expected['Recency'] = (expected['LastPurchaseDate'].max() + pd.Timedelta(days=1) - expected['LastPurchaseDate']).dt.days
+    assert total == 8
+    assert everyone == expected[['userId', 'Label', 'Recency', 'Frequency', 'Monetary']].to_dict(orient='records')
+
+    label = everyone[0]["Label"]
+    page, total = table.details(label, page=1, page_size=1)
+    assert total == sum(1 for row in everyone if row["Label"] == label)
+    assert page == [everyone[0]]
+    assert table.details("không có nhãn này") == ([], 0)
+    assert segmentation.engine.details(label, 1, 1) == (page, total)
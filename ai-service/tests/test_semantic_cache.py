@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from semantic_cache import SemanticCache
+
+VERSIONS = {"1": (100000.0, 5), "2": (250000.0, 0)}
+
+
+def _vector(*values):
+    return np.asarray(values, dtype=np.float32)
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache(maxsize=10, ttl=60, threshold=0.9)
+
+
+def test_similar_question_with_same_products_hits(cache):
+    cache.put(_vector(1, 0, 0), VERSIONS, "trả lời")
+    assert cache.get(_vector(0.95, 0.1, 0), dict(VERSIONS)) == "trả lời"
+    # Khác ý, khác tập sản phẩm hoặc khác lịch sử -> không dùng lại
+    assert cache.get(_vector(0, 1, 0), VERSIONS) is None
+    assert cache.get(_vector(1, 0, 0), {"1": VERSIONS["1"]}) is None
+    assert cache.get(_vector(1, 0, 0), VERSIONS, history_key="khác") is None
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_price_or_stock_change_invalidates_on_lookup(cache):
+    cache.put(_vector(1, 0, 0), VERSIONS, "trả lời")
+    changed = dict(VERSIONS, **{"2": (250000.0, 3)})
+    assert cache.get(_vector(1, 0, 0), changed) is None
+    assert cache.invalidated == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_invalidate_products_drops_stale_entries(cache):
+    cache.put(_vector(1, 0, 0), VERSIONS, "a")
+    cache.put(_vector(0, 1, 0), {"3": (50000.0, 1)}, "b")
+    current = {"1": (90000.0, 5), "2": (250000.0, 0), "3": (50000.0, 1)}
+    assert cache.invalidate_products(current.get) == 1
+    assert cache.get(_vector(0, 1, 0), {"3": (50000.0, 1)}) == "b"
+    # Sản phẩm bị xoá (không còn version) cũng làm mục hết hiệu lực
+    assert cache.invalidate_products({}.get) == 1
+    assert cache.stats()["size"] == 0 and cache.stats()["groups"] == 0
+
+
+def test_expiry_eviction_and_replacement(monkeypatch):
+    import semantic_cache
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: now[0])
+    cache = SemanticCache(maxsize=2, ttl=60, threshold=0.9)
+
+    cache.put(_vector(1, 0, 0), VERSIONS, "cũ")
+    cache.put(_vector(1, 0, 0), VERSIONS, "mới")     # trùng câu hỏi -> thay câu trả lời
+    assert cache.stats()["size"] == 1
+    assert cache.get(_vector(1, 0, 0), VERSIONS) == "mới"
+
+    now[0] += 61
+    assert cache.get(_vector(1, 0, 0), VERSIONS) is None
+    assert cache.stats()["size"] == 0
+
+    for i, pid in enumerate("abc"):
+        cache.put(_vector(1, 0, 0), {pid: (1.0, 1)}, str(i))
+    assert cache.evicted == 1
+    assert cache.get(_vector(1, 0, 0), {"a": (1.0, 1)}) is None
+    assert cache.get(_vector(1, 0, 0), {"c": (1.0, 1)}) == "2"
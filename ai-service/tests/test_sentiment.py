@@ -0,0 +1,98 @@
+import asyncio
+import sqlite3
+import zlib
+
+import pytest
+
+import db
+import sentiment
+
+
+class FakeReviews:
+    """Bảng Review trong RAM; CRC32 giống hàm CRC32() của MySQL trên chuỗi utf8mb4"""
+
+    def __init__(self):
+        self.rows = {}
+
+    def put(self, review_id, content, rating=5, product_id=1):
+        self.rows[review_id] = {"id": review_id, "content": content, "rating": rating, "productId": product_id,
+                                "productName": f"Sản phẩm {product_id}",
+                                "contentHash": zlib.crc32(content.encode("utf-8"))}
+
+    def fetch_all(self, sql, params=None):
+        rows = [r for _, r in sorted(self.rows.items())]
+        if "r.id IN" in sql:
+            ids = set(params[:-1])
+            rows = [r for r in rows if r["id"] in ids]
+        else:
+            rows = [r for r in rows if r["id"] > params[0]]
+        return [dict(r) for r in rows[:params[-1]]]
+
+    def iter_columns(self, sql, params=None, schema=None, chunk_size=db.STREAM_CHUNK):
+        assert sql == sentiment.FINGERPRINT_SQL
+        rows = [(r["id"], r["contentHash"], r["rating"]) for _, r in sorted(self.rows.items())]
+        if rows:
+            yield db._to_columns(rows, schema)
+
+
+@pytest.fixture
+def reviews(monkeypatch):
+    table = FakeReviews()
+    monkeypatch.setattr(db, "fetch_all", table.fetch_all)
+    monkeypatch.setattr(db, "iter_columns", table.iter_columns)
+    calls = []
+
+    async def classify(batch, api_key):
+        calls.append([r["id"] for r in batch])
+        return {r["id"]: sentiment.NEGATIVE if "tệ" in r["content"] else sentiment.POSITIVE for r in batch}
+
+    monkeypatch.setattr(sentiment, "classify", classify)
+    table.calls = calls
+    return table
+
+
+def _run(store):
+    return asyncio.run(sentiment.analyze_new_reviews(store, "key"))
+
+
+def test_only_new_reviews_are_classified(reviews, tmp_path):
+    store = sentiment.SentimentStore(str(tmp_path / "s.sqlite3"))
+    reviews.put(1, "Hàng đẹp")
+    reviews.put(2, "Quá tệ")
+    assert _run(store) == {"ai": 2, "rating": 0, "deleted": 0}
+    assert store.counts() == {sentiment.POSITIVE: 1, sentiment.NEGATIVE: 1}
+    assert _run(store) == {"ai": 0, "rating": 0, "deleted": 0}
+    assert reviews.calls == [[1, 2]]
+
+
+def test_edited_reviews_are_reclassified_and_deleted_removed(reviews, tmp_path):
+    store = sentiment.SentimentStore(str(tmp_path / "s.sqlite3"))
+    for i in range(1, 5):
+        reviews.put(i, "Hàng đẹp")
+    _run(store)
+
+    reviews.put(2, "Dùng 1 tuần thấy quá tệ")   # sửa nội dung
+    reviews.put(3, "Hàng đẹp", rating=1)        # chỉ sửa số sao
+    del reviews.rows[4]                          # bị xoá
+    reviews.put(5, "Hàng đẹp")                   # review mới
+    assert _run(store) == {"ai": 3, "rating": 0, "deleted": 1}
+    assert sorted(reviews.calls[-1]) == [2, 3, 5]
+    assert store.counts() == {sentiment.POSITIVE: 3, sentiment.NEGATIVE: 1}
+    assert 4 not in store.fingerprints()
+    assert _run(store)["ai"] == 0
+
+
+def test_store_from_older_version_is_migrated_without_reclassifying(reviews, tmp_path):
+    path = str(tmp_path / "s.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE review_sentiment (review_id INTEGER PRIMARY KEY, product_id INTEGER,
+                    product_name TEXT, content TEXT, rating INTEGER, sentiment TEXT, source TEXT, classified_at REAL)""")
+    conn.execute("INSERT INTO review_sentiment VALUES (1, 1, 'SP', 'Hàng đẹp', 5, ?, 'ai', 0)", (sentiment.POSITIVE,))
+    conn.commit()
+    conn.close()
+    reviews.put(1, "Hàng đẹp")
+
+    store = sentiment.SentimentStore(path)
+    assert _run(store) == {"ai": 0, "rating": 0, "deleted": 0}
+    assert store.fingerprints() == {1: (reviews.rows[1]["contentHash"], 5)}
+    assert reviews.calls == []
@@ -0,0 +1,19 @@
+import jobs
+import serve
+
+
+def test_only_first_worker_owns_writer_jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_SHARED_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(jobs, "SCHEDULER_ENABLED", True)
+    monkeypatch.setattr(jobs, "scheduler", jobs.JobScheduler())
+
+    serve._configure_worker(0)
+    assert jobs.SCHEDULER_ENABLED and jobs.scheduler.owner
+    assert jobs.scheduler.shared_dir == str(tmp_path / "jobs")
+
+    serve._configure_worker(1)
+    assert not jobs.SCHEDULER_ENABLED and not jobs.scheduler.owner
+    jobs.scheduler.register("sync-rag", lambda: None, writer=True)
+    jobs.scheduler.register("cart-insights", lambda: None)
+    assert jobs.scheduler._remote(jobs.scheduler.jobs["sync-rag"])
+    assert not jobs.scheduler._remote(jobs.scheduler.jobs["cart-insights"])
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import shared_vectors
+
+VECTORS = [[1, 0], [0.9, 0.1], [0, 1], [-1, 0]]
+METAS = [
+    {"category": "Áo", "price_value": 100000.0, "stock": 3},
+    {"category": "Áo", "price_value": 300000.0, "stock": 0},
+    {"category": "Quần", "price_value": 200000.0, "stock": 5},
+    {"category": "Quần", "price_value": 150000.0, "stock": 1},
+]
+
+
+class FakeCollection:
+    def __init__(self, vectors, metas):
+        self.data = {"ids": [str(i + 1) for i in range(len(vectors))], "embeddings": vectors, "metadatas": metas}
+
+    def get(self, include=None):
+        return self.data
+
+
+@pytest.fixture
+def writer(tmp_path):
+    return shared_vectors.SharedVectorIndex(str(tmp_path))
+
+
+def test_other_worker_reads_export_through_mmap(writer, tmp_path):
+    reader = shared_vectors.SharedVectorIndex(str(tmp_path))
+    assert not reader.refresh(force=True) and reader.query([1, 0], 2) == []
+
+    assert writer.export(FakeCollection(VECTORS, METAS)) == 4
+    assert reader.refresh(force=True)
+    assert isinstance(reader._mapped.vectors, np.memmap)
+    assert reader.version == writer.version
+
+    # Sản phẩm 2 hết hàng bị loại; không lọc tồn kho thì xếp theo khoảng cách L2
+    assert reader.query([1, 0], 2) == ["1", "3"]
+    assert reader.query([1, 0], 2, in_stock=False) == ["1", "2"]
+    assert reader.query([1, 0], 3, {"category": "Quần", "max_price": 180000}) == ["4"]
+    assert reader.query([1, 0], 3, {"category": "Không có"}) == []
+
+
+def test_new_export_replaces_old_version(writer, tmp_path):
+    reader = shared_vectors.SharedVectorIndex(str(tmp_path))
+    writer.export(FakeCollection(VECTORS, METAS))
+    reader.refresh(force=True)
+    first = reader.version
+
+    writer.export(FakeCollection(VECTORS[:2], METAS[:2]))
+    assert reader.refresh(force=True) and reader.version != first
+    assert len(reader) == 2 and reader.reloads == 2
+    # Giữ bản hiện tại + 1 bản trước (worker khác có thể còn mmap)
+    assert len([name for name in tmp_path.iterdir() if name.suffix == ".npy"]) == 2
+    assert not reader.refresh(force=True)
@@ -0,0 +1,66 @@
+import re
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+import tracing
+
+
+def _app():
+    app = FastAPI()
+    app.add_middleware(tracing.TraceMiddleware)
+
+    @app.get("/trace-test/{item_id}")
+    def item(item_id: int):
+        with tracing.stage("db"):
+            tracing.size("db", "rows", 42)
+        tracing.record("db", 0.002)        # bước gọi 2 lần -> cộng dồn trong 1 request
+        tracing.size("prompt", "tokens", 1500)
+        return {"id": item_id}
+
+    @app.get("/trace-test-stream")
+    def stream():
+        def body():
+            with tracing.stage("gemini"):
+                yield "a"
+        return StreamingResponse(body())
+
+    @app.get("/metrics")
+    def metrics():
+        return PlainTextResponse(tracing.render())
+
+    return app
+
+
+def _value(text, metric, **labels):
+    pattern = re.escape(metric) + r"\{" + ",".join(
+        f'{k}="{re.escape(str(v))}"' for k, v in labels.items()) + r"\} (\S+)"
+    match = re.search(pattern, text)
+    return None if match is None else float(match.group(1))
+
+
+def test_stage_and_size_metrics_reach_metrics_endpoint():
+    client = TestClient(_app())
+    for item_id in (1, 2):
+        assert client.get(f"/trace-test/{item_id}").json() == {"id": item_id}
+    assert client.get("/trace-test-stream").text == "a"
+    text = client.get("/metrics").text
+
+    # Nhãn endpoint là path template của route, không phải path thật
+    endpoint = "/trace-test/{item_id}"
+    assert _value(text, "ai_request_duration_seconds_count", endpoint=endpoint, method="GET", status=200) == 2
+    assert _value(text, "ai_stage_duration_seconds_count", endpoint=endpoint, stage="db") == 2
+    assert _value(text, "ai_stage_duration_seconds_sum", endpoint=endpoint, stage="db") >= 0.004
+    assert _value(text, "ai_stage_size_sum", endpoint=endpoint, stage="db", unit="rows") == 84
+    assert _value(text, "ai_stage_size_bucket", endpoint=endpoint, stage="prompt", unit="tokens", le=1000) == 0
+    assert _value(text, "ai_stage_size_bucket", endpoint=endpoint, stage="prompt", unit="tokens", le=10000) == 2
+    # Bước chạy trong lúc stream body vẫn thuộc request; /metrics không tự đo chính nó
+    assert _value(text, "ai_stage_duration_seconds_count", endpoint="/trace-test-stream", stage="gemini") == 1
+    assert 'endpoint="/metrics"' not in text
+
+
+def test_background_stages_use_job_label():
+    tracing.bind("job:trace-test", lambda: tracing.record("chroma.query", 0.01))()
+    text = tracing.render()
+    assert _value(text, "ai_stage_duration_seconds_count", endpoint="job:trace-test", stage="chroma.query") == 1
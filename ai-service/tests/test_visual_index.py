@@ -0,0 +1,119 @@
+import base64
+import io
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import visual_index
+
+COLORS = {"red": (255, 0, 0), "green": (0, 255, 0), "blue": (0, 0, 255)}
+
+
+def _save(path, color):
+    Image.new("RGB", (4, 4), COLORS[color]).save(path)
+
+
+class FakeModel:
+    """Vector = màu trung bình đã chuẩn hoá, đủ để ảnh cùng màu gần nhau"""
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, images, batch_size=32, normalize_embeddings=True):
+        self.encoded += len(images)
+        vectors = np.array([np.asarray(image, dtype=np.float32).mean(axis=(0, 1)) for image in images])
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class FakeCollection:
+    def __init__(self):
+        self.items = {}
+
+    def get(self, include=None):
+        return {"ids": list(self.items), "metadatas": [meta for _, meta in self.items.values()]}
+
+    def count(self):
+        return len(self.items)
+
+    def upsert(self, ids, embeddings, metadatas):
+        for pid, vector, meta in zip(ids, embeddings, metadatas):
+            self.items[pid] = (np.asarray(vector), meta)
+
+    def update(self, ids, metadatas):
+        for pid, meta in zip(ids, metadatas):
+            self.items[pid] = (self.items[pid][0], meta)
+
+    def delete(self, ids):
+        for pid in ids:
+            del self.items[pid]
+
+    def query(self, query_embeddings, n_results, include=None):
+        q = np.asarray(query_embeddings[0])
+        ranked = sorted(self.items, key=lambda pid: 1 - float(self.items[pid][0] @ q))[:n_results]
+        return {"ids": [ranked], "metadatas": [[self.items[pid][1] for pid in ranked]],
+                "distances": [[1 - float(self.items[pid][0] @ q) for pid in ranked]]}
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    root = tmp_path / "uploads"
+    root.mkdir()
+    monkeypatch.setattr(visual_index, "IMAGE_UPLOAD_DIR", str(root))
+    for color in COLORS:
+        _save(root / f"{color}.png", color)
+    return root
+
+
+@pytest.fixture
+def index():
+    index = visual_index.VisualIndex(chroma_client=None)
+    index._model = FakeModel()
+    index._collection = FakeCollection()
+    return index
+
+
+def _product(pid, image, price=100000):
+    return {"id": pid, "name": f"SP {pid}", "category": "Áo", "price": price, "image": image}
+
+
+def test_local_images_stay_inside_upload_dir(uploads, tmp_path):
+    assert visual_index.load_product_image("red.png").getpixel((0, 0)) == COLORS["red"]
+    assert visual_index.load_product_image(str(uploads / "blue.png")).getpixel((0, 0)) == COLORS["blue"]
+
+    _save(tmp_path / "secret.png", "green")
+    os.symlink(tmp_path / "secret.png", uploads / "link.png")
+    for src in ("../secret.png", str(tmp_path / "secret.png"), "link.png", "/etc/passwd"):
+        with pytest.raises(ValueError):
+            visual_index.load_product_image(src)
+
+
+def test_data_url_is_decoded():
+    buffer = io.BytesIO()
+    Image.new("RGB", (2, 2), COLORS["green"]).save(buffer, format="PNG")
+    data = "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+    image, mime_type, raw = visual_index.decode_image(data)
+    assert mime_type == "image/png" and raw == data.split(",", 1)[1]
+    assert visual_index.load_product_image(data).getpixel((0, 0)) == COLORS["green"]
+
+
+def test_sync_embeds_only_new_or_changed_images(uploads, index):
+    report = index.sync([_product(1, "red.png"), _product(2, "green.png"), _product(3, "../../etc/passwd"),
+                         _product(4, None)])
+    assert (report["embedded"], report["failed"]) == (2, ["3"])
+    assert index.model.encoded == 2
+
+    # Đổi giá -> chỉ cập nhật metadata; đổi ảnh -> encode lại; sản phẩm không còn -> xoá
+    report = index.sync([_product(1, "red.png", price=90000), _product(2, "blue.png")])
+    assert (report["embedded"], report["metadata_updated"], report["deleted"]) == (1, 1, 0)
+    assert index.model.encoded == 3
+    report = index.sync([_product(2, "blue.png")])
+    assert (report["embedded"], report["skipped"], report["deleted"]) == (0, 1, 1)
+
+
+def test_search_ranks_closest_image_first(uploads, index):
+    index.sync([_product(1, "red.png"), _product(2, "green.png"), _product(3, "blue.png")])
+    results = index.search(visual_index.load_product_image("blue.png"), top_k=2)
+    assert [r["id"] for r in results][0] == 3
+    assert results[0]["score"] == pytest.approx(1.0) and results[0]["image"] == "blue.png"
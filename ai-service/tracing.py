@@ -0,0 +1,241 @@
+# ai_service/tracing.py
+# Đo thời gian từng bước của mỗi request (DB, embedding, Chroma, Gemini, parse JSON, serialize),
+# xuất histogram dạng Prometheus ở /metrics và ghi log các request chậm
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Request lâu hơn ngưỡng này (ms) được in ra kèm thời gian từng bước; 0 = tắt
+SLOW_REQUEST_MS = float(os.getenv("TRACE_SLOW_MS", "0"))
+SLOW_REQUEST_KEEP = int(os.getenv("TRACE_SLOW_KEEP", "50"))
+# Không đo chính endpoint /metrics (Prometheus gọi liên tục)
+SKIP_PATHS = ("/metrics",)
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}     # giá trị label -> [đếm theo bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]}")
+        return lines
+
+
+_histograms = {}
+_gauges = {}
+
+
+def histogram(name, help_text, labels, buckets=TIME_BUCKETS):
+    if name not in _histograms:
+        _histograms[name] = Histogram(name, help_text, labels, buckets)
+    return _histograms[name]
+
+
+def register_gauge(name, help_text, fn):
+    """fn() trả về 1 số hoặc dict {giá trị label: số} (label tên 'name'), đọc lại mỗi lần scrape"""
+    _gauges[name] = (help_text, fn)
+
+
+REQUEST_SECONDS = histogram("ai_request_duration_seconds", "Thời gian xử lý request",
+                            ["endpoint", "method", "status"])
+STAGE_SECONDS = histogram("ai_stage_duration_seconds", "Thời gian từng bước trong request/job",
+                          ["endpoint", "stage"])
+SIZES = histogram("ai_stage_size", "Kích thước theo bước: số dòng DB, byte/token prompt, byte response",
+                  ["endpoint", "stage", "unit"], SIZE_BUCKETS)
+JOB_SECONDS = histogram("ai_job_duration_seconds", "Thời gian chạy job nền", ["job", "outcome"])
+
+
+# ---------- trace của request hiện tại ----------
+
+class Trace:
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.endpoint = path
+        self.started = time.perf_counter()
+        self.stages = {}      # bước -> [tổng giây, số lần]
+        self.sizes = {}       # (bước, đơn vị) -> tổng
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def add_size(self, name, unit, value):
+        with self._lock:
+            self.sizes[(name, unit)] = self.sizes.get((name, unit), 0) + value
+
+    def summary(self, total):
+        return {
+            "method": self.method,
+            "endpoint": self.endpoint,
+            "total_ms": round(total * 1000, 1),
+            "stages_ms": {name: round(s * 1000, 1) for name, (s, _) in
+                          sorted(self.stages.items(), key=lambda kv: kv[1][0], reverse=True)},
+            "calls": {name: n for name, (_, n) in self.stages.items() if n > 1},
+            "sizes": {f"{name}_{unit}": v for (name, unit), v in self.sizes.items()},
+        }
+
+
+_trace = contextvars.ContextVar("ai_trace", default=None)
+# Nhãn endpoint khi không nằm trong request (job nền)
+_label = contextvars.ContextVar("ai_trace_label", default="background")
+_slow = deque(maxlen=SLOW_REQUEST_KEEP)
+
+
+def record(stage_name, seconds):
+    """Ghi thời gian 1 bước; trong request thì gom vào trace, ghi histogram khi request kết thúc"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_stage(stage_name, seconds)
+    else:
+        STAGE_SECONDS.observe(seconds, endpoint=_label.get(), stage=stage_name)
+
+
+def size(stage_name, unit, value):
+    """Ghi kích thước của 1 bước (rows, bytes, tokens)"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add_size(stage_name, unit, value)
+    else:
+        SIZES.observe(value, endpoint=_label.get(), stage=stage_name, unit=unit)
+
+
+@contextmanager
+def stage(stage_name):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage_name, time.perf_counter() - t)
+
+
+def bind(label, fn):
+    """Bọc fn để các bước đo bên trong được gắn nhãn `label` (vd. job:sync-rag) thay vì request gọi nó"""
+    def run(*args, **kwargs):
+        return contextvars.Context().run(_run_labelled, label, fn, args, kwargs)
+    return run
+
+
+def _run_labelled(label, fn, args, kwargs):
+    _label.set(label)
+    return fn(*args, **kwargs)
+
+
+async def bind_async(label, coro):
+    _trace.set(None)
+    _label.set(label)
+    return await coro
+
+
+def _finish(trace, status):
+    total = time.perf_counter() - trace.started
+    REQUEST_SECONDS.observe(total, endpoint=trace.endpoint, method=trace.method, status=status)
+    for name, (seconds, _) in trace.stages.items():
+        STAGE_SECONDS.observe(seconds, endpoint=trace.endpoint, stage=name)
+    for (name, unit), value in trace.sizes.items():
+        SIZES.observe(value, endpoint=trace.endpoint, stage=name, unit=unit)
+    if SLOW_REQUEST_MS and total * 1000 >= SLOW_REQUEST_MS:
+        summary = trace.summary(total)
+        summary["status"] = status
+        summary["at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        _slow.append(summary)
+        print(f">>> [PYTHON] Request chậm: {json.dumps(summary, ensure_ascii=False)}")
+
+
+class TraceMiddleware:
+    """ASGI middleware: mở trace cho mỗi request HTTP, đóng khi đã gửi xong body (kể cả response stream)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in SKIP_PATHS:
+            return await self.app(scope, receive, send)
+
+        trace = Trace(scope["method"], scope["path"])
+        token = _trace.set(trace)
+        state = {"status": 500, "done": False}   # lỗi chưa kịp gửi response -> 500
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["done"] = True
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+            if not state["done"]:
+                state["status"] = 499  # client ngắt kết nối trước khi nhận hết body
+        finally:
+            # Dùng path template của route (/recommendations/{user_id}) để không nổ số lượng label
+            route = scope.get("route")
+            trace.endpoint = getattr(route, "path", None) or "unmatched"
+            _finish(trace, state["status"])
+            _trace.reset(token)
+
+
+def slow_requests():
+    return {"threshold_ms": SLOW_REQUEST_MS, "requests": list(_slow)}
+
+
+def render():
+    """Toàn bộ metrics theo định dạng text của Prometheus"""
+    lines = []
+    for h in list(_histograms.values()):
+        lines.extend(h.render())
+    for name, (help_text, fn) in list(_gauges.items()):
+        try:
+            value = fn()
+        except Exception:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        if isinstance(value, dict):
+            lines += [f'{name}{{name="{_escape(k)}"}} {v}' for k, v in value.items()]
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
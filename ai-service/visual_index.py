@@ -0,0 +1,182 @@
+# ai_service/visual_index.py
+# Chỉ mục vector ảnh sản phẩm (CLIP) để tìm kiếm bằng hình ảnh ngay trên CPU
+import io
+import os
+import time
+import base64
+import hashlib
+import threading
+
+import requests
+from PIL import Image
+
+import tracing
+
+IMAGE_MODEL_NAME = os.getenv("IMAGE_EMBED_MODEL", "clip-ViT-B-32")
+IMAGE_COLLECTION = os.getenv("IMAGE_COLLECTION", "fashion_product_images")
+DOWNLOAD_TIMEOUT = float(os.getenv("IMAGE_DOWNLOAD_TIMEOUT", "10"))
+SYNC_BATCH_SIZE = int(os.getenv("IMAGE_SYNC_BATCH_SIZE", "32"))
+# Cột Product.image là đường dẫn file thì chỉ được đọc trong thư mục ảnh upload này
+IMAGE_UPLOAD_DIR = os.getenv("IMAGE_UPLOAD_DIR", "./uploads")
+
+
+def decode_image(data):
+    """Nhận base64 (có hoặc không có header data:image/...;base64,) -> (PIL.Image, mime_type, base64 thuần)"""
+    mime_type = "image/jpeg"  # mặc định
+    if "," in data:
+        header, data = data.split(",", 1)
+        if "image/png" in header:
+            mime_type = "image/png"
+        elif "image/webp" in header:
+            mime_type = "image/webp"
+        elif "image/gif" in header:
+            mime_type = "image/gif"
+        elif "image/jpeg" in header or "image/jpg" in header:
+            mime_type = "image/jpeg"
+    image = Image.open(io.BytesIO(base64.b64decode(data))).convert("RGB")
+    return image, mime_type, data
+
+
+_http = requests.Session()
+
+
+def upload_path(src, root=None):
+    """
+    Đường dẫn file ảnh trong thư mục upload: tương đối -> tính từ thư mục upload, tuyệt đối -> phải nằm
+    trong đó. Giá trị lấy từ DB nên chặn '../', symlink ra ngoài... (ValueError)
+    """
+    root = os.path.realpath(root or IMAGE_UPLOAD_DIR)
+    path = os.path.realpath(os.path.join(root, src))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Ảnh {src!r} nằm ngoài thư mục upload")
+    return path
+
+
+def load_product_image(src):
+    """Ảnh sản phẩm có thể là URL, data URL base64 hoặc đường dẫn file trong IMAGE_UPLOAD_DIR"""
+    if src.startswith("data:"):
+        return decode_image(src)[0]
+    if src.startswith("http://") or src.startswith("https://"):
+        response = _http.get(src, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        return Image.open(io.BytesIO(response.content)).convert("RGB")
+    return Image.open(upload_path(src)).convert("RGB")
+
+
+class VisualIndex:
+    def __init__(self, chroma_client):
+        self.chroma_client = chroma_client
+        self._model = None
+        self._collection = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        # CLIP chỉ được tải khi thực sự cần (lần sync/tìm kiếm đầu tiên)
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(IMAGE_MODEL_NAME)
+        return self._model
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            self._collection = self.chroma_client.get_or_create_collection(
+                name=IMAGE_COLLECTION, metadata={"hnsw:space": "cosine"}
+            )
+        return self._collection
+
+    def count(self):
+        return self.collection.count()
+
+    def encode(self, images):
+        return self.model.encode(images, batch_size=SYNC_BATCH_SIZE, normalize_embeddings=True)
+
+    def sync(self, products):
+        """Chỉ tải + encode lại ảnh của sản phẩm mới hoặc đổi link ảnh; xoá sản phẩm không còn"""
+        t0 = time.perf_counter()
+        existing = self.collection.get(include=["metadatas"])
+        existing_metas = dict(zip(existing["ids"], existing["metadatas"]))
+
+        to_embed, meta_only, failed = [], [], []
+        skipped = 0
+        for p in products:
+            if not p['image']:
+                continue
+            pid = str(p['id'])
+            meta = {
+                "name": p['name'],
+                "category": p['category'] or "",
+                "price": float(p['price']),
+                "image": p['image'] if not p['image'].startswith("data:") else "",
+                "image_hash": hashlib.sha1(p['image'].encode("utf-8")).hexdigest(),
+            }
+            old = existing_metas.get(pid)
+            if not old or old.get("image_hash") != meta["image_hash"]:
+                to_embed.append((pid, p['image'], meta))
+            elif old != meta:
+                meta_only.append((pid, meta))
+            else:
+                skipped += 1
+
+        embedded = 0
+        embed_time = 0.0
+        for i in range(0, len(to_embed), SYNC_BATCH_SIZE):
+            batch_ids, batch_images, batch_metas = [], [], []
+            for pid, src, meta in to_embed[i:i + SYNC_BATCH_SIZE]:
+                try:
+                    batch_images.append(load_product_image(src))
+                except Exception as e:
+                    print(f">>> [PYTHON] Không tải được ảnh sản phẩm {pid}: {e}")
+                    failed.append(pid)
+                    continue
+                batch_ids.append(pid)
+                batch_metas.append(meta)
+            if not batch_ids:
+                continue
+            t_enc = time.perf_counter()
+            vectors = self.encode(batch_images).tolist()
+            embed_time += time.perf_counter() - t_enc
+            self.collection.upsert(ids=batch_ids, embeddings=vectors, metadatas=batch_metas)
+            embedded += len(batch_ids)
+
+        if meta_only:
+            self.collection.update(ids=[pid for pid, _ in meta_only], metadatas=[m for _, m in meta_only])
+
+        current_ids = {str(p['id']) for p in products if p['image']}
+        removed_ids = [pid for pid in existing_metas if pid not in current_ids]
+        if removed_ids:
+            self.collection.delete(ids=removed_ids)
+
+        return {
+            "embedded": embedded,
+            "metadata_updated": len(meta_only),
+            "skipped": skipped,
+            "deleted": len(removed_ids),
+            "failed": failed,
+            "embed_ms": round(embed_time * 1000, 1),
+            "total_ms": round((time.perf_counter() - t0) * 1000, 1),
+        }
+
+    def search(self, image, top_k=8):
+        """Encode ảnh khách tải lên và tìm top_k sản phẩm có ảnh gần nhất (ANN cosine)"""
+        if self.count() == 0:
+            return []
+        with tracing.stage("clip.encode"):
+            vector = self.encode([image]).tolist()
+        with tracing.stage("chroma.query"):
+            results = self.collection.query(query_embeddings=vector, n_results=top_k,
+                                            include=["metadatas", "distances"])
+        return [
+            {
+                "id": int(pid),
+                "name": meta["name"],
+                "category": meta["category"],
+                "price": meta["price"],
+                "image": meta["image"],
+                "score": round(1 - dist, 4),
+            }
+            for pid, meta, dist in zip(results["ids"][0], results["metadatas"][0], results["distances"][0])
+        ]
@@ -0,0 +1,5 @@
+-- AlterTable
+ALTER TABLE `Product` ADD COLUMN `updatedAt` DATETIME(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3);
+
+-- CreateIndex
+CREATE INDEX `Product_updatedAt_idx` ON `Product`(`updatedAt`);
@@ -37,6 +37,7 @@ export class ChatService {
           .post('http://127.0.0.1:8000/chatbot', {
             question: message,
             history: history,
+            userId: userId ? Number(userId) : null,
           })
           .pipe(timeout(CHATBOT_TIMEOUT_MS)),
       );